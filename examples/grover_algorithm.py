@@ -35,8 +35,9 @@ def grover_algorithm(d, f):
     N = 2**d
     zero_projector = np.zeros((N, N))
     zero_projector[0, 0] = 1
-    Inversion = H_d((2 * qc.Operator.from_matrix(zero_projector) - qc.Identity(d))(H_d))
-    Grover = Inversion(Oracle, qubit_indices=range(d))
+    Reflection = 2 * qc.Operator.from_matrix(zero_projector) - qc.Identity(d)
+    Grover = qc.Circuit(d+1)
+    Grover.add(Oracle).add(H_d, range(d)).add(Reflection, range(d)).add(H_d, range(d))
 
     # Initial state
     state = qc.zeros(d) * qc.ones(1)
@@ -32,7 +32,9 @@ def stage_1(state, U, t, d):
     return state
 
 
-# The t-qubit quantum Fourier transform
+# The t-qubit quantum Fourier transform, built from its circuit.
+# This is equivalent to qc.QFT(t), which applies the transform with
+# a fast Fourier transform instead.
 def QFT(t):
     Op = qc.Identity(t)
     H = qc.Hadamard()
@@ -63,7 +65,7 @@ def QFT(t):
 
 # The t-qubit inverse quantum Fourier transform
 def inv_QFT(t):
-    return QFT(t).adj
+    return qc.InverseQFT(t)
 
 
 # Do phase estimation for a random d-qubit operator,
@@ -1,13 +1,21 @@
 from qcircuits.state import qubit, zeros, ones, bitstring
-from qcircuits.state import positive_superposition, bell_state
+from qcircuits.state import positive_superposition, bell_state, memmap_state
 from qcircuits.state import State
+from qcircuits.state_batch import StateBatch
+from qcircuits.stabilizer import StabilizerState
+from qcircuits.mps import MatrixProductState
+from qcircuits.sparse_state import SparseState
+from qcircuits.product_state import ProductState
 from qcircuits.operators import Identity, PauliX, PauliY, PauliZ
 from qcircuits.operators import Hadamard, Phase, PiBy8, SqrtNot
 from qcircuits.operators import Rotation, RotationX, RotationY, RotationZ
 from qcircuits.operators import CNOT, Toffoli, Swap, SqrtSwap
-from qcircuits.operators import ControlledU, U_f
+from qcircuits.operators import ControlledU, U_f, QFT, InverseQFT
 from qcircuits.operators import Operator
 from qcircuits.density_operator import DensityOperator
+from qcircuits.circuit import Circuit
+from qcircuits.tensors import set_default_dtype, get_default_dtype
+from qcircuits import results, rng
 
 
 __version__ = '0.5.0'
@@ -0,0 +1,380 @@
+"""
+The circuit module contains the Circuit class, instances of which
+record a sequence of operators applied to the qubits of a multi-qubit
+system, and apply them only when the circuit is applied to a state.
+
+The Circuit class is aliased at the top-level module, so that one can
+call ``qcircuits.Circuit()`` instead of ``qcircuits.circuit.Circuit()``.
+"""
+
+
+from collections import OrderedDict
+
+import numpy as np
+
+from qcircuits.operators import OperatorBase, Operator, Identity
+from qcircuits.operators import _check_qubit_indices, _check_out, _qubit_axes
+from qcircuits.operators import _output_tensor
+from qcircuits.density_operator import DensityOperator
+from qcircuits.stabilizer import StabilizerState
+from qcircuits.mps import MatrixProductState
+from qcircuits.sparse_state import SparseState
+from qcircuits.product_state import ProductState
+from qcircuits.kernels import apply_kernel, _needs_renormalization
+
+
+def _merge_steps(steps):
+    # Compose a sequence of circuit steps into a single step acting on
+    # the union of their qubits, in ascending order
+    if len(steps) == 1:
+        return steps[0]
+
+    qubits = sorted(set(i for _, qubit_indices in steps for i in qubit_indices))
+    position = {q: k for k, q in enumerate(qubits)}
+    dtype = np.result_type(*(op.dtype for op, _ in steps))
+
+    U = Identity(len(qubits)).astype(dtype)
+    for op, qubit_indices in steps:
+        op(U, [position[i] for i in qubit_indices], inplace=True)
+
+    return U, tuple(qubits)
+
+
+class Circuit:
+    """
+    A quantum circuit for a `d`-qubit system, recorded as a sequence of
+    steps, each an operator and the qubits it is applied to.
+
+    Building a circuit does not apply any operators. When the circuit
+    is applied to a :py:class:`.State` or :py:class:`.DensityOperator`,
+    the operators are applied in sequence to a single copy of the
+    argument, so no multi-qubit operator for the whole circuit is ever
+    produced.
+
+    Parameters
+    ----------
+    d : int
+        The number of qubits of the system the circuit acts on.
+    """
+
+    def __init__(self, d):
+        if d < 1:
+            raise ValueError('A circuit must act on at least one qubit.')
+
+        self.d = d
+        self._steps = []
+
+    def __repr__(self):
+        return 'Circuit(d={}, steps={})'.format(self.d, len(self))
+
+    def __len__(self):
+        return len(self._steps)
+
+    @property
+    def steps(self):
+        """
+        Get the steps of the circuit.
+
+        Returns
+        -------
+        list of (Operator, tuple of int)
+            Each operator in the circuit, in order of application,
+            with the indices of the qubits it is applied to.
+        """
+
+        return list(self._steps)
+
+    def add(self, op, qubit_indices=None):
+        """
+        Append an operator, or all the steps of another circuit, to the
+        circuit. This method modifies the circuit in-place, but also
+        returns the circuit to allow chaining of operations.
+
+        Parameters
+        ----------
+        op : Operator or Circuit
+            The operator or circuit to be appended.
+        qubit_indices : list of int
+            The indices of the qubits of this circuit that the operator
+            or circuit is applied to. May be omitted if the operator or
+            circuit acts on all the qubits of this circuit.
+
+        Returns
+        -------
+        Circuit
+            The resulting circuit.
+        """
+
+        if isinstance(op, Circuit):
+            qubit_indices = _check_qubit_indices(qubit_indices, op.d, self.d)
+            for sub_op, sub_indices in op._steps:
+                self._steps.append(
+                    (sub_op, tuple(qubit_indices[i] for i in sub_indices))
+                )
+        elif isinstance(op, Operator):
+            qubit_indices = _check_qubit_indices(qubit_indices, op.rank // 2, self.d)
+            self._steps.append((op, tuple(int(i) for i in qubit_indices)))
+        else:
+            raise TypeError('Only operators and circuits can be added to a circuit.')
+
+        return self
+
+    @property
+    def adj(self):
+        """
+        Get the adjoint of this circuit, i.e., the circuit applying the
+        adjoint of each operator in reverse order. If the operators are
+        unitary, this is the inverse of the circuit.
+
+        Returns
+        -------
+        Circuit
+            The adjoint circuit.
+        """
+
+        circuit = Circuit(self.d)
+        circuit._steps = [(op.adj, qubit_indices)
+                          for op, qubit_indices in reversed(self._steps)]
+        return circuit
+
+    def fuse(self, max_width=2):
+        """
+        Produce an equivalent circuit in which runs of operators acting
+        on at most `max_width` qubits in total are merged into a single
+        operator, so that the state is swept once per merged operator
+        rather than once per original operator.
+
+        Operators acting on disjoint qubits are merged if the merged
+        operator is no wider than `max_width`. Operators that are
+        already wider than `max_width` are kept as they are, and so
+        are operators that are not merged with any other, which keeps
+        their structure (e.g., diagonal or permutation).
+
+        Parameters
+        ----------
+        max_width : int
+            The maximum number of qubits a merged operator acts on.
+
+        Returns
+        -------
+        Circuit
+            The fused circuit.
+        """
+
+        if max_width < 1:
+            raise ValueError('The maximum fused width must be at least 1.')
+
+        fused = Circuit(self.d)
+        # Groups of steps that may still be extended, as pairs of the
+        # set of qubits the group acts on and its steps. Open groups
+        # always act on disjoint qubits, so they commute with each other
+        # and can be emitted in any order.
+        open_groups = []
+
+        for step in self._steps:
+            qubits = set(step[1])
+            overlapping = [g for g in open_groups if g[0] & qubits]
+            rest = [g for g in open_groups if not g[0] & qubits]
+            merged_qubits = qubits.union(*(g[0] for g in overlapping))
+
+            if len(merged_qubits) <= max_width:
+                steps = [s for g in overlapping for s in g[1]]
+                open_groups = rest + [(merged_qubits, steps + [step])]
+            else:
+                for g in overlapping:
+                    fused._steps.append(_merge_steps(g[1]))
+                open_groups = rest + [(qubits, [step])]
+
+        for g in open_groups:
+            fused._steps.append(_merge_steps(g[1]))
+
+        return fused
+
+    def to_operator(self):
+        """
+        Produce the dense operator equivalent to the circuit.
+
+        Returns
+        -------
+        Operator
+            A rank `2d` tensor describing the circuit.
+        """
+
+        return self(Identity(self.d))
+
+    def __call__(self, arg, inplace=False, out=None):
+        """
+        Apply the circuit to a :py:class:`.State` or
+        :py:class:`.DensityOperator`, or compose it with an
+        :py:class:`.Operator`.
+
+        Parameters
+        ----------
+        arg : State, Operator, DensityOperator, or other state
+            The `d`-qubit state or operator the circuit is applied to.
+            The other states are :py:class:`.StateBatch`,
+            :py:class:`.StabilizerState`, :py:class:`.MatrixProductState`,
+            :py:class:`.SparseState` and :py:class:`.ProductState`.
+        inplace : bool
+            If true, modify the argument in-place and return it.
+        out : same type as `arg`
+            If supplied, an object of the same type and shape as the
+            argument, into which the result is written.
+
+        Returns
+        -------
+        same type as `arg`
+            The result of applying the circuit to the argument.
+        """
+
+        return CompiledCircuit(self)(arg, inplace=inplace, out=out)
+
+    def compile(self, max_width=2):
+        """
+        Produce a :py:class:`.CompiledCircuit` for this circuit, to be
+        applied to many states.
+
+        The circuit is fused (see :py:meth:`fuse`) and the kernel and
+        tensor axes of each of its operators are resolved once. Compiled
+        circuits are cached by the structure of the circuit, i.e., the
+        type and a hash of the data of each of its operators' kernels,
+        and the qubits they are applied to, so compiling an unchanged
+        circuit again, or another circuit built in the same way, e.g.,
+        from fresh calls to the same factory functions, returns the
+        cached result.
+
+        Parameters
+        ----------
+        max_width : int
+            The maximum number of qubits a fused operator acts on. If
+            None, operators are not fused.
+
+        Returns
+        -------
+        CompiledCircuit
+            The compiled circuit.
+        """
+
+        key = (self.d, max_width,
+               tuple((op._get_kernel().fingerprint(), qubit_indices)
+                     for op, qubit_indices in self._steps))
+
+        compiled = _compile_cache.pop(key, None)
+        if compiled is None:
+            circuit = self if max_width is None else self.fuse(max_width)
+            compiled = CompiledCircuit(circuit)
+
+        # Most recently used entries are at the end
+        _compile_cache[key] = compiled
+        if len(_compile_cache) > _compile_cache_size:
+            _compile_cache.popitem(last=False)
+
+        return compiled
+
+
+# Compiled circuits, keyed by circuit structure, in least recently used order
+_compile_cache = OrderedDict()
+_compile_cache_size = 64
+
+
+class CompiledCircuit:
+    """
+    A circuit with the kernel and tensor axes of each of its operators
+    resolved, so that it can be applied to many states without any
+    per-operator validation or planning. Produced by
+    :py:meth:`.Circuit.compile`.
+
+    Parameters
+    ----------
+    circuit : Circuit
+        The circuit to be compiled.
+    """
+
+    def __init__(self, circuit):
+        self.d = circuit.d
+        self._steps = circuit.steps
+        self._kernels = [(op._get_kernel(), qubit_indices)
+                         for op, qubit_indices in self._steps]
+        self._conjugates = None
+        self._unitary = all(kernel.unitary for kernel, _ in self._kernels)
+
+    @property
+    def _conjugate_kernels(self):
+        # The complex conjugate of each kernel, for density operators,
+        # resolved when the circuit is first applied to one
+        if self._conjugates is None:
+            self._conjugates = [kernel.conjugated() for kernel, _ in self._kernels]
+        return self._conjugates
+
+    def __repr__(self):
+        return 'CompiledCircuit(d={}, steps={})'.format(self.d, len(self))
+
+    def __len__(self):
+        return len(self._steps)
+
+    def __call__(self, arg, inplace=False, out=None):
+        """
+        Apply the compiled circuit to a :py:class:`.State` or
+        :py:class:`.DensityOperator`, or compose it with an
+        :py:class:`.Operator`.
+
+        Parameters
+        ----------
+        arg : State, Operator, DensityOperator, or other state
+            The `d`-qubit state or operator the circuit is applied to.
+            The other states are :py:class:`.StateBatch`,
+            :py:class:`.StabilizerState`, :py:class:`.MatrixProductState`,
+            :py:class:`.SparseState` and :py:class:`.ProductState`.
+        inplace : bool
+            If true, modify the argument in-place and return it.
+        out : same type as `arg`
+            If supplied, an object of the same type and shape as the
+            argument, into which the result is written.
+
+        Returns
+        -------
+        same type as `arg`
+            The result of applying the circuit to the argument.
+        """
+
+        d, offset, stride = _qubit_axes(arg)
+        if d != self.d:
+            raise ValueError('The circuit is for a {}-qubit system, but the argument '
+                             'is for a {}-qubit system.'.format(self.d, d))
+
+        out = _check_out(arg, inplace, out)
+        if isinstance(arg, (StabilizerState, MatrixProductState, SparseState,
+                            ProductState)):
+            out = arg._copy_into(out)
+            for kernel, qubit_indices in self._kernels:
+                out._apply_kernel(kernel, list(qubit_indices))
+            return out
+
+        t = _output_tensor(arg, out)
+        if out is None:
+            out = arg.__class__(t, copy=False, dtype=arg.dtype)
+
+        if isinstance(arg, DensityOperator):
+            # rho -> U rho U^†, applying the complex conjugate of U to
+            # the column indices
+            for (kernel, qubit_indices), conjugate in zip(self._kernels,
+                                                          self._conjugate_kernels):
+                apply_kernel(kernel, t, [2*i for i in qubit_indices])
+                apply_kernel(conjugate, t, [2*i + 1 for i in qubit_indices])
+            out._t = t
+            return out
+
+        for kernel, qubit_indices in self._kernels:
+            apply_kernel(kernel, t, [offset + stride*i for i in qubit_indices])
+        # Setting the tensor discards any structure an operator had
+        out._t = t
+
+        # Renormalizing once at the end is equivalent to renormalizing
+        # after each step, as the operators are linear. It is not needed
+        # at all if every operator is unitary and the state is in double
+        # precision.
+        if (not isinstance(arg, OperatorBase) and
+                _needs_renormalization(self._unitary, out.dtype)):
+            out.renormalize_()
+
+        return out
@@ -14,6 +14,7 @@ aliased at the top-level module, so that one can call
 import numpy as np
 
 from qcircuits.operators import OperatorBase
+from qcircuits.rng import resolve_rng, _choice
 
 
 class DensityOperator(OperatorBase):
@@ -25,10 +26,15 @@ class DensityOperator(OperatorBase):
     ----------
     tensor : numpy complex128 multidimensional array
         The tensor representing the operator.
+    copy : bool
+        If false, use a tensor of the right dtype directly rather than copying it.
+    dtype : numpy dtype
+        The precision of the tensor, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
     """
 
-    def __init__(self, tensor):
-        super().__init__(tensor)
+    def __init__(self, tensor, copy=True, dtype=None):
+        super().__init__(tensor, copy=copy, dtype=dtype)
         # TODO check positive, trace 1 (maybe only check when applying/measuring?)
 
     def __repr__(self):
@@ -88,14 +94,17 @@ class DensityOperator(OperatorBase):
             outer_product = DensityOperator._tensor_from_state_outer_product(s)
 
             if t is None:
-                t = p * outer_product
+                t = float(p) * outer_product
                 shape = t.shape
             else:
                 if outer_product.shape != shape:
                     raise ValueError('Pure state dimensionalities do not match.')
-                t += p * outer_product
+                t += float(p) * outer_product
 
-        return DensityOperator(t)
+        # The outer products are transposed views, so lay out the sum in
+        # C order for operator application
+        t = np.ascontiguousarray(t)
+        return DensityOperator(t, copy=False, dtype=t.dtype)
 
     @staticmethod
     def _tensor_from_state_outer_product(state):
@@ -117,10 +126,11 @@ class DensityOperator(OperatorBase):
         for _ in range(len(unmeasured_indices)):
             t = np.sum(t[[0, 1], [0, 1], ...], axis=0)
 
-        ps = np.real(np.diag(OperatorBase._tensor_to_matrix(t)))
+        ps = np.real(np.diag(OperatorBase._tensor_to_matrix(t))).astype(np.float64)
+        ps /= np.sum(ps)
         return ps, unmeasured_indices
 
-    def measure(self, qubit_indices=None, remove=False):
+    def measure(self, qubit_indices=None, remove=False, rng=None):
         """
         Measure the state with respect to the computational bases
         of the qubits indicated by `qubit_indices`.
@@ -137,6 +147,10 @@ class DensityOperator(OperatorBase):
         remove : bool
             Indicates whether the measured qubits should be removed from
             the density operator.
+        rng : None, int, numpy.random.Generator, or numpy.random.RandomState
+            The random number generator, or a seed for one, to draw the
+            outcome with. If not given, numpy's global random state is
+            used. See :py:mod:`qcircuits.rng`.
 
         Returns
         -------
@@ -177,8 +191,7 @@ class DensityOperator(OperatorBase):
         # Get measurement outcome probabilities
         ps, unmeasured_indices = self._measurement_probabilites(qubit_indices)
 
-        num_outcomes = 2**len(qubit_indices)
-        outcome = np.random.choice(num_outcomes, p=ps)
+        outcome = _choice(resolve_rng(rng), ps)
         bits = tuple(
             [outcome >> i & 1 for i in range(len(qubit_indices)-1, -1, -1)]
         )
@@ -188,13 +201,13 @@ class DensityOperator(OperatorBase):
         t = self._permuted_tensor(permute)
         idx = tuple(np.repeat(bits, 2))
         # Index in and renormalize
-        self._t = t[idx] / ps[outcome]
+        self._t = t[idx] / float(ps[outcome])
 
         # If the measured qubits are not to be removed from the state
         # then insert them back in
         if not remove:
             measured_t = DensityOperator._tensor_from_state_outer_product(
-                bitstring(*bits)
+                bitstring(*bits, dtype=self.dtype)
             )
             self._t = np.tensordot(measured_t, self._t, axes=0)
             self.permute_qubits(permute, inverse=True)
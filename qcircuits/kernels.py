@@ -0,0 +1,1026 @@
+"""
+The kernels module contains the routines used to apply operators to the
+tensors of states and operators.
+
+A kernel wraps some representation of an operator for a `d`-qubit
+system and knows how to apply it, in-place, to `d` chosen axes of a
+larger tensor. The axes of the target tensor need not be contiguous or
+in order, and the tensor may have further axes (of any size) that the
+kernel leaves untouched. Kernels work on arbitrary strided numpy views,
+so they can be applied to a slice of a larger tensor.
+
+Kernels never change the precision of the tensor they are applied to:
+the operator's data is converted to the dtype of the target tensor
+(and cached) before it is applied.
+
+This module is used internally by :py:class:`.Operator`, and is not
+aliased at the top-level module.
+"""
+
+
+from itertools import product
+import hashlib
+
+import numpy as np
+
+
+def tensor_from_matrix(M):
+    """
+    Convert the matrix Kronecker-product representation of a `d`-qubit
+    operator to a rank `2d` tensor with interleaved lower and upper
+    indices.
+    """
+
+    d = int(np.log2(M.shape[0]))
+    permutation = [0] * 2 * d
+    permutation[::2] = range(0, d)
+    permutation[1::2] = range(d, 2*d)
+
+    return M.reshape([2] * 2 * d).transpose(permutation)
+
+
+def matrix_from_tensor(t):
+    """
+    Convert a rank `2d` operator tensor with interleaved lower and upper
+    indices to its matrix Kronecker-product representation.
+    """
+
+    d = len(t.shape) // 2
+    permutation = list(range(0, 2*d, 2)) + list(range(1, 2*d, 2))
+    return t.transpose(permutation).reshape(2**d, 2**d)
+
+
+# The number of elements of each block that kernels are applied to, for
+# tensors that are memory-mapped files. 2**22 complex128 elements is 64 MiB.
+out_of_core_block_size = 2**22
+
+
+def _is_memory_mapped(t):
+    # Whether an array is a numpy.memmap, or a view of one
+    while isinstance(t, np.ndarray):
+        if isinstance(t, np.memmap):
+            return True
+        t = t.base
+    return False
+
+
+def _needs_renormalization(unitary, dtype):
+    # Whether a state should be renormalized after applying operators to
+    # it. Unitary operators preserve the norm up to rounding, but in
+    # reduced precision the rounding errors of many operators add up to
+    # more than the unit-norm tolerance, so such states are renormalized
+    # regardless.
+    return not unitary or np.finfo(dtype).eps > np.finfo(np.float64).eps
+
+
+def apply_kernel(kernel, t, axes):
+    """
+    Apply a kernel in-place to the axes `axes` of tensor `t`. If `t` is
+    a memory-mapped file, the kernel is applied to one block of the
+    tensor at a time (see :py:func:`apply_blocked`), so that the
+    temporary arrays of the kernel are no larger than a block and the
+    file is streamed through memory.
+
+    Parameters
+    ----------
+    kernel : Kernel
+        The kernel.
+    t : numpy multidimensional array
+        The tensor to be modified. May be a view.
+    axes : list of int
+        The axes of `t` the operator is applied to.
+    """
+
+    if _is_memory_mapped(t):
+        apply_blocked(kernel, t, axes, out_of_core_block_size)
+    else:
+        kernel.apply(t, axes)
+
+
+def apply_blocked(kernel, t, axes, block_size):
+    """
+    Apply a kernel in-place to the axes `axes` of tensor `t`, one block
+    of at most `block_size` elements at a time (or as small as possible,
+    if the kernel's axes alone are larger than that). Blocks are taken by
+    fixing the leading axes that the kernel does not act on, so for a
+    kernel that does not act on the first qubits, each block is a
+    contiguous part of a C-contiguous tensor.
+
+    Parameters
+    ----------
+    kernel : Kernel
+        The kernel.
+    t : numpy multidimensional array
+        The tensor to be modified. May be a view.
+    axes : list of int
+        The axes of `t` the operator is applied to.
+    block_size : int
+        The maximum number of elements of each block.
+    """
+
+    axes = list(axes)
+    split_axes, indices = _blocks(t.shape, axes, block_size)
+
+    # The kernel's axes, renumbered for the fixed axes being removed
+    block_axes = [a - sum(s < a for s in split_axes) for a in axes]
+
+    for idx in indices:
+        kernel.apply(t[idx], block_axes)
+
+
+def _blocks(shape, axes, block_size):
+    # The blocks of at most `block_size` elements (or as small as possible)
+    # of a tensor of shape `shape` that contain all of the axes `axes`,
+    # taken by fixing as many leading axes not in `axes` as needed. Returns
+    # the fixed axes, and an iterator over the index of each block, in the
+    # C order of the tensor.
+    split_axes = []
+    size = int(np.prod(shape, dtype=np.int64))
+    for axis in range(len(shape)):
+        if size <= block_size:
+            break
+        if axis not in axes:
+            split_axes.append(axis)
+            size //= shape[axis]
+
+    def indices():
+        for index in product(*(range(shape[a]) for a in split_axes)):
+            idx = [slice(None)] * len(shape)
+            for axis, i in zip(split_axes, index):
+                idx[axis] = i
+            yield tuple(idx)
+
+    return split_axes, indices()
+
+
+def _adjoint_permutation(d):
+    # The transposition of a rank 2d operator tensor swapping each
+    # qubit's lower and upper indices
+    permutation = [0] * 2 * d
+    permutation[::2] = range(1, 2*d, 2)
+    permutation[1::2] = range(0, 2*d, 2)
+    return permutation
+
+
+def _fingerprint_value(value):
+    # A hashable description of an attribute of a kernel
+    if isinstance(value, Kernel):
+        return value.fingerprint()
+    if isinstance(value, np.ndarray):
+        digest = hashlib.sha1(np.ascontiguousarray(value).tobytes()).hexdigest()
+        return (value.shape, value.dtype.str, digest)
+    if isinstance(value, (list, tuple)):
+        return tuple(_fingerprint_value(v) for v in value)
+    return value
+
+
+class Kernel:
+    """
+    Base class for operator application kernels.
+
+    Parameters
+    ----------
+    d : int
+        The number of qubits the kernel acts on.
+    dtype : numpy dtype
+        The precision of the kernel's data.
+    """
+
+    # Whether the operator is stored sparsely, in which case its
+    # compositions, adjoint and tensor products with other sparse
+    # kernels are computed in coordinate format, without densifying.
+    sparse = False
+
+    # Dense operators on more qubits than this are not checked for being
+    # unitary, as the check takes O(8^d) time
+    max_unitary_check_qubits = 6
+
+    def __init__(self, d, dtype):
+        self.d = d
+        self.dtype = np.dtype(dtype)
+        self._cast_cache = {}
+        self._unitary = None
+        self._fingerprint = None
+
+    def _cast(self, name, dtype):
+        # The array attribute `name` in the given precision
+        key = (name, dtype)
+        if key not in self._cast_cache:
+            self._cast_cache[key] = getattr(self, name).astype(dtype, copy=False)
+        return self._cast_cache[key]
+
+    @property
+    def unitary(self):
+        """
+        Get whether the operator is known to be unitary, in which case
+        applying it preserves the norm of a state, so the state need not
+        be renormalized. This is checked once, when first asked for.
+
+        Returns
+        -------
+        bool
+            Whether the operator is unitary, to within rounding error.
+        """
+
+        if self._unitary is None:
+            self._unitary = bool(self._is_unitary())
+        return self._unitary
+
+    def fingerprint(self):
+        """
+        Get a hashable description of the operator, made of the type of
+        the kernel and a hash of each of its (public) attributes, so
+        that kernels of the same type holding equal data have equal
+        fingerprints. It is computed once, when first asked for, as the
+        data of a kernel is never modified.
+
+        Returns
+        -------
+        tuple
+            The fingerprint.
+        """
+
+        if self._fingerprint is None:
+            self._fingerprint = (type(self).__name__,) + tuple(
+                (name, _fingerprint_value(value))
+                for name, value in sorted(vars(self).items()) if not name.startswith('_'))
+        return self._fingerprint
+
+    def _tolerance(self):
+        return 1e-10 if self.dtype == np.complex128 else 1e-5
+
+    def _is_unitary(self):
+        if self.d > self.max_unitary_check_qubits:
+            return False
+        M = matrix_from_tensor(self.to_tensor())
+        return np.allclose(M.dot(np.conj(M.T)), np.eye(2**self.d), atol=self._tolerance())
+
+    def apply(self, t, axes):
+        """
+        Apply the operator in-place to the axes `axes` of tensor `t`.
+
+        Parameters
+        ----------
+        t : numpy multidimensional array
+            The tensor to be modified. May be a view.
+        axes : list of int
+            The axes of `t` the operator is applied to, in the order
+            of the operator's qubits.
+        """
+
+        raise NotImplementedError
+
+    def to_tensor(self):
+        """
+        Produce the dense rank `2d` tensor of the operator.
+
+        Returns
+        -------
+        numpy complex128 multidimensional array
+            The operator tensor, with lower and upper indices interleaved.
+        """
+
+        raise NotImplementedError
+
+    def astype(self, dtype):
+        """
+        Produce a kernel for the same operator with data of another
+        precision.
+
+        Parameters
+        ----------
+        dtype : numpy dtype
+            The precision.
+
+        Returns
+        -------
+        Kernel
+            The converted kernel.
+        """
+
+        return DenseKernel(self.to_tensor().astype(dtype))
+
+    def scaled(self, scalar):
+        """
+        Produce a kernel for the operator multiplied by a scalar.
+
+        Parameters
+        ----------
+        scalar : complex
+            The scalar multiplier.
+
+        Returns
+        -------
+        Kernel
+            The kernel for the scaled operator.
+        """
+
+        if self.sparse:
+            rows, cols, values = self.to_coo()
+            return kernel_from_coo(rows, cols, self.dtype.type(scalar) * values, self.d)
+        return DenseKernel(self.dtype.type(scalar) * self.to_tensor())
+
+    def adjoint(self):
+        """
+        Produce a kernel for the adjoint of the operator.
+
+        Returns
+        -------
+        Kernel
+            The kernel for the adjoint.
+        """
+
+        return DenseKernel(self.to_tensor(), conjugate=True, transpose=True)
+
+    def conjugated(self):
+        """
+        Produce a kernel for the complex conjugate of the operator
+        (not its adjoint), e.g., to apply :math:`U^{\\dagger}` from the
+        right to the column indices of a density operator.
+
+        Returns
+        -------
+        Kernel
+            The kernel for the complex conjugate.
+        """
+
+        return DenseKernel(self.to_tensor(), conjugate=True)
+
+    def to_coo(self):
+        """
+        Produce the nonzero entries of the operator's matrix, in
+        coordinate format.
+
+        Returns
+        -------
+        (numpy int array, numpy int array, numpy complex128 array)
+            The row index, column index, and value of each nonzero entry.
+        """
+
+        M = matrix_from_tensor(self.to_tensor())
+        rows, cols = np.nonzero(M)
+        return rows, cols, M[rows, cols]
+
+
+class DenseKernel(Kernel):
+    """
+    Apply an operator given by a dense rank `2d` tensor, with lower and
+    upper indices interleaved, by tensor contraction.
+
+    The kernel may instead apply the complex conjugate and/or the
+    transpose of the tensor's operator, which it does by contracting
+    the conjugated tensor and/or its other indices, so the adjoint of
+    an operator is applied without producing its tensor.
+
+    Parameters
+    ----------
+    tensor : numpy complex128 multidimensional array
+        The operator tensor.
+    conjugate : bool
+        If true, apply the complex conjugate of the operator.
+    transpose : bool
+        If true, apply the transpose of the operator.
+    """
+
+    def __init__(self, tensor, conjugate=False, transpose=False):
+        super().__init__(len(tensor.shape) // 2, tensor.dtype)
+        self.tensor = tensor
+        self.conjugate = conjugate
+        self.transpose = transpose
+
+    @property
+    def _conjugate_tensor(self):
+        return np.conj(self.tensor)
+
+    def apply(self, t, axes):
+        axes = list(axes)
+        # The transpose swaps the roles of the lower and upper indices
+        in_axes = list(range(0 if self.transpose else 1, 2*self.d, 2))
+        tensor = self._cast('_conjugate_tensor' if self.conjugate else 'tensor', t.dtype)
+        result = np.tensordot(tensor, t, (in_axes, axes))
+        # tensordot puts the operator's outgoing axes first
+        t[...] = np.moveaxis(result, range(self.d), axes)
+
+    def to_tensor(self):
+        t = self.tensor
+        if self.conjugate:
+            t = np.conj(t)
+        if self.transpose:
+            t = t.transpose(_adjoint_permutation(self.d))
+        return t
+
+    def scaled(self, scalar):
+        if self.conjugate:
+            scalar = np.conj(scalar)
+        return DenseKernel(self.dtype.type(scalar) * self.tensor,
+                           self.conjugate, self.transpose)
+
+    def astype(self, dtype):
+        return DenseKernel(self.tensor.astype(dtype, copy=False),
+                           self.conjugate, self.transpose)
+
+    def adjoint(self):
+        return DenseKernel(self.tensor, not self.conjugate, not self.transpose)
+
+    def conjugated(self):
+        return DenseKernel(self.tensor, not self.conjugate, self.transpose)
+
+
+class SingleQubitKernel(Kernel):
+    """
+    Apply a single-qubit operator by updating the two halves of the
+    tensor, split along the target axis, in-place.
+
+    Parameters
+    ----------
+    matrix : numpy complex128 array
+        The 2x2 matrix of the operator.
+    """
+
+    def __init__(self, matrix):
+        super().__init__(1, matrix.dtype)
+        self.matrix = matrix
+
+    def apply(self, t, axes):
+        axis, = axes
+        # Strided views of the |0⟩ and |1⟩ halves of the tensor. For a
+        # C-contiguous state these are the two halves of the
+        # (2^k, 2, 2^(d-k-1)) view of the tensor. Slicing rather than
+        # integer indexing keeps these as views even for rank 1 tensors.
+        prefix = (slice(None),) * axis
+        a0 = t[prefix + (slice(0, 1),)]
+        a1 = t[prefix + (slice(1, 2),)]
+        (m00, m01), (m10, m11) = self._cast('matrix', t.dtype)
+
+        a0_copy = a0.copy()
+        a0 *= m00
+        a0 += m01 * a1
+        a1 *= m11
+        a0_copy *= m10
+        a1 += a0_copy
+
+    def to_tensor(self):
+        return self.matrix
+
+    def scaled(self, scalar):
+        return SingleQubitKernel(self.dtype.type(scalar) * self.matrix)
+
+    def astype(self, dtype):
+        return SingleQubitKernel(self.matrix.astype(dtype, copy=False))
+
+    def adjoint(self):
+        return SingleQubitKernel(np.conj(self.matrix.T))
+
+    def conjugated(self):
+        return SingleQubitKernel(np.conj(self.matrix))
+
+
+class DiagonalKernel(Kernel):
+    """
+    Apply an operator whose matrix is diagonal by multiplying the target
+    tensor elementwise, without transposing it.
+
+    Parameters
+    ----------
+    diagonal : numpy complex128 multidimensional array
+        The diagonal of the operator's matrix, with shape [2] * `d`.
+    """
+
+    sparse = True
+
+    # For operators on up to this many qubits, only the slices of the
+    # target tensor with a non-unit diagonal entry are multiplied.
+    max_sliced_qubits = 4
+
+    def __init__(self, diagonal):
+        super().__init__(len(diagonal.shape), diagonal.dtype)
+        self.diagonal = diagonal
+
+        # The basis states whose slices are multiplied, computed once
+        if self.d <= self.max_sliced_qubits:
+            self._non_unit = [bits for bits in product([0, 1], repeat=self.d)
+                              if diagonal[bits] != 1.0]
+
+    def apply(self, t, axes):
+        axes = list(axes)
+        diagonal = self._cast('diagonal', t.dtype)
+
+        if self.d <= self.max_sliced_qubits:
+            # E.g., a controlled phase only touches a quarter of the tensor
+            for bits in self._non_unit:
+                value = diagonal[bits]
+                idx = [slice(None)] * len(t.shape)
+                for axis, bit in zip(axes, bits):
+                    idx[axis] = bit
+                t[tuple(idx)] *= value
+        else:
+            # Broadcast the diagonal, with its axes in the order they
+            # appear in the target tensor, over the remaining axes
+            shape = [1] * len(t.shape)
+            for axis in axes:
+                shape[axis] = 2
+            t *= np.transpose(diagonal, np.argsort(axes)).reshape(shape)
+
+    def to_tensor(self):
+        return tensor_from_matrix(np.diag(self.diagonal.flatten()))
+
+    def _is_unitary(self):
+        return np.allclose(np.abs(self.diagonal), 1.0, atol=self._tolerance())
+
+    def scaled(self, scalar):
+        return DiagonalKernel(self.dtype.type(scalar) * self.diagonal)
+
+    def astype(self, dtype):
+        return DiagonalKernel(self.diagonal.astype(dtype, copy=False))
+
+    def adjoint(self):
+        return DiagonalKernel(np.conj(self.diagonal))
+
+    def conjugated(self):
+        return DiagonalKernel(np.conj(self.diagonal))
+
+    def to_coo(self):
+        diagonal = self.diagonal.flatten()
+        indices = np.flatnonzero(diagonal)
+        return indices, indices, diagonal[indices]
+
+
+class PermutationKernel(Kernel):
+    """
+    Apply an operator that permutes the computational basis states,
+    optionally multiplying each by a phase, by gathering and scattering
+    slices of the target tensor. Only the slices for basis states that
+    are not mapped to themselves are moved.
+
+    Parameters
+    ----------
+    permutation : numpy int array
+        An array of size 2^`d`, where basis state `i` is mapped to basis
+        state `permutation[i]`. The first qubit is the most significant bit.
+    phases : numpy complex128 array
+        An optional array of size 2^`d`, where basis state `i` is
+        multiplied by `phases[i]`. If not given, all phases are 1.
+    dtype : numpy dtype
+        The precision of the operator, if no phases are given.
+    """
+
+    sparse = True
+
+    def __init__(self, permutation, phases=None, dtype=np.complex128):
+        permutation = np.asarray(permutation, dtype=np.intp)
+        if phases is not None:
+            dtype = phases.dtype
+        super().__init__(int(np.log2(permutation.size)), dtype)
+        self.permutation = permutation
+        self.phases = phases
+
+        moved = permutation != np.arange(permutation.size)
+        if phases is not None:
+            moved |= phases != 1.0
+        self._moved = np.flatnonzero(moved)
+
+        # The multi-indices of the slices moved, computed once
+        shape = [2] * self.d
+        self._src = np.unravel_index(self._moved, shape)
+        self._dst = np.unravel_index(self.permutation[self._moved], shape)
+
+    def apply(self, t, axes):
+        if self._moved.size == 0:
+            return
+
+        # A view with the operator's axes first
+        v = np.moveaxis(t, list(axes), range(self.d))
+        values = v[self._src]
+        if self.phases is not None:
+            values *= self._cast('phases', t.dtype)[self._moved].reshape(
+                (-1,) + (1,) * (len(t.shape) - self.d))
+        v[self._dst] = values
+
+    def to_tensor(self):
+        M = np.zeros((2**self.d, 2**self.d), dtype=self.dtype)
+        phases = 1.0 if self.phases is None else self.phases
+        M[self.permutation, np.arange(2**self.d)] = phases
+        return tensor_from_matrix(M)
+
+    def _is_unitary(self):
+        return self.phases is None or np.allclose(np.abs(self.phases), 1.0,
+                                                  atol=self._tolerance())
+
+    def scaled(self, scalar):
+        phases = np.ones(2**self.d, dtype=self.dtype) if self.phases is None else self.phases
+        return PermutationKernel(self.permutation, self.dtype.type(scalar) * phases)
+
+    def astype(self, dtype):
+        phases = None if self.phases is None else self.phases.astype(dtype, copy=False)
+        return PermutationKernel(self.permutation, phases, dtype=dtype)
+
+    def adjoint(self):
+        # The inverse permutation, with the conjugate phases
+        inverse = np.argsort(self.permutation)
+        phases = None if self.phases is None else np.conj(self.phases[inverse])
+        return PermutationKernel(inverse, phases, dtype=self.dtype)
+
+    def conjugated(self):
+        if self.phases is None:
+            return self
+        return PermutationKernel(self.permutation, np.conj(self.phases))
+
+    def to_coo(self):
+        n = 2**self.d
+        phases = np.ones(n, dtype=self.dtype) if self.phases is None else self.phases
+        return self.permutation, np.arange(n), phases
+
+
+class ControlledKernel(Kernel):
+    """
+    Apply an operator that applies another operator `U` to its last
+    qubits if all of its first `num_controls` qubits are set. `U` is
+    only applied to the slice of the target tensor for which the control
+    bits are set, and the rest of the tensor is not touched.
+
+    Parameters
+    ----------
+    kernel : Kernel
+        The kernel for `U`.
+    num_controls : int
+        The number of control qubits.
+    """
+
+    sparse = True
+
+    def __init__(self, kernel, num_controls):
+        super().__init__(kernel.d + num_controls, kernel.dtype)
+        self.kernel = kernel
+        self.num_controls = num_controls
+
+    def apply(self, t, axes):
+        axes = list(axes)
+        control_axes = axes[:self.num_controls]
+
+        # A view of the slice with the control bits set
+        idx = [slice(None)] * len(t.shape)
+        for axis in control_axes:
+            idx[axis] = 1
+        controlled_t = t[tuple(idx)]
+
+        # The target axes, renumbered for the control axes being removed
+        target_axes = [a - sum(c < a for c in control_axes)
+                       for a in axes[self.num_controls:]]
+        self.kernel.apply(controlled_t, target_axes)
+
+    def to_tensor(self):
+        M = np.eye(2**self.d, dtype=self.dtype)
+        n = 2**self.kernel.d
+        M[-n:, -n:] = matrix_from_tensor(self.kernel.to_tensor())
+        return tensor_from_matrix(M)
+
+    def _is_unitary(self):
+        return self.kernel.unitary
+
+    def astype(self, dtype):
+        return ControlledKernel(self.kernel.astype(dtype), self.num_controls)
+
+    def adjoint(self):
+        return ControlledKernel(self.kernel.adjoint(), self.num_controls)
+
+    def conjugated(self):
+        return ControlledKernel(self.kernel.conjugated(), self.num_controls)
+
+    def to_coo(self):
+        # The identity, except for the last block, where U acts
+        offset = 2**self.d - 2**self.kernel.d
+        rows, cols, values = self.kernel.to_coo()
+        identity = np.arange(offset)
+        return (np.concatenate([identity, rows + offset]),
+                np.concatenate([identity, cols + offset]),
+                np.concatenate([np.ones(offset, dtype=self.dtype), values]))
+
+
+class KroneckerKernel(Kernel):
+    """
+    Apply an operator that is the tensor product of other operators,
+    each acting on a consecutive group of qubits, by applying each
+    factor to its own axes in turn. Only the factors are stored, so,
+    e.g., the `d`-qubit Hadamard operator costs O(d) memory rather
+    than O(4^d), and is applied in O(d 2^d) time.
+
+    Parameters
+    ----------
+    factors : list of Kernel
+        The kernels for the factors, in order of their qubits. Factors
+        that are themselves tensor products are flattened.
+    """
+
+    def __init__(self, factors):
+        flattened = []
+        for factor in factors:
+            if isinstance(factor, KroneckerKernel):
+                flattened.extend(factor.factors)
+            else:
+                flattened.append(factor)
+
+        super().__init__(sum(factor.d for factor in flattened),
+                         np.result_type(*(factor.dtype for factor in flattened)))
+        self.factors = flattened
+
+    @property
+    def factor_qubits(self):
+        """
+        Get the qubits each factor acts on.
+
+        Returns
+        -------
+        list of list of int
+            For each factor, the indices of its qubits.
+        """
+
+        starts = np.cumsum([0] + [factor.d for factor in self.factors])
+        return [list(range(start, start + factor.d))
+                for start, factor in zip(starts, self.factors)]
+
+    def apply(self, t, axes):
+        axes = list(axes)
+        for factor, qubits in zip(self.factors, self.factor_qubits):
+            factor.apply(t, [axes[i] for i in qubits])
+
+    def to_tensor(self):
+        t = self.factors[0].to_tensor()
+        for factor in self.factors[1:]:
+            t = np.tensordot(t, factor.to_tensor(), axes=0)
+        return t.astype(self.dtype, copy=False)
+
+    def _is_unitary(self):
+        return all(factor.unitary for factor in self.factors)
+
+    def scaled(self, scalar):
+        return KroneckerKernel([self.factors[0].scaled(scalar)] + self.factors[1:])
+
+    def astype(self, dtype):
+        return KroneckerKernel([factor.astype(dtype) for factor in self.factors])
+
+    def adjoint(self):
+        return KroneckerKernel([factor.adjoint() for factor in self.factors])
+
+    def conjugated(self):
+        return KroneckerKernel([factor.conjugated() for factor in self.factors])
+
+
+class FourierKernel(Kernel):
+    """
+    Apply the quantum Fourier transform, or its inverse, with a fast
+    Fourier transform over the target axes, in O(d 2^d) time per slice
+    of the target tensor rather than the O(4^d) of a dense operator.
+
+    The quantum Fourier transform maps basis state :math:`|j⟩` to
+    :math:`\\frac{1}{\\sqrt{N}} \\sum_k e^{2 \\pi i j k / N} |k⟩`, with
+    :math:`N = 2^d` and the first qubit as the most significant bit,
+    which is numpy's normalized inverse discrete Fourier transform.
+
+    Parameters
+    ----------
+    d : int
+        The number of qubits the transform acts on.
+    inverse : bool
+        If true, apply the inverse transform.
+    dtype : numpy dtype
+        The precision of the operator.
+    """
+
+    def __init__(self, d, inverse=False, dtype=np.complex128):
+        super().__init__(d, dtype)
+        self.inverse = inverse
+
+    def apply(self, t, axes):
+        # A view with the operator's axes first, which are flattened
+        # into the single axis the transform is taken along
+        v = np.moveaxis(t, list(axes), range(self.d))
+        flat = v.reshape((2**self.d,) + v.shape[self.d:])
+        transform = np.fft.fft if self.inverse else np.fft.ifft
+        v[...] = transform(flat, axis=0, norm='ortho').reshape(v.shape)
+
+    def to_tensor(self):
+        n = 2**self.d
+        sign = -1 if self.inverse else 1
+        jk = np.outer(np.arange(n), np.arange(n)) % n
+        M = np.exp(sign * 2j * np.pi * jk / n) / np.sqrt(n)
+        return tensor_from_matrix(M.astype(self.dtype))
+
+    def _is_unitary(self):
+        return True
+
+    def astype(self, dtype):
+        return FourierKernel(self.d, self.inverse, dtype)
+
+    def adjoint(self):
+        return FourierKernel(self.d, not self.inverse, self.dtype)
+
+    def conjugated(self):
+        # The transform's matrix is symmetric, so its conjugate is its adjoint
+        return FourierKernel(self.d, not self.inverse, self.dtype)
+
+
+class SparseKernel(Kernel):
+    """
+    Apply an operator given by the nonzero entries of its matrix, in
+    coordinate format, by gathering the slices of the target tensor for
+    the entries' columns, and summing the weighted slices into the
+    slices for their rows. Only the nonzero entries are stored.
+
+    Parameters
+    ----------
+    rows : numpy int array
+        The row index of each nonzero entry.
+    cols : numpy int array
+        The column index of each nonzero entry.
+    values : numpy complex128 array
+        The value of each nonzero entry.
+    d : int
+        The number of qubits the operator acts on.
+    """
+
+    sparse = True
+
+    def __init__(self, rows, cols, values, d):
+        super().__init__(d, values.dtype)
+        rows, cols, values = _sum_duplicates(rows, cols, values, 2**d)
+        self.rows = rows
+        self.cols = cols
+        self.values = values
+
+        # The entries are sorted by row. Find where each row's entries
+        # start, and which rows have no entries at all.
+        n = 2**d
+        shape = [2] * d
+        self._row_starts = np.flatnonzero(np.diff(rows, prepend=-1))
+        out_rows = rows[self._row_starts]
+        empty_rows = np.setdiff1d(np.arange(n), out_rows)
+        self._src = np.unravel_index(cols, shape)
+        self._dst = np.unravel_index(out_rows, shape)
+        self._empty = np.unravel_index(empty_rows, shape)
+
+    def apply(self, t, axes):
+        # A view with the operator's axes first
+        v = np.moveaxis(t, list(axes), range(self.d))
+        if self.values.size == 0:
+            v[...] = 0
+            return
+
+        values = self._cast('values', t.dtype).reshape((-1,) + (1,) * (len(t.shape) - self.d))
+        gathered = v[self._src] * values
+        sums = np.add.reduceat(gathered, self._row_starts, axis=0)
+        v[self._empty] = 0
+        v[self._dst] = sums
+
+    def to_tensor(self):
+        M = np.zeros((2**self.d, 2**self.d), dtype=self.dtype)
+        M[self.rows, self.cols] = self.values
+        return tensor_from_matrix(M)
+
+    def to_coo(self):
+        return self.rows, self.cols, self.values
+
+    def _is_unitary(self):
+        # The entries of M M^†, computed sparsely
+        n = 2**self.d
+        rows, cols, values = _sum_duplicates(*coo_matmul(
+            (self.rows, self.cols, self.values),
+            (self.cols, self.rows, np.conj(self.values))), n)
+        on_diagonal = rows == cols
+        return (np.count_nonzero(on_diagonal) == n and
+                np.allclose(values[on_diagonal], 1.0, atol=self._tolerance()) and
+                np.allclose(values[~on_diagonal], 0.0, atol=self._tolerance()))
+
+    def scaled(self, scalar):
+        return kernel_from_coo(self.rows, self.cols, self.dtype.type(scalar) * self.values, self.d)
+
+    def astype(self, dtype):
+        return SparseKernel(self.rows, self.cols, self.values.astype(dtype), self.d)
+
+    def adjoint(self):
+        return kernel_from_coo(self.cols, self.rows, np.conj(self.values), self.d)
+
+    def conjugated(self):
+        return SparseKernel(self.rows, self.cols, np.conj(self.values), self.d)
+
+
+def _sum_duplicates(rows, cols, values, n):
+    # Sort the entries of an n x n matrix in coordinate format by row and
+    # column, summing duplicate entries and dropping zeros
+    keys = np.asarray(rows, dtype=np.int64) * n + np.asarray(cols, dtype=np.int64)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    values = np.asarray(values)[order]
+    if keys.size > 0:
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        keys = keys[starts]
+        values = np.add.reduceat(values, starts)
+    nonzero = values != 0
+    keys = keys[nonzero]
+    return keys // n, keys % n, values[nonzero]
+
+
+def kernel_from_coo(rows, cols, values, d):
+    """
+    Produce a kernel for an operator given by the nonzero entries of its
+    matrix in coordinate format, using the most specific kernel for the
+    operator's structure: diagonal, permutation, or general sparse.
+
+    Parameters
+    ----------
+    rows : numpy int array
+        The row index of each entry.
+    cols : numpy int array
+        The column index of each entry.
+    values : numpy complex128 array
+        The value of each entry. Duplicate entries are summed.
+    d : int
+        The number of qubits the operator acts on.
+
+    Returns
+    -------
+    Kernel
+        The kernel.
+    """
+
+    n = 2**d
+    rows, cols, values = _sum_duplicates(rows, cols, values, n)
+
+    if np.all(rows == cols):
+        diagonal = np.zeros(n, dtype=values.dtype)
+        diagonal[rows] = values
+        return DiagonalKernel(diagonal.reshape([2] * d))
+
+    if rows.size == n and np.unique(cols).size == n and np.unique(rows).size == n:
+        # Sorted by row, so index by column to get the permutation
+        permutation = np.empty(n, dtype=np.intp)
+        phases = np.empty(n, dtype=values.dtype)
+        permutation[cols] = rows
+        phases[cols] = values
+        return PermutationKernel(permutation, phases)
+
+    return SparseKernel(rows, cols, values, d)
+
+
+def _spread_bits(x, positions, d):
+    # Place the bits of the len(positions)-bit integers x (most
+    # significant first) at the given qubit positions of d-bit integers
+    x = np.asarray(x, dtype=np.int64)
+    k = len(positions)
+    result = np.zeros_like(x)
+    for j, position in enumerate(positions):
+        result |= ((x >> (k - 1 - j)) & 1) << (d - 1 - position)
+    return result
+
+
+def expand_coo(coo, qubit_indices, d):
+    """
+    Produce the coordinate format of the `d`-qubit operator that applies
+    a `k`-qubit operator, given in coordinate format, to the qubits
+    `qubit_indices`, and the identity to the other qubits.
+    """
+
+    rows, cols, values = coo
+    others = [i for i in range(d) if i not in qubit_indices]
+    if not others and list(qubit_indices) == list(range(d)):
+        return coo
+
+    rest = _spread_bits(np.arange(2**len(others)), others, d)
+    rows = (_spread_bits(rows, qubit_indices, d)[:, None] | rest).ravel()
+    cols = (_spread_bits(cols, qubit_indices, d)[:, None] | rest).ravel()
+    values = np.repeat(values, rest.size)
+    return rows, cols, values
+
+
+def coo_matmul(a, b):
+    """
+    Multiply two matrices given in coordinate format, without
+    densifying them.
+    """
+
+    rows_a, cols_a, values_a = a
+    rows_b, cols_b, values_b = b
+
+    order = np.argsort(rows_b, kind='stable')
+    rows_b, cols_b, values_b = rows_b[order], cols_b[order], values_b[order]
+
+    # Pair each entry (i, j) of a with every entry (j, k) of b
+    starts = np.searchsorted(rows_b, cols_a, side='left')
+    counts = np.searchsorted(rows_b, cols_a, side='right') - starts
+    index_a = np.repeat(np.arange(cols_a.size), counts)
+    offsets = np.arange(index_a.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    index_b = np.repeat(starts, counts) + offsets
+
+    return rows_a[index_a], cols_b[index_b], values_a[index_a] * values_b[index_b]
+
+
+def coo_kron(a, b, n_b):
+    """
+    Produce the Kronecker product of two matrices given in coordinate
+    format, where the second is `n_b` x `n_b`, without densifying them.
+    """
+
+    rows_a, cols_a, values_a = a
+    rows_b, cols_b, values_b = b
+    rows = (np.asarray(rows_a, dtype=np.int64)[:, None] * n_b + rows_b).ravel()
+    cols = (np.asarray(cols_a, dtype=np.int64)[:, None] * n_b + cols_b).ravel()
+    return rows, cols, (values_a[:, None] * values_b).ravel()
@@ -0,0 +1,420 @@
+"""
+The mps module contains the MatrixProductState class, instances of
+which represent states of multi-qubit systems as matrix product states,
+for simulating circuits that produce little entanglement.
+
+A matrix product state of `d` qubits stores one rank 3 tensor per qubit,
+of shape (:math:`\\chi_l`, 2, :math:`\\chi_r`), where the bond dimensions
+:math:`\\chi` between neighbouring qubits grow with the entanglement
+between the qubits on either side, up to :math:`2^{d/2}`. For shallow
+circuits the bond dimensions stay small, so states of 60 to 100 qubits
+can be simulated, and the bond dimensions can be capped to approximate
+more entangled states.
+
+The MatrixProductState class is aliased at the top-level module, so that
+one can call ``qcircuits.MatrixProductState()`` instead of
+``qcircuits.mps.MatrixProductState()``.
+"""
+
+
+import numpy as np
+
+from qcircuits.tensors import get_default_dtype
+from qcircuits.state import State, _check_measured_indices
+from qcircuits.kernels import KroneckerKernel, matrix_from_tensor
+from qcircuits.rng import resolve_rng, _choice
+
+
+_swap = np.array([[1, 0, 0, 0],
+                  [0, 0, 1, 0],
+                  [0, 1, 0, 0],
+                  [0, 0, 0, 1]], dtype=np.complex128)
+
+
+class MatrixProductState:
+    """
+    A state of a `d`-qubit system stored as a matrix product state,
+    and associated methods. The state is initially :math:`|0\\ldots0⟩`.
+
+    One- and two-qubit operators (and tensor products of them) are
+    applied to a matrix product state in the same way as to a
+    :py:class:`.State`, e.g., ``qc.CNOT()(x, [0, 3])``, and so are
+    :py:class:`.Circuit` objects made of them. Two-qubit operators on
+    qubits that are not neighbours are applied by swapping the qubits
+    to be neighbours, and back.
+
+    After each two-qubit operator, the smallest Schmidt coefficients of
+    the bond between the qubits are discarded, as long as their total
+    squared magnitude is at most `truncation_threshold`, and at most
+    `max_bond_dimension` are kept. The total discarded weight is
+    recorded in :py:attr:`truncation_error`.
+
+    Parameters
+    ----------
+    d : int
+        The number of qubits.
+    max_bond_dimension : int
+        The maximum bond dimension. If None, the bond dimensions are
+        only limited by `truncation_threshold`.
+    truncation_threshold : float
+        The maximum squared magnitude of the Schmidt coefficients
+        discarded after each two-qubit operator.
+    dtype : numpy dtype
+        The precision of the tensors, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
+    """
+
+    def __init__(self, d, max_bond_dimension=None, truncation_threshold=1e-12, dtype=None):
+        if d < 1:
+            raise ValueError('Rank must be at least 1.')
+        if max_bond_dimension is not None and max_bond_dimension < 1:
+            raise ValueError('The maximum bond dimension must be at least 1.')
+        if dtype is None:
+            dtype = get_default_dtype()
+
+        self.max_bond_dimension = max_bond_dimension
+        self.truncation_threshold = truncation_threshold
+        self.truncation_error = 0.0
+
+        site = np.zeros((1, 2, 1), dtype=dtype)
+        site[0, 0, 0] = 1
+        self._sites = [site.copy() for i in range(d)]
+        # The site all the others are orthonormal with respect to:
+        # sites to its left are left-orthonormal and sites to its right
+        # right-orthonormal, so the state's norm is the norm of this site
+        self._center = 0
+
+    @staticmethod
+    def from_state(state, max_bond_dimension=None, truncation_threshold=1e-12):
+        """
+        Produce a matrix product state from a :py:class:`.State`, by
+        successive singular value decompositions.
+
+        Parameters
+        ----------
+        state : State
+            The state.
+        max_bond_dimension : int
+            The maximum bond dimension.
+        truncation_threshold : float
+            The maximum squared magnitude of the Schmidt coefficients
+            discarded at each bond.
+
+        Returns
+        -------
+        MatrixProductState
+            The matrix product state.
+        """
+
+        d = state.rank
+        mps = MatrixProductState(d, max_bond_dimension, truncation_threshold,
+                                 dtype=state.dtype)
+        rest = state._t.reshape(1, -1)
+        for i in range(d - 1):
+            M = rest.reshape(rest.shape[0] * 2, -1)
+            U, s, Vh = np.linalg.svd(M, full_matrices=False)
+            k = mps._num_kept(s)
+            mps._sites[i] = U[:, :k].reshape(-1, 2, k)
+            rest = s[:k, None] * Vh[:k]
+        mps._sites[d - 1] = rest.reshape(-1, 2, 1)
+        mps._center = d - 1
+        mps._normalize()
+        return mps
+
+    def __repr__(self):
+        return 'MatrixProductState(d={}, bond_dimensions={})'.format(
+            self.rank, self.bond_dimensions)
+
+    def __str__(self):
+        return '{}-qubit matrix product state with bond dimensions {}.'.format(
+            self.rank, self.bond_dimensions)
+
+    @property
+    def rank(self):
+        """
+        Get the number of qubits of the state.
+
+        Returns
+        -------
+        int
+            The number of qubits.
+        """
+
+        return len(self._sites)
+
+    @property
+    def shape(self):
+        """
+        Get the shape of the tensor of the equivalent :py:class:`.State`.
+
+        Returns
+        -------
+        tuple of int
+            The shape, [2] :math:`\\times d`.
+        """
+
+        return (2,) * self.rank
+
+    @property
+    def dtype(self):
+        """
+        Get the precision of the tensors.
+
+        Returns
+        -------
+        numpy dtype
+            complex64 or complex128.
+        """
+
+        return self._sites[0].dtype
+
+    @property
+    def bond_dimensions(self):
+        """
+        Get the dimension of each bond, between qubits `i` and `i` + 1.
+
+        Returns
+        -------
+        list of int
+            The `d` - 1 bond dimensions.
+        """
+
+        return [site.shape[2] for site in self._sites[:-1]]
+
+    def _copy_into(self, out):
+        # Copy the state into `out`, or a new state if it is None
+        if out is self:
+            return out
+        if out is None:
+            out = MatrixProductState.__new__(MatrixProductState)
+        out.max_bond_dimension = self.max_bond_dimension
+        out.truncation_threshold = self.truncation_threshold
+        out.truncation_error = self.truncation_error
+        out._sites = [site.copy() for site in self._sites]
+        out._center = self._center
+        return out
+
+    def _num_kept(self, s):
+        # The number of the singular values `s`, in descending order,
+        # kept after truncation, recording the weight discarded
+        weights = s**2 / np.sum(s**2)
+        # The weight discarded by keeping only the first k values
+        discarded = np.concatenate([np.cumsum(weights[::-1])[::-1], [0.0]])
+        k = max(1, int(np.argmax(discarded <= self.truncation_threshold)))
+        if self.max_bond_dimension is not None:
+            k = min(k, self.max_bond_dimension)
+        self.truncation_error += discarded[k]
+        return k
+
+    def _move_center(self, i):
+        # Move the orthogonality center to site i with QR decompositions
+        while self._center < i:
+            c = self._center
+            site = self._sites[c]
+            Q, R = np.linalg.qr(site.reshape(-1, site.shape[2]))
+            self._sites[c] = Q.reshape(site.shape[0], 2, -1)
+            self._sites[c + 1] = np.tensordot(R, self._sites[c + 1], axes=(1, 0))
+            self._center += 1
+
+        while self._center > i:
+            c = self._center
+            site = self._sites[c]
+            Q, R = np.linalg.qr(site.reshape(site.shape[0], -1).T)
+            self._sites[c] = Q.T.reshape(-1, 2, site.shape[2])
+            self._sites[c - 1] = np.tensordot(self._sites[c - 1], R.T, axes=(2, 0))
+            self._center -= 1
+
+    def _normalize(self):
+        site = self._sites[self._center]
+        site /= np.linalg.norm(site)
+
+    def _apply_one(self, i, U):
+        # Apply a single-qubit operator to site i
+        if not np.allclose(U.dot(np.conj(U.T)), np.eye(2)):
+            # A non-unitary operator changes the norm, which is only
+            # held by the orthogonality center
+            self._move_center(i)
+        self._sites[i] = np.einsum('ij,ajb->aib', U, self._sites[i]).astype(self.dtype)
+        if self._center == i:
+            self._normalize()
+
+    def _apply_two(self, i, U):
+        # Apply a two-qubit operator to sites i and i + 1, and split the
+        # result with a truncated singular value decomposition
+        self._move_center(i)
+        a = self._sites[i].shape[0]
+        c = self._sites[i + 1].shape[2]
+
+        theta = np.tensordot(self._sites[i], self._sites[i + 1], axes=(2, 0))
+        theta = np.einsum('ijkl,aklc->aijc', U.reshape(2, 2, 2, 2), theta)
+        U_, s, Vh = np.linalg.svd(theta.reshape(a * 2, 2 * c), full_matrices=False)
+
+        k = self._num_kept(s)
+        s = s[:k] / np.linalg.norm(s[:k])
+        self._sites[i] = U_[:, :k].reshape(a, 2, k).astype(self.dtype, copy=False)
+        self._sites[i + 1] = (s[:, None] * Vh[:k]).reshape(k, 2, c).astype(self.dtype,
+                                                                           copy=False)
+        self._center = i + 1
+
+    def _apply_kernel(self, kernel, qubit_indices):
+        # Apply an operator's kernel to the given qubits. The factors of
+        # a tensor product are applied one at a time, so that, e.g.,
+        # PauliX(d) is accepted for any d.
+        if isinstance(kernel, KroneckerKernel):
+            for factor, qubits in zip(kernel.factors, kernel.factor_qubits):
+                self._apply_kernel(factor, [qubit_indices[i] for i in qubits])
+            return
+
+        if kernel.d > 2:
+            raise ValueError('Only 1- and 2-qubit operators, or tensor products of them, '
+                             'can be applied to matrix product states.')
+
+        U = matrix_from_tensor(kernel.to_tensor())
+        if kernel.d == 1:
+            self._apply_one(qubit_indices[0], U)
+            return
+
+        i, j = qubit_indices
+        if j < i:
+            # Apply the operator with its qubits swapped, to (j, i)
+            i, j = j, i
+            U = _swap.dot(U).dot(_swap)
+
+        # Swap qubit j along the chain to be the neighbour of qubit i,
+        # apply the operator, and swap it back
+        for site in range(j - 1, i, -1):
+            self._apply_two(site, _swap)
+        self._apply_two(i, U)
+        for site in range(i + 1, j):
+            self._apply_two(site, _swap)
+
+    def amplitude(self, bits):
+        """
+        Get the probability amplitude of a computational basis state.
+
+        Parameters
+        ----------
+        bits : iterable of int
+            The bit of each qubit in the basis state.
+
+        Returns
+        -------
+        complex
+            The amplitude.
+        """
+
+        bits = list(bits)
+        if len(bits) != self.rank or any(b not in [0, 1] for b in bits):
+            raise ValueError('Supply a bit for each qubit.')
+
+        v = np.ones(1, dtype=self.dtype)
+        for site, b in zip(self._sites, bits):
+            v = v.dot(site[:, b, :])
+        return complex(v[0])
+
+    def to_state(self):
+        """
+        Produce the :py:class:`.State` with the same amplitudes. The
+        state has :math:`2^d` amplitudes, so this is only feasible for
+        small numbers of qubits.
+
+        Returns
+        -------
+        State
+            The state vector.
+        """
+
+        t = self._sites[0]
+        for site in self._sites[1:]:
+            t = np.tensordot(t, site, axes=(-1, 0))
+        return State(t.reshape([2] * self.rank), dtype=self.dtype)
+
+    def schmidt_number(self, indices):
+        """
+        Get the Schmidt number, a measure of entanglement, for the
+        Schmidt decomposition of the state into the subsystem of the
+        qubits `indices` and the subsystem of the other qubits. This is
+        read off the bond between the subsystems, so one of them should
+        be the first `k` qubits, for some `k`.
+
+        Parameters
+        ----------
+        indices : list of int
+            The qubit indices for one of the subsystems.
+            This should include at least one qubit index
+            and also exclude at least one index.
+
+        Returns
+        -------
+        int
+            The Schmidt number.
+        """
+
+        indices = sorted(indices)
+        if len(indices) in [0, self.rank]:
+            raise ValueError('At least one qubit index should be included '
+                             'and at least one should be excluded')
+        if min(indices) < 0 or max(indices) >= self.rank:
+            raise ValueError('Indices should be between 0 and d-1 for a d-qubit state.')
+
+        k = len(indices)
+        if indices == list(range(k)):
+            bond = k - 1
+        elif indices == list(range(self.rank - k, self.rank)):
+            bond = self.rank - k - 1
+        else:
+            raise ValueError('One of the subsystems should be the first k qubits.')
+
+        # With the orthogonality center at the left of the bond, the
+        # singular values of the center are the Schmidt coefficients
+        self._move_center(bond)
+        site = self._sites[bond]
+        s = np.linalg.svd(site.reshape(-1, site.shape[2]), compute_uv=False)
+        return np.sum(s > 1e-10)
+
+    def measure(self, qubit_indices=None, rng=None):
+        """
+        Measure the state with respect to the computational bases
+        of the qubits indicated by `qubit_indices`.
+        Measuring a state will modify the state in-place.
+        If no indices are indicated, the whole state is measured.
+
+        Parameters
+        ----------
+        qubit_indices : int or iterable
+            An index or indices indicating the qubit(s) whose
+            computational bases the measurement of the state will be
+            made with respect to. If no `qubit_indices` are given,
+            the whole state is measured.
+        rng : None, int, numpy.random.Generator, or numpy.random.RandomState
+            The random number generator, or a seed for one, to draw the
+            outcome with. If not given, numpy's global random state is
+            used. See :py:mod:`qcircuits.rng`.
+
+        Returns
+        -------
+        int or tuple of int
+            The measurement outcomes for the measured qubit(s).
+            If the `qubit_indices` parameter is supplied as an int,
+            an int is returned, otherwise a tuple.
+        """
+
+        qubit_indices, int_arg = _check_measured_indices(qubit_indices, self.rank)
+        rng = resolve_rng(rng)
+
+        bits = []
+        for i in qubit_indices:
+            # With the orthogonality center at the qubit, the outcome
+            # probabilities are the norms of the site's two slices
+            self._move_center(i)
+            site = self._sites[i]
+            ps = np.sum(np.abs(site)**2, axis=(0, 2), dtype=np.float64)
+            outcome = _choice(rng, ps)
+
+            site[:, 1 - outcome, :] = 0
+            site /= np.sqrt(ps[outcome] / np.sum(ps))
+            bits.append(outcome)
+
+        if int_arg:
+            return bits[0]
+        return tuple(bits)
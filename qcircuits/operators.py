@@ -14,11 +14,16 @@ aliased at the top-level module, so that, for example, one can call
 
 
 from itertools import product
-import copy
 
 import numpy as np
 
-from qcircuits.tensors import Tensor
+from qcircuits.tensors import Tensor, get_default_dtype
+from qcircuits.kernels import DenseKernel, SingleQubitKernel, DiagonalKernel
+from qcircuits.kernels import PermutationKernel, ControlledKernel, SparseKernel
+from qcircuits.kernels import KroneckerKernel, FourierKernel
+from qcircuits.kernels import kernel_from_coo, expand_coo, coo_matmul, coo_kron
+from qcircuits.kernels import tensor_from_matrix, matrix_from_tensor, apply_kernel
+from qcircuits.kernels import _needs_renormalization
 
 
 class OperatorBase(Tensor):
@@ -29,10 +34,15 @@ class OperatorBase(Tensor):
     ----------
     tensor : numpy complex128 multidimensional array
         The tensor representing the operator.
+    copy : bool
+        If false, use a tensor of the right dtype directly rather than copying it.
+    dtype : numpy dtype
+        The precision of the tensor, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
     """
 
-    def __init__(self, tensor):
-        super().__init__(tensor)
+    def __init__(self, tensor, copy=True, dtype=None):
+        super().__init__(tensor, copy=copy, dtype=dtype)
 
     @staticmethod
     def from_matrix(M):
@@ -44,7 +54,9 @@ class OperatorBase(Tensor):
         Parameters
         ----------
         numpy complex128 multidimensional array
-            The matrix representation of the operator.
+            The matrix representation of the operator. May also be a
+            scipy sparse matrix, in which case a sparse operator is
+            produced (see :py:meth:`.Operator.from_coo`).
 
         Returns
         -------
@@ -54,7 +66,7 @@ class OperatorBase(Tensor):
         """
 
         if type(M) is list:
-            M = np.array(M, dtype=np.complex128)
+            M = np.array(M, dtype=get_default_dtype())
 
         # Check the matrix is square
         shape = M.shape
@@ -64,19 +76,17 @@ class OperatorBase(Tensor):
         d = np.log2(shape[0])
         if not d.is_integer():
             raise ValueError('The matrix dimension should be a power of 2.')
-        d = int(d)
 
-        permutation = [0] * 2 * d
-        permutation[::2] = range(0, d)
-        permutation[1::2] = range(d, 2*d)
+        # Sparse matrices, e.g. from scipy.sparse, are not densified
+        if hasattr(M, 'tocoo'):
+            coo = M.tocoo()
+            return Operator.from_coo(coo.row, coo.col, coo.data, int(d))
 
-        return Operator(M.reshape([2] * 2 * d).transpose(permutation))
+        return Operator(tensor_from_matrix(M))
 
     @staticmethod
     def _tensor_to_matrix(t):
-        d = len(t.shape) // 2
-        permutation = list(range(0, 2*d, 2)) + list(range(1, 2*d, 2))
-        return t.transpose(permutation).reshape(2**d, 2**d)
+        return matrix_from_tensor(t)
 
     def to_matrix(self):
         """
@@ -111,7 +121,7 @@ class OperatorBase(Tensor):
         permutation[::2] = range(1, d, 2)
         permutation[1::2] = range(0, d, 2)
         t = np.conj(self._t).transpose(permutation)
-        return self.__class__(t)
+        return self.__class__(t, copy=False, dtype=t.dtype)
 
     def _permuted_tensor(self, axes, inverse=False):
         if inverse:
@@ -170,7 +180,118 @@ class OperatorBase(Tensor):
         return self
 
 
+def _check_qubit_indices(qubit_indices, op_d, d):
+    # Check the qubit indices for applying an op_d-qubit operator to a
+    # d-qubit system, and return them as a list
+    if op_d > d:
+        raise ValueError('An operator for a d-rank state space can only be applied to '
+                         'a system whose rank is >= d.')
+    if op_d < d and qubit_indices is None:
+        raise ValueError('Applying operator to too-large system without supplying '
+                         'qubit indices.')
+
+    if qubit_indices is not None:
+        qubit_indices = list(qubit_indices)
+
+        if len(set(qubit_indices)) != len(qubit_indices):
+            raise ValueError('Qubit indices list contains repeated elements.')
+        if min(qubit_indices) < 0:
+            raise ValueError('Supplied qubit index < 0.')
+        if max(qubit_indices) >= d:
+            raise ValueError('Supplied qubit index larger than system size.')
+        if len(qubit_indices) != op_d:
+            raise ValueError('Length of qubit_indices does not match operator.')
+    else:
+        qubit_indices = list(range(d))
+
+    return qubit_indices
+
+
+def _qubit_axes(arg):
+    # The number of qubits of a state or operator, and the offset and
+    # stride of the axes of its tensor for each qubit. For operators and
+    # density operators these are the upper indices, and for batches of
+    # states the batch axis comes first.
+    if isinstance(arg, OperatorBase):
+        return arg.rank // 2, 0, 2
+    elif isinstance(arg, StateBatch):
+        return arg.rank - 1, 1, 1
+    else:
+        return arg.rank, 0, 1
+
+
+def _check_out(arg, inplace, out):
+    # Resolve the inplace and out arguments of operator application to
+    # the object the result should be written to, or None for a new object
+    if inplace:
+        if out is not None and out is not arg:
+            raise ValueError('Supply at most one of inplace and out.')
+        out = arg
+    if out is not None:
+        if out.__class__ is not arg.__class__ or out.shape != arg.shape:
+            raise ValueError('Output should be of the same type and shape as the argument.')
+
+    return out
+
+
+def _output_tensor(arg, out):
+    # The tensor to write the result of applying an operator to `arg`
+    # into, holding a copy of the argument. An operator's tensor that
+    # came from its kernel, or that its kernel was built from, or a view
+    # of either, may be shared with other operators (e.g., its adjoint,
+    # or controlled operators built from it), so it is never written to:
+    # a fresh tensor is used instead, and the other operators are
+    # unaffected. Either way, `out` owns the tensor returned.
+    shared = False
+    if isinstance(out, Operator):
+        shared = out._shared
+        out._shared = False
+    if out is None or shared:
+        return np.array(arg._t, order='C')
+    if out is not arg:
+        np.copyto(out._t, arg._t)
+    return out._t
+
+
+def _compose_factored(kernel, qubit_indices, product):
+    # Compose an operator, applied to the qubits `qubit_indices`, with
+    # a tensor product operator, factor by factor. Each factor of the
+    # operator is composed with the factor of the product acting on its
+    # qubits, and factors of the product are only merged (and densified)
+    # where the operator acts across them.
+    if isinstance(kernel, KroneckerKernel):
+        pieces = [(factor, [qubit_indices[i] for i in qubits])
+                  for factor, qubits in zip(kernel.factors, kernel.factor_qubits)]
+    else:
+        pieces = [(kernel, qubit_indices)]
+
+    factors = list(product.factors)
+    for piece, piece_indices in pieces:
+        starts = np.cumsum([0] + [factor.d for factor in factors])
+        owners = np.searchsorted(starts, piece_indices, side='right') - 1
+        lo, hi = min(owners), max(owners)
+
+        if lo == hi:
+            target = Operator._from_kernel(factors[lo])
+        else:
+            t = KroneckerKernel(factors[lo:hi+1]).to_tensor()
+            target = Operator(t, copy=False, dtype=t.dtype)
+
+        local_indices = [i - starts[lo] for i in piece_indices]
+        result = Operator._from_kernel(piece)._apply(target, local_indices)
+        factors[lo:hi+1] = [result._get_kernel()]
+
+    if len(factors) == 1:
+        return Operator._from_kernel(factors[0])
+    return Operator._from_kernel(KroneckerKernel(factors))
+
+
 from qcircuits.density_operator import DensityOperator
+from qcircuits.state_batch import StateBatch
+from qcircuits.stabilizer import StabilizerState
+from qcircuits.mps import MatrixProductState
+from qcircuits.sparse_state import SparseState
+from qcircuits.product_state import ProductState
 
 
 class Operator(OperatorBase):
@@ -182,12 +303,108 @@ class Operator(OperatorBase):
     ----------
     tensor : numpy complex128 multidimensional array
         The tensor representing the operator.
+    copy : bool
+        If false, use a tensor of the right dtype directly rather than copying it.
+    dtype : numpy dtype
+        The precision of the tensor, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
     """
 
-    def __init__(self, tensor):
-        super().__init__(tensor)
+    # Dense operators with at most this fraction of nonzero entries in
+    # their matrix are applied as sparse operators
+    max_sparse_density = 1 / 8
+
+    def __init__(self, tensor, copy=True, dtype=None):
+        super().__init__(tensor, copy=copy, dtype=dtype)
+        # Whether the tensor's storage may be shared with a kernel, and so
+        # with other operators. Views of the tensor (e.g., after permuting
+        # its qubits) share it too, so this survives replacing the tensor.
+        self._shared = False
         # TODO check unitary (maybe only check when applying?)
 
+    @staticmethod
+    def from_coo(rows, cols, values, d, dtype=None):
+        """
+        Construct a sparse operator from the nonzero entries of its
+        matrix Kronecker-product representation, in coordinate format.
+        The operator is applied, composed with other sparse operators,
+        and its adjoint and tensor products with other sparse operators
+        computed, without ever producing its dense tensor, unless that
+        is asked for.
+
+        Parameters
+        ----------
+        rows : numpy int array
+            The row index of each entry.
+        cols : numpy int array
+            The column index of each entry.
+        values : numpy complex128 array
+            The value of each entry. Duplicate entries are summed.
+        d : int
+            The number of qubits the operator acts on.
+        dtype : numpy dtype
+            The precision of the operator, complex64 or complex128.
+            Defaults to the precision set by :py:func:`.set_default_dtype`.
+
+        Returns
+        -------
+        Operator
+            A d-qubit operator.
+        """
+
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        if rows.shape != cols.shape or rows.shape != np.shape(values):
+            raise ValueError('The rows, columns and values should have the same length.')
+        if rows.size > 0 and (min(rows.min(), cols.min()) < 0 or
+                              max(rows.max(), cols.max()) >= 2**d):
+            raise ValueError('Row and column indices should be between 0 and 2**d - 1.')
+
+        if dtype is None:
+            dtype = get_default_dtype()
+        values = np.asarray(values, dtype=dtype)
+
+        return Operator._from_kernel(kernel_from_coo(rows, cols, values, d))
+
+    @classmethod
+    def _from_kernel(cls, kernel):
+        # Construct an operator from a structured kernel. The dense
+        # tensor is only produced if it is asked for.
+        op = cls.__new__(cls)
+        op._tensor = None
+        op._kernel = kernel
+        op._conjugate = None
+        op._shared = True
+        return op
+
+    @property
+    def _t(self):
+        if self._tensor is None:
+            self._tensor = self._kernel.to_tensor()
+        return self._tensor
+
+    @_t.setter
+    def _t(self, t):
+        # Any structure the operator had is not valid for a new tensor
+        self._tensor = t
+        self._kernel = None
+        self._conjugate = None
+
+    @property
+    def shape(self):
+        if self._tensor is None:
+            return (2,) * 2 * self._kernel.d
+        return self._tensor.shape
+
+    @property
+    def dtype(self):
+        if self._tensor is None:
+            return self._kernel.dtype
+        return self._tensor.dtype
+
+    def astype(self, dtype):
+        return Operator._from_kernel(self._get_kernel().astype(np.dtype(dtype)))
+
     def __repr__(self):
         s = 'Operator('
         s += super().__str__().replace('\n', '\n' + ' ' * len(s))
@@ -201,87 +418,166 @@ class Operator(OperatorBase):
         return s
 
     def __add__(self, arg):
-        return Operator(self._t + arg._t)
+        t = self._t + arg._t
+        return Operator(t, copy=False, dtype=t.dtype)
 
     def __sub__(self, arg):
         return self + (-1) * arg
 
     def __mul__(self, scalar):
         if isinstance(scalar, (float, int, complex)):
-            return Operator(scalar * self._t)
+            return Operator._from_kernel(self._get_kernel().scaled(scalar))
         else:
             return super().__mul__(scalar)
 
     def __rmul__(self, scalar):
         if isinstance(scalar, (float, int, complex)):
-            return Operator(scalar * self._t)
+            return Operator._from_kernel(self._get_kernel().scaled(scalar))
 
     def __truediv__(self, scalar):
-        return Operator(self._t / scalar)
+        return Operator._from_kernel(self._get_kernel().scaled(1 / scalar))
 
     def __neg__(self):
-        return Operator(-self._t)
+        return Operator._from_kernel(self._get_kernel().scaled(-1))
 
-    def _apply(self, arg, qubit_indices=None):
-        if isinstance(arg, OperatorBase):
-            d = arg.rank // 2
-            arg_indices = list(range(0, 2*d, 2))
-        else:
-            d = arg.rank
-            arg_indices = list(range(d))
-        op_indices = list(range(1, self.rank, 2))
-
-        if len(op_indices) > d:
-            raise ValueError('An operator for a d-rank state space can only be applied to '
-                             'a system whose rank is >= d.')
-        if len(op_indices) < d and qubit_indices is None:
-            raise ValueError('Applying operator to too-large system without supplying '
-                             'qubit indices.')
-
-        if qubit_indices is not None:
-            qubit_indices = list(qubit_indices)
-
-            if len(set(qubit_indices)) != len(qubit_indices):
-                raise ValueError('Qubit indices list contains repeated elements.')
-            if min(qubit_indices) < 0:
-                raise ValueError('Supplied qubit index < 0.')
-            if max(qubit_indices) >= d:
-                raise ValueError('Supplied qubit index larger than system size.')
-            if len(qubit_indices) != len(op_indices):
-                raise ValueError('Length of qubit_indices does not match operator.')
-        else:
-            qubit_indices = list(range(d))
-
-        d1 = len(qubit_indices)
-        non_application_indices = sorted(list(set(range(d))  - set(qubit_indices)))
-        application_permutation = qubit_indices + non_application_indices
-
-        arg_t = arg._permuted_tensor(application_permutation)
-        arg_indices = arg_indices[:len(qubit_indices)]
-        result = np.tensordot(self._t, arg_t, (op_indices, arg_indices))
-
-        # Our convention is to have lower and upper indices of operators interleaved.
-        # Using tensordot on operator-operator application leaves us with all upper
-        # indices followed by all lower. We transpose the result to fix this.
-        if isinstance(arg, OperatorBase):
-            permute = [0] * 2*d
-            permute[: 2*d1 : 2] = range(d1)
-            permute[1 : 2*d1 : 2] = range(d1, 2*d1)
-            permute[2*d1 : 2*d] = range(2*d1, 2*d)
-            result = np.transpose(result, permute)
-
-        return_val = arg.__class__(result)
-        return_val.permute_qubits(application_permutation, inverse=True)
-        if not isinstance(arg, OperatorBase):
-            return_val.renormalize_()
-
-        return return_val
-
-    def __call__(self, arg, qubit_indices=None):
+    @property
+    def adj(self):
+        """
+        Get the adjoint of this operator,
+        :math:`A^{\\dagger} = (A^{*})^{T}`.
+        If the operator is unitary,
+        :math:`A A^{\\dagger} = I`.
+
+        The adjoint shares this operator's data, and is applied
+        without producing its tensor, which is only computed if it is
+        asked for. Applying an operator to this one in-place, or with
+        this one as `out`, gives this operator a new tensor, even after
+        its qubits are permuted, so the adjoint remains the adjoint of
+        the operator as it was.
+
+        Returns
+        -------
+        Operator
+            The adjoint operator.
+        """
+
+        return Operator._from_kernel(self._get_kernel().adjoint())
+
+    def tensor_product(self, arg):
+        if not isinstance(arg, Operator):
+            return super().tensor_product(arg)
+
+        a = self._get_kernel()
+        b = arg._get_kernel()
+        # Only the product of multi-qubit sparse factors is stored sparsely;
+        # single-qubit factors are cheaper to keep as they are
+        if a.sparse and b.sparse and a.d > 1 and b.d > 1:
+            d = a.d + b.d
+            rows, cols, values = coo_kron(a.to_coo(), b.to_coo(), 2**b.d)
+            dtype = np.result_type(a.dtype, b.dtype)
+            return Operator._from_kernel(
+                kernel_from_coo(rows, cols, values.astype(dtype, copy=False), d))
+
+        # Otherwise keep the factors, rather than producing the dense tensor
+        return Operator._from_kernel(KroneckerKernel([a, b]))
+
+    def tensor_power(self, n):
+        kernel = self._get_kernel()
+        if n > 1 and kernel.sparse and kernel.d > 1:
+            result = self
+            for i in range(n-1):
+                result = result.tensor_product(self)
+            return result
+        if n > 1:
+            return Operator._from_kernel(KroneckerKernel([kernel] * n))
+        return super().tensor_power(n)
+
+    def _apply(self, arg, qubit_indices=None, out=None):
+        d, offset, stride = _qubit_axes(arg)
+        qubit_indices = _check_qubit_indices(qubit_indices, self.rank // 2, d)
+        axes = [offset + stride*i for i in qubit_indices]
+
+        # The composition with a tensor product operator is computed
+        # factor by factor
+        if (out is None and isinstance(arg, Operator) and
+                isinstance(arg._get_kernel(), KroneckerKernel)):
+            return _compose_factored(self._get_kernel(), qubit_indices, arg._kernel)
+
+        # The composition of sparse operators is computed sparsely
+        if (out is None and isinstance(arg, Operator) and
+                self._get_kernel().sparse and arg._get_kernel().sparse):
+            a = expand_coo(self._kernel.to_coo(), qubit_indices, d)
+            rows, cols, values = coo_matmul(a, arg._kernel.to_coo())
+            return Operator._from_kernel(
+                kernel_from_coo(rows, cols, values.astype(arg.dtype, copy=False), d))
+
+        # Copy the argument once (unless the output is the argument itself),
+        # then let the kernel update the copy in-place, without transposing
+        # it to and from the application order. The copy is C-contiguous,
+        # as the kernels' strided updates are much slower on permuted tensors.
+        kernel = self._get_kernel()
+        t = _output_tensor(arg, out)
+        if out is None:
+            out = arg.__class__(t, copy=False, dtype=arg.dtype)
+        apply_kernel(kernel, t, axes)
+        if isinstance(arg, DensityOperator):
+            # Multiplying by U^† from the right applies the complex
+            # conjugate of U to the column (lower) indices, in the same buffer
+            apply_kernel(self._get_conjugate_kernel(), t, [a + 1 for a in axes])
+        # Setting the tensor discards any structure an operator had
+        out._t = t
+        # Unitary operators preserve the norm, so the two extra passes over
+        # a double precision state to renormalize it are only made for
+        # other operators
+        if (not isinstance(arg, OperatorBase) and
+                _needs_renormalization(kernel.unitary, out.dtype)):
+            out.renormalize_()
+
+        return out
+
+    def _get_kernel(self):
+        # Operators built by the factory functions may declare their
+        # structure. Otherwise, detect the structure of the dense tensor
+        # once and keep the kernel until the tensor is replaced.
+        if self._kernel is None:
+            t = self._t
+            d = self.rank // 2
+            self._shared = True
+            M = self.to_matrix()
+            diagonal = np.diagonal(M)
+            num_nonzero = np.count_nonzero(M)
+
+            if num_nonzero == np.count_nonzero(diagonal):
+                self._kernel = DiagonalKernel(diagonal.reshape([2] * d))
+            elif (num_nonzero == 2**d and
+                  np.all(np.count_nonzero(M, axis=0) == 1) and
+                  np.all(np.count_nonzero(M, axis=1) == 1)):
+                permutation = np.argmax(M != 0, axis=0)
+                phases = M[permutation, np.arange(2**d)]
+                self._kernel = PermutationKernel(permutation, phases)
+            elif d == 1:
+                self._kernel = SingleQubitKernel(t)
+            elif num_nonzero <= M.size * self.max_sparse_density:
+                rows, cols = np.nonzero(M)
+                self._kernel = SparseKernel(rows, cols, M[rows, cols], d)
+            else:
+                self._kernel = DenseKernel(t)
+
+        return self._kernel
+
+    def _get_conjugate_kernel(self):
+        # The kernel of the complex conjugate of the operator, applied to
+        # the column indices of density operators, built once and kept
+        # until the tensor is replaced
+        if self._conjugate is None:
+            self._conjugate = self._get_kernel().conjugated()
+        return self._conjugate
+
+    def __call__(self, arg, qubit_indices=None, inplace=False, out=None):
         """
         Applies this Operator to another Operator, as in operator
-        composition A(B), or to a :py:class:`.State` or :py:class:`.DensityOperator`,
-        as in A(v). Via operator composition,
+        composition A(B), or to a :py:class:`.State`, :py:class:`.StateBatch`,
+        or :py:class:`.DensityOperator`, as in A(v). Via operator composition,
         if two operators A and B will be applied to state v in sequence,
         either B(A(v)) or (B(A))(v) are valid.
 
@@ -289,6 +585,12 @@ class Operator(OperatorBase):
         if the qubits to which it is to be applied are specified in the
         `qubit_indices` parameter.
 
+        By default the argument is left unchanged and the result is
+        newly allocated. To avoid allocating a new tensor for each
+        application in a long sequence of operators, the result can
+        instead be written to the argument itself, with `inplace`, or
+        into an existing object of the same type and shape, with `out`.
+
         If x represents state :math:`|\\phi⟩` and A an operator,
         A(x) represents the state :math:`A |\\phi⟩`.
         If x represents density operator (mixed state)
@@ -297,34 +599,65 @@ class Operator(OperatorBase):
 
         Parameters
         ----------
-        arg : State, Operator, or DensityOperator
+        arg : State, Operator, DensityOperator, or other state
             The state that the operator is applied to, or the operator
-            with which the operator is composed.
+            with which the operator is composed. The other states are
+            :py:class:`.StateBatch`, :py:class:`.StabilizerState`,
+            :py:class:`.MatrixProductState`, :py:class:`.SparseState`
+            and :py:class:`.ProductState`. For a batch of states,
+            the operator is applied to each state in the batch. Only
+            Clifford operators can be applied to stabilizer states, and
+            only 1- and 2-qubit operators, or tensor products of them,
+            to matrix product states.
         qubit_indices: list of int
             If the operator is applied to a larger
             quantum system, the user must supply a list of the indices
             of the qubits to which the operator is to be applied.
             These can also be used to apply the operator to the qubits
             in arbitrary order.
+        inplace : bool
+            If true, modify the argument in-place and return it.
+        out : same type as `arg`
+            If supplied, an object of the same type and shape as the
+            argument, into which the result is written. The argument
+            is left unchanged, and `out` is returned.
 
         Returns
         -------
-        State, Operator, or DensityOperator
+        same type as `arg`
             The state vector or operator resulting in applying the
             operator to the argument.
         """
 
-        if isinstance(arg, DensityOperator):
-            return self._apply(
-                self._apply(arg.adj, qubit_indices).adj,
-                qubit_indices
-            )
-        else:
-            return self._apply(arg, qubit_indices)
+        out = _check_out(arg, inplace, out)
+
+        if isinstance(arg, (StabilizerState, MatrixProductState, SparseState,
+                            ProductState)):
+            qubit_indices = _check_qubit_indices(qubit_indices, self.rank // 2, arg.rank)
+            out = arg._copy_into(out)
+            out._apply_kernel(self._get_kernel(), qubit_indices)
+            return out
+
+        return self._apply(arg, qubit_indices, out=out)
 
 
 # Factory functions for building operators
 
+def _single_qubit_power(kernel, d):
+    # The d-fold tensor power of a single-qubit kernel, stored as its
+    # factors, so that it costs O(d) memory rather than O(2^d)
+    if d == 1:
+        return Operator._from_kernel(kernel)
+    return Operator._from_kernel(KroneckerKernel([kernel] * d))
+
+
+def _diagonal_operator(diagonal, d):
+    # The d-fold tensor power of a single-qubit diagonal operator,
+    # declared as diagonal so that it is never applied as a dense tensor.
+    diagonal = np.array(diagonal, dtype=get_default_dtype())
+    return _single_qubit_power(DiagonalKernel(diagonal), d)
+
+
 def Identity(d=1):
     """
     Produce the `d`-qubit identity operator :math:`I^{\\otimes d}`.
@@ -344,11 +677,11 @@ def Identity(d=1):
     --------
     PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
-    return Operator(np.array([[1.0 + 0.0j, 0.0j],
-                              [0.0j, 1.0 + 0.0j]])).tensor_power(d)
+    # Moves nothing, so applying it is free
+    return _single_qubit_power(PermutationKernel([0, 1], dtype=get_default_dtype()), d)
 
 
 def PauliX(d=1):
@@ -372,11 +705,11 @@ def PauliX(d=1):
     --------
     Identity, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
-    return Operator(np.array([[0.0j, 1.0 + 0.0j],
-                              [1.0 + 0.0j, 0.0j]])).tensor_power(d)
+    # Flips every bit of the basis state
+    return _single_qubit_power(PermutationKernel([1, 0], dtype=get_default_dtype()), d)
 
 
 def PauliY(d=1):
@@ -399,11 +732,13 @@ def PauliY(d=1):
     --------
     Identity, PauliX, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
-    return Operator(np.array([[0.0j, -1.0j],
-                              [1.0j, 0.0j]])).tensor_power(d)
+    # Flips every bit of the basis state, with a phase of i for each 0
+    # bit and -i for each 1 bit
+    phases = np.array([1.0j, -1.0j], dtype=get_default_dtype())
+    return _single_qubit_power(PermutationKernel([1, 0], phases), d)
 
 
 def PauliZ(d=1):
@@ -427,10 +762,9 @@ def PauliZ(d=1):
     --------
     Identity, PauliX, PauliY, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
-    return Operator(np.array([[1.0 + 0.0j, 0.0j],
-                              [0.0j, -1.0 + 0.0j]])).tensor_power(d)
+    return _diagonal_operator([1.0 + 0.0j, -1.0 + 0.0j], d)
 
 
 def Hadamard(d=1):
@@ -454,11 +788,11 @@ def Hadamard(d=1):
     --------
     Identity, PauliX, PauliY, PauliZ, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
     return Operator(1/np.sqrt(2) *
         np.array([[1.0 + 0.0j,  1.0 + 0.0j],
-                  [1.0 + 0.0j, -1.0 + 0.0j]])).tensor_power(d)
+                  [1.0 + 0.0j, -1.0 + 0.0j]]), copy=False).tensor_power(d)
 
 
 def Phase(d=1):
@@ -482,11 +816,12 @@ def Phase(d=1):
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
-    return Operator(np.array([[1.0 + 0.0j, 0.0j],
-                              [0.0j, 1.0j]])).tensor_power(d)
+    return _diagonal_operator([1.0 + 0.0j, 1.0j], d)
+
+
 def PiBy8(d=1):
     """
     Produce the `d`-qubit :math:`\pi/8` operator T.
@@ -509,11 +844,10 @@ def PiBy8(d=1):
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, Rotation
     RotationX, RotationY, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
-    return Operator(np.array([[1.0 + 0.0j, 0.0j],
-                              [0.0j, np.exp(1j * np.pi/4)]])).tensor_power(d)
+    return _diagonal_operator([1.0 + 0.0j, np.exp(1j * np.pi/4)], d)
 
 def Rotation(v, theta):
     """
@@ -537,7 +871,7 @@ def Rotation(v, theta):
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase
     PiBy8, RotationX, RotationY, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
     v = np.array(v)
@@ -568,7 +902,7 @@ def RotationX(theta):
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationY, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
     return Rotation([1., 0., 0.], theta)
@@ -594,7 +928,7 @@ def RotationY(theta):
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationZ, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
     return Rotation([0., 1., 0.], theta)
@@ -620,10 +954,10 @@ def RotationZ(theta):
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, SqrtNot, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
-    return Rotation([0., 0., 1.], theta)
+    return _diagonal_operator([np.exp(-0.5j * theta), np.exp(0.5j * theta)], 1)
 
 
 def SqrtNot(d=1):
@@ -647,11 +981,11 @@ def SqrtNot(d=1):
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, CNOT, Toffoli
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
     return Operator(0.5 * np.array([[1 + 1j, 1 - 1j],
-                                    [1 - 1j, 1 + 1j]])).tensor_power(d)
+                                    [1 - 1j, 1 + 1j]]), copy=False).tensor_power(d)
 
 
 def CNOT():
@@ -669,17 +1003,10 @@ def CNOT():
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, Toffoli, SqrtNot
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
-    return Operator((1.0 + 0.0j) *  np.array([[[[ 1.0, 0.0],
-                                                [ 0.0, 1.0]],
-                                               [[ 0.0, 0.0],
-                                                [ 0.0, 0.0]]],
-                                              [[[ 0.0, 0.0],
-                                                [ 0.0, 0.0]],
-                                               [[ 0.0, 1.0],
-                                                [ 1.0, 0.0]]]]))
+    return Operator._from_kernel(PermutationKernel([0, 1, 3, 2], dtype=get_default_dtype()))
 
 
 def Toffoli():
@@ -698,20 +1025,12 @@ def Toffoli():
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, CNOT, SqrtNot
-    Swap, SqrtSwap, ControlledU, U_f
+    Swap, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
-    d = 3
-    shape = [2] * 2 * d
-    t = np.zeros(shape, dtype=np.complex128)
-
-    # Fill in the operator as the Identity operator.
-    t[:] = Identity(d)[:]
-    # In the case that the first two bits are set, it acts on the third
-    # bit as the PauliX operator.
-    t[:, 1, :, 1, ...] = (Identity(2) * PauliX())[:, 1, :, 1]
-
-    return Operator(t)
+    # Identity, except that \|110⟩ and \|111⟩ are exchanged
+    return Operator._from_kernel(PermutationKernel([0, 1, 2, 3, 4, 5, 7, 6],
+                                                    dtype=get_default_dtype()))
 
 
 def Swap():
@@ -728,17 +1047,10 @@ def Swap():
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot
-    CNOT, Toffoli, SqrtSwap, ControlledU, U_f
+    CNOT, Toffoli, SqrtSwap, ControlledU, U_f, QFT, InverseQFT
     """
 
-    return Operator((1.0 + 0.0j) *  np.array([[[[ 1.0, 0.0],
-                                                [ 0.0, 0.0]],
-                                               [[ 0.0, 0.0],
-                                                [ 1.0, 0.0]]],
-                                              [[[ 0.0, 1.0],
-                                                [ 0.0, 0.0]],
-                                               [[ 0.0, 0.0],
-                                                [ 0.0, 1.0]]]]))
+    return Operator._from_kernel(PermutationKernel([0, 2, 1, 3], dtype=get_default_dtype()))
 
 
 def SqrtSwap():
@@ -756,7 +1068,7 @@ def SqrtSwap():
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot
-    CNOT, Toffoli, Swap, ControlledU, U_f
+    CNOT, Toffoli, Swap, ControlledU, U_f, QFT, InverseQFT
     """
 
     return Operator(np.array([[[[ 1.0,                 0.0],
@@ -766,44 +1078,57 @@ def SqrtSwap():
                               [[[ 0.0,       0.5 * (1 - 1j)],
                                 [ 0.0,                 0.0]],
                                [[ 0.5 * (1 + 1j),      0.0],
-                                [ 0.0,                 1.0]]]]))
+                                [ 0.0,                 1.0]]]]), copy=False)
 
 
-def ControlledU(U):
+def ControlledU(U, num_controls=1):
     """
-    Produce a Controlled-U operator, an operator for a `d` + 1 qubit
-    system where the supplied U is an operator for a `d` qubit system.
-    If the first bit is set, apply U to the state for the remaining
-    bits.
+    Produce a Controlled-U operator, an operator for a `d` + `c` qubit
+    system where the supplied U is an operator for a `d` qubit system
+    and `c` is the number of control qubits.
+    If the first `c` bits are all set, apply U to the state for the
+    remaining bits. The control qubits can be chosen freely
+    by the `qubit_indices` the operator is applied with.
+
+    The operator is stored in terms of U, and applying it only
+    applies U to the part of the state for which the control bits
+    are set.
 
     Parameters
     ----------
     U : Operator
         The operator to be conditionally applied.
+    num_controls : int
+        The number of control qubits.
 
     Returns
     -------
     Operator
-        A tensor whose rank is the rank of U plus 2,
+        A tensor whose rank is the rank of U plus 2 * `num_controls`,
         describing the operator.
 
     See Also
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot
-    CNOT, Toffoli, Swap, SqrtSwap, U_f
+    CNOT, Toffoli, Swap, SqrtSwap, U_f, QFT, InverseQFT
     """
 
-    d = U.rank // 2 + 1
-    shape = [2] * 2 * d
-    t = np.zeros(shape, dtype=np.complex128)
+    if num_controls < 1:
+        raise ValueError('ControlledU requires at least one control qubit.')
+
+    U_kernel = U._get_kernel()
+    if isinstance(U_kernel, DiagonalKernel):
+        # Ones everywhere, except where all control bits are set
+        diagonal = np.ones([2] * num_controls + list(U_kernel.diagonal.shape),
+                           dtype=U_kernel.dtype)
+        diagonal[(1,) * num_controls] = U_kernel.diagonal
+        return Operator._from_kernel(DiagonalKernel(diagonal))
+    if isinstance(U_kernel, ControlledKernel):
+        num_controls += U_kernel.num_controls
+        U_kernel = U_kernel.kernel
 
-    # If the first bit is zero, fill in as the identity operator.
-    t[:, 0, ...] = Identity(d)[:, 0, ...]
-    # Else, fill in as Identity tensored with U (Identity for the first bit,
-    # which remains unchanged.
-    t[:, 1, ...] = (Identity() * U)[:, 1, ...]
-    return Operator(t)
+    return Operator._from_kernel(ControlledKernel(U_kernel, num_controls))
 
 
 def U_f(f, d):
@@ -827,27 +1152,90 @@ def U_f(f, d):
     --------
     Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
     RotationX, RotationY, RotationZ, SqrtNot
-    CNOT, Toffoli, Swap, SqrtSwap, ControlledU
+    CNOT, Toffoli, Swap, SqrtSwap, ControlledU, QFT, InverseQFT
     """
     if d < 2:
         raise ValueError('U_f operator requires rank >= 2.')
 
-    operator_shape = [2] * 2 * d
-    t = np.zeros(operator_shape, dtype=np.complex128)
+    # The operator only permutes basis states, so we store the
+    # permutation rather than a 4^d tensor.
+    permutation = np.arange(2**d)
 
-    for bits in product([0, 1], repeat=d):
-        input_bits = bits[:-1]
+    for index, input_bits in enumerate(product([0, 1], repeat=d-1)):
         result = f(*input_bits)
 
         if result not in [0, 1]:
             raise RuntimeError('Function f for U_f operator should be Boolean,' \
                                'i.e., return 0 or 1.')
 
-        result_bits = list(bits)
+        # The last bit is the least significant, so flipping it swaps
+        # a pair of adjacent basis states
         if result:
-            result_bits[-1] = 1 - result_bits[-1]
-        all_bits = tuple([item for sublist in zip(result_bits, bits) for item in sublist])
+            permutation[2*index] = 2*index + 1
+            permutation[2*index + 1] = 2*index
+
+    return Operator._from_kernel(PermutationKernel(permutation, dtype=get_default_dtype()))
+
+
+def QFT(d=1):
+    """
+    Produce the `d`-qubit quantum Fourier transform operator, which maps
+    basis state :math:`|j⟩` to
+    :math:`\\frac{1}{\\sqrt{N}} \\sum_{k=0}^{N-1} e^{2 \\pi i j k / N} |k⟩`,
+    where :math:`N = 2^d` and the first qubit is the most significant bit.
+
+    The operator is applied with a fast Fourier transform over the
+    qubits it is applied to, in :math:`O(d 2^d)` time for a `d`-qubit
+    state. Its dense tensor is only produced if it is asked for.
+
+    Parameters
+    ----------
+    d : int
+        The number of qubits described by the state vector on which
+        the produced operator will act.
+
+    Returns
+    -------
+    Operator
+        A rank `2d` tensor describing the operator.
+
+    See Also
+    --------
+    Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
+    RotationX, RotationY, RotationZ, SqrtNot
+    CNOT, Toffoli, Swap, SqrtSwap, ControlledU, U_f, InverseQFT
+    """
+
+    if d < 1:
+        raise ValueError('Rank must be at least 1.')
+
+    return Operator._from_kernel(FourierKernel(d, dtype=get_default_dtype()))
+
+
+def InverseQFT(d=1):
+    """
+    Produce the `d`-qubit inverse quantum Fourier transform operator,
+    the adjoint of :py:func:`QFT`.
+
+    Parameters
+    ----------
+    d : int
+        The number of qubits described by the state vector on which
+        the produced operator will act.
+
+    Returns
+    -------
+    Operator
+        A rank `2d` tensor describing the operator.
+
+    See Also
+    --------
+    Identity, PauliX, PauliY, PauliZ, Hadamard, Phase, PiBy8, Rotation
+    RotationX, RotationY, RotationZ, SqrtNot
+    CNOT, Toffoli, Swap, SqrtSwap, ControlledU, U_f, QFT
+    """
 
-        t[all_bits] = 1.0 + 0.0j
+    if d < 1:
+        raise ValueError('Rank must be at least 1.')
 
-    return Operator(t)
+    return Operator._from_kernel(FourierKernel(d, inverse=True, dtype=get_default_dtype()))
@@ -0,0 +1,323 @@
+"""
+The product_state module contains the ProductState class, instances of
+which represent states of multi-qubit systems as tensor products of
+states of clusters of qubits that are not entangled with each other.
+
+Operators are applied only to the tensors of the clusters containing
+the qubits they act on, and clusters are merged only when an operator
+acts on qubits of more than one cluster. A state of `n` qubits in
+clusters of :math:`k_i` qubits stores :math:`\\sum_i 2^{k_i}` amplitudes
+rather than :math:`2^n`, so circuits with mostly local structure can be
+simulated on many more qubits than with a :py:class:`.State`.
+
+The ProductState class is aliased at the top-level module, so that
+one can call ``qcircuits.ProductState()`` instead of
+``qcircuits.product_state.ProductState()``.
+"""
+
+
+import numpy as np
+
+from qcircuits.tensors import get_default_dtype
+from qcircuits.state import State, _check_measured_indices
+from qcircuits.kernels import KroneckerKernel, apply_kernel, _needs_renormalization
+from qcircuits.rng import resolve_rng
+
+
+class ProductState:
+    """
+    A state of a `d`-qubit system stored as a tensor product of the
+    states of clusters of qubits, and associated methods. The state is
+    initially :math:`|0\\ldots0⟩`, with each qubit in a cluster of its
+    own.
+
+    Operators and circuits are applied to a product state in the same
+    way as to a :py:class:`.State`, e.g., ``qc.CNOT()(x, [0, 3])``. An
+    operator acting on qubits of several clusters merges them into one
+    cluster, except for tensor products of operators, whose factors are
+    applied separately. Measuring a qubit splits it off into a cluster
+    of its own.
+
+    Parameters
+    ----------
+    d : int
+        The number of qubits.
+    dtype : numpy dtype
+        The precision of the cluster states, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
+    """
+
+    def __init__(self, d, dtype=None):
+        if d < 1:
+            raise ValueError('Rank must be at least 1.')
+        if dtype is None:
+            dtype = get_default_dtype()
+
+        zero = np.array([1, 0], dtype=dtype)
+        # Each cluster is a list of qubit indices, in the order of the
+        # axes of its tensor, and the tensor
+        self._clusters = [([i], zero.copy()) for i in range(d)]
+
+    @staticmethod
+    def from_states(states):
+        """
+        Produce the tensor product of a sequence of states, keeping each
+        state as a separate cluster.
+
+        Parameters
+        ----------
+        states : list of State or ProductState
+            The states, in the order of their qubits.
+
+        Returns
+        -------
+        ProductState
+            The product state.
+        """
+
+        if len(states) == 0:
+            raise ValueError('Supply at least one state.')
+
+        x = ProductState.__new__(ProductState)
+        x._clusters = []
+        offset = 0
+        for state in states:
+            if isinstance(state, ProductState):
+                x._clusters += [([offset + i for i in qubits], t.copy())
+                                for qubits, t in state._clusters]
+            else:
+                x._clusters.append((list(range(offset, offset + state.rank)),
+                                    np.array(state._t, order='C')))
+            offset += state.rank
+        return x
+
+    def __repr__(self):
+        return 'ProductState(d={}, clusters={})'.format(self.rank, self.clusters)
+
+    def __str__(self):
+        s = '{}-qubit product state. Clusters:\n'.format(self.rank)
+        s += '\n'.join('{}:\n{}'.format(qubits, t) for qubits, t in self._clusters)
+        return s
+
+    @property
+    def rank(self):
+        """
+        Get the number of qubits of the state.
+
+        Returns
+        -------
+        int
+            The number of qubits.
+        """
+
+        return sum(len(qubits) for qubits, _ in self._clusters)
+
+    @property
+    def shape(self):
+        """
+        Get the shape of the tensor of the equivalent :py:class:`.State`.
+
+        Returns
+        -------
+        tuple of int
+            The shape, [2] :math:`\\times d`.
+        """
+
+        return (2,) * self.rank
+
+    @property
+    def dtype(self):
+        """
+        Get the precision of the cluster states.
+
+        Returns
+        -------
+        numpy dtype
+            complex64 or complex128.
+        """
+
+        return np.result_type(*(t.dtype for _, t in self._clusters))
+
+    @property
+    def clusters(self):
+        """
+        Get the qubits of each cluster.
+
+        Returns
+        -------
+        list of tuple of int
+            The qubit indices of each cluster, in ascending order, with
+            the clusters ordered by their first qubit.
+        """
+
+        return sorted(tuple(sorted(qubits)) for qubits, _ in self._clusters)
+
+    def tensor_product(self, arg):
+        """
+        Return the product state given by the tensor product of this
+        state with another state, keeping the clusters of both. Can
+        also be called with the infix `*` operator, i.e., x * y, for
+        which `x` may also be a :py:class:`.State`.
+
+        Parameters
+        ----------
+        arg : State or ProductState
+            The state with which to take the tensor product.
+
+        Returns
+        -------
+        ProductState
+            The product state of this state's qubits followed by those
+            of `arg`.
+        """
+
+        return ProductState.from_states([self, arg])
+
+    def __mul__(self, arg):
+        return self.tensor_product(arg)
+
+    def __rmul__(self, arg):
+        if isinstance(arg, State):
+            return ProductState.from_states([arg, self])
+        return NotImplemented
+
+    def _copy_into(self, out):
+        # Copy the state into `out`, or a new state if it is None
+        if out is self:
+            return out
+        if out is None:
+            out = ProductState.__new__(ProductState)
+        out._clusters = [(list(qubits), t.copy()) for qubits, t in self._clusters]
+        return out
+
+    def _cluster_of(self, qubit):
+        for k, (qubits, _) in enumerate(self._clusters):
+            if qubit in qubits:
+                return k
+
+    def _merge(self, qubit_indices):
+        # Merge the clusters containing the given qubits into one,
+        # returning its index
+        ks = sorted(set(self._cluster_of(i) for i in qubit_indices))
+        if len(ks) == 1:
+            return ks[0]
+
+        qubits = []
+        t = np.ones((), dtype=self.dtype)
+        for k in ks:
+            qubits += self._clusters[k][0]
+            t = np.multiply.outer(t, self._clusters[k][1])
+        for k in reversed(ks[1:]):
+            del self._clusters[k]
+        self._clusters[ks[0]] = (qubits, t)
+        return ks[0]
+
+    def _apply_kernel(self, kernel, qubit_indices):
+        # Apply an operator's kernel to the cluster of the given qubits
+        if isinstance(kernel, KroneckerKernel):
+            for factor, qubits in zip(kernel.factors, kernel.factor_qubits):
+                self._apply_kernel(factor, [qubit_indices[i] for i in qubits])
+            return
+
+        k = self._merge(qubit_indices)
+        qubits, t = self._clusters[k]
+        apply_kernel(kernel, t, [qubits.index(i) for i in qubit_indices])
+        # As for a State, unitary operators need no renormalization
+        if _needs_renormalization(kernel.unitary, t.dtype):
+            t /= np.linalg.norm(t)
+        self._clusters[k] = (qubits, t)
+
+    def amplitude(self, bits):
+        """
+        Get the probability amplitude of a computational basis state.
+
+        Parameters
+        ----------
+        bits : iterable of int
+            The bit of each qubit in the basis state.
+
+        Returns
+        -------
+        complex
+            The amplitude.
+        """
+
+        bits = list(bits)
+        if len(bits) != self.rank or any(b not in [0, 1] for b in bits):
+            raise ValueError('Supply a bit for each qubit.')
+
+        amplitude = 1 + 0j
+        for qubits, t in self._clusters:
+            amplitude *= complex(t[tuple(bits[i] for i in qubits)])
+        return amplitude
+
+    def to_state(self):
+        """
+        Produce the :py:class:`.State` with the same amplitudes. The
+        state has :math:`2^d` amplitudes, so this is only feasible for
+        small numbers of qubits.
+
+        Returns
+        -------
+        State
+            The state vector.
+        """
+
+        qubits = []
+        t = np.ones((), dtype=self.dtype)
+        for cluster_qubits, cluster_t in self._clusters:
+            qubits += cluster_qubits
+            t = np.multiply.outer(t, cluster_t)
+        return State(np.transpose(t, np.argsort(qubits)), dtype=self.dtype)
+
+    def measure(self, qubit_indices=None, rng=None):
+        """
+        Measure the state with respect to the computational bases
+        of the qubits indicated by `qubit_indices`.
+        Measuring a state will modify the state in-place, and split
+        each measured qubit off into a cluster of its own.
+        If no indices are indicated, the whole state is measured.
+
+        Parameters
+        ----------
+        qubit_indices : int or iterable
+            An index or indices indicating the qubit(s) whose
+            computational bases the measurement of the state will be
+            made with respect to. If no `qubit_indices` are given,
+            the whole state is measured.
+        rng : None, int, numpy.random.Generator, or numpy.random.RandomState
+            The random number generator, or a seed for one, to draw the
+            outcome with. If not given, numpy's global random state is
+            used. See :py:mod:`qcircuits.rng`.
+
+        Returns
+        -------
+        int or tuple of int
+            The measurement outcomes for the measured qubit(s).
+            If the `qubit_indices` parameter is supplied as an int,
+            an int is returned, otherwise a tuple.
+        """
+
+        qubit_indices, int_arg = _check_measured_indices(qubit_indices, self.rank)
+        rng = resolve_rng(rng)
+
+        bits = []
+        for i in qubit_indices:
+            k = self._cluster_of(i)
+            qubits, t = self._clusters[k]
+            state = State(t, copy=False, dtype=t.dtype)
+            outcome = state.measure(qubits.index(i), remove=len(qubits) > 1, rng=rng)
+
+            if len(qubits) > 1:
+                # The measured qubit is no longer entangled with the rest
+                self._clusters[k] = ([q for q in qubits if q != i], state._t)
+                basis = np.zeros(2, dtype=t.dtype)
+                basis[outcome] = 1
+                self._clusters.append(([i], basis))
+            else:
+                self._clusters[k] = (qubits, state._t)
+            bits.append(outcome)
+
+        if int_arg:
+            return bits[0]
+        return tuple(bits)
@@ -0,0 +1,193 @@
+"""
+The results module contains functions for working with measurement
+outcomes in packed form, for experiments with many shots.
+
+A packed outcome stores the bits measured in one shot as the bits of an
+unsigned integer, with the first measured qubit as the most significant
+bit, matching the order of the computational basis states. Outcomes of
+up to 64 qubits are packed into a numpy uint64 array with one element
+per shot. Outcomes of more qubits are packed into a numpy uint8 array
+with one row of bytes per shot, as produced by ``numpy.packbits``.
+Either way, a shot costs about one bit per qubit, rather than the
+hundreds of bytes of a tuple of Python ints.
+
+Packed outcomes are produced by :py:meth:`.State.sample` and
+:py:meth:`.StateBatch.measure` with ``packed=True``, or from arrays of
+bits with :py:func:`pack_bits`.
+"""
+
+
+import numpy as np
+
+
+# Outcomes of more qubits than this are packed into rows of bytes
+max_word_qubits = 64
+
+
+def _check_num_qubits(packed, num_qubits):
+    packed = np.asarray(packed)
+    if num_qubits <= max_word_qubits:
+        if packed.ndim != 1:
+            raise ValueError('Outcomes of up to {} qubits should be a 1D array.'.format(
+                max_word_qubits))
+        return packed.astype(np.uint64, copy=False)
+
+    if packed.ndim != 2 or packed.shape[1] != (num_qubits + 7) // 8:
+        raise ValueError('Outcomes of more than {} qubits should be a 2D array '
+                         'of bytes.'.format(max_word_qubits))
+    return packed.astype(np.uint8, copy=False)
+
+
+def pack_bits(bits):
+    """
+    Pack an array of measured bits, one row per shot.
+
+    Parameters
+    ----------
+    bits : numpy int array
+        An array of zeros and ones with shape (shots, num_qubits).
+
+    Returns
+    -------
+    numpy uint64 or uint8 array
+        The packed outcomes: a uint64 array of shape (shots,) if there
+        are at most 64 qubits, and otherwise a uint8 array of shape
+        (shots, ceil(num_qubits / 8)).
+    """
+
+    bits = np.asarray(bits)
+    if bits.ndim != 2:
+        raise ValueError('The bits should have shape (shots, num_qubits).')
+    num_qubits = bits.shape[1]
+
+    if num_qubits > max_word_qubits:
+        return np.packbits(bits.astype(np.uint8, copy=False), axis=1)
+
+    weights = np.left_shift(np.uint64(1),
+                            np.arange(num_qubits - 1, -1, -1, dtype=np.uint64))
+    packed = np.zeros(bits.shape[0], dtype=np.uint64)
+    for j in range(num_qubits):
+        packed |= bits[:, j].astype(np.uint64) * weights[j]
+    return packed
+
+
+def unpack_bits(packed, num_qubits):
+    """
+    Unpack packed outcomes into an array of bits, one row per shot.
+
+    Parameters
+    ----------
+    packed : numpy uint64 or uint8 array
+        The packed outcomes.
+    num_qubits : int
+        The number of measured qubits.
+
+    Returns
+    -------
+    numpy uint8 array
+        An array of zeros and ones with shape (shots, num_qubits).
+    """
+
+    packed = _check_num_qubits(packed, num_qubits)
+
+    if num_qubits > max_word_qubits:
+        return np.unpackbits(packed, axis=1)[:, :num_qubits]
+
+    shifts = np.arange(num_qubits - 1, -1, -1, dtype=np.uint64)
+    return ((packed[:, None] >> shifts) & np.uint64(1)).astype(np.uint8)
+
+
+def marginal(packed, num_qubits, positions):
+    """
+    Select some of the measured qubits from packed outcomes, e.g., to
+    marginalize over the others when histogramming.
+
+    Parameters
+    ----------
+    packed : numpy uint64 or uint8 array
+        The packed outcomes.
+    num_qubits : int
+        The number of measured qubits.
+    positions : list of int
+        The positions, among the measured qubits, of the qubits to keep,
+        in the order they should appear in the result.
+
+    Returns
+    -------
+    numpy uint64 or uint8 array
+        The packed outcomes of the selected qubits.
+    """
+
+    positions = list(positions)
+    if len(positions) == 0:
+        raise ValueError('Must keep at least one qubit.')
+    if min(positions) < 0 or max(positions) >= num_qubits:
+        raise ValueError('Positions should be between 0 and num_qubits-1.')
+
+    packed = _check_num_qubits(packed, num_qubits)
+
+    if num_qubits > max_word_qubits or len(positions) > max_word_qubits:
+        return pack_bits(unpack_bits(packed, num_qubits)[:, positions])
+
+    m = len(positions)
+    result = np.zeros(packed.shape[0], dtype=np.uint64)
+    for j, p in enumerate(positions):
+        bit = (packed >> np.uint64(num_qubits - 1 - p)) & np.uint64(1)
+        result |= bit << np.uint64(m - 1 - j)
+    return result
+
+
+def histogram(packed, num_qubits):
+    """
+    Count the number of times each outcome occurred.
+
+    Parameters
+    ----------
+    packed : numpy uint64 or uint8 array
+        The packed outcomes.
+    num_qubits : int
+        The number of measured qubits.
+
+    Returns
+    -------
+    (numpy uint64 or uint8 array, numpy int array)
+        The distinct packed outcomes in ascending order, and the number
+        of times each occurred.
+    """
+
+    packed = _check_num_qubits(packed, num_qubits)
+
+    if num_qubits > max_word_qubits:
+        return np.unique(packed, axis=0, return_counts=True)
+
+    # Count densely when the table of all outcomes is not much larger
+    # than the outcomes themselves
+    if 2**num_qubits <= max(packed.shape[0], 1024):
+        counts = np.bincount(packed.astype(np.intp), minlength=2**num_qubits)
+        outcomes = np.flatnonzero(counts)
+        return outcomes.astype(np.uint64), counts[outcomes]
+
+    return np.unique(packed, return_counts=True)
+
+
+def to_bitstrings(packed, num_qubits):
+    """
+    Convert packed outcomes to strings of '0' and '1' characters, with
+    the first measured qubit first.
+
+    Parameters
+    ----------
+    packed : numpy uint64 or uint8 array
+        The packed outcomes.
+    num_qubits : int
+        The number of measured qubits.
+
+    Returns
+    -------
+    numpy str array
+        One string of length `num_qubits` per shot.
+    """
+
+    bits = unpack_bits(packed, num_qubits)
+    chars = np.ascontiguousarray(bits + np.uint8(ord('0')))
+    return chars.view('S{}'.format(num_qubits))[:, 0].astype('U')
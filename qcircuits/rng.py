@@ -0,0 +1,99 @@
+"""
+The rng module contains functions for controlling the random numbers
+used to draw measurement outcomes.
+
+Every method that draws measurement outcomes, e.g.,
+:py:meth:`.State.measure`, :py:meth:`.State.sample`,
+:py:meth:`.StateBatch.measure` and :py:meth:`.DensityOperator.measure`,
+takes an `rng` argument, which may be
+
+* None, to use numpy's global random state, as seeded by
+  ``numpy.random.seed``,
+* an int or ``numpy.random.SeedSequence``, to use a new
+  ``numpy.random.Generator`` seeded with it, or
+* a ``numpy.random.Generator`` or ``numpy.random.RandomState``, which
+  is used directly.
+
+Passing the same Generator to a sequence of calls makes the outcomes
+reproducible. For sampling in parallel, :py:func:`spawn` produces
+statistically independent generators, one per worker.
+"""
+
+
+import numpy as np
+
+
+def resolve_rng(rng):
+    """
+    Get the random number generator described by an `rng` argument.
+
+    Parameters
+    ----------
+    rng : None, int, numpy.random.SeedSequence, numpy.random.Generator, or numpy.random.RandomState
+        The description of the random number generator. The
+        numpy.random module, which this function returns for None, is
+        accepted as well, and also means numpy's global random state.
+
+    Returns
+    -------
+    numpy.random.Generator, numpy.random.RandomState, or the numpy.random module
+        An object with the sampling methods of a random number generator.
+    """
+
+    if rng is None or rng is np.random:
+        # The numpy.random module has the same sampling functions,
+        # using the global random state. Accepting it as well means a
+        # resolved rng can be passed on.
+        return np.random
+    if isinstance(rng, (np.random.Generator, np.random.RandomState)):
+        return rng
+    if isinstance(rng, (int, np.integer, np.random.SeedSequence)):
+        return np.random.default_rng(rng)
+
+    raise ValueError('rng should be None, a seed, a SeedSequence, '
+                     'a Generator, or a RandomState.')
+
+
+def spawn(rng, n):
+    """
+    Produce `n` statistically independent random number generators,
+    e.g., one for each worker sampling measurement outcomes in
+    parallel. Spawning from the same seed always gives the same
+    generators, so parallel sampling is reproducible.
+
+    Parameters
+    ----------
+    rng : None, int, numpy.random.SeedSequence, or numpy.random.Generator
+        The seed or generator to spawn from. If None, fresh entropy
+        from the operating system is used.
+    n : int
+        The number of generators.
+
+    Returns
+    -------
+    list of numpy.random.Generator
+        The independent generators.
+    """
+
+    if isinstance(rng, np.random.Generator):
+        seed_sequence = np.random.SeedSequence(rng.integers(2**63))
+    elif isinstance(rng, np.random.SeedSequence):
+        seed_sequence = rng
+    elif rng is None or isinstance(rng, (int, np.integer)):
+        seed_sequence = np.random.SeedSequence(rng)
+    else:
+        raise ValueError('rng should be None, a seed, a SeedSequence, or a Generator.')
+
+    return [np.random.default_rng(s) for s in seed_sequence.spawn(n)]
+
+
+def _choice(rng, ps, size=None):
+    # Draw outcomes with probabilities ps by inverting the CDF, which is
+    # faster than Generator.choice and works the same for every kind of
+    # generator. The probabilities need not be exactly normalized.
+    cdf = np.cumsum(ps)
+    u = rng.random(size) * cdf[-1]
+    outcomes = np.minimum(np.searchsorted(cdf, u, side='right'), len(ps) - 1)
+    if size is None:
+        return int(outcomes)
+    return outcomes
@@ -0,0 +1,435 @@
+"""
+The sparse_state module contains the SparseState class, instances of
+which represent states of multi-qubit systems by their nonzero
+probability amplitudes only.
+
+Computational basis states, e.g., those produced by
+:py:func:`.bitstring`, :py:func:`.zeros` and :py:func:`.ones` with
+``sparse=True``, stay with a handful of nonzero amplitudes when
+permutation operators such as :py:func:`.PauliX`, :py:func:`.CNOT`,
+:py:func:`.Toffoli` and :py:func:`.U_f` are applied to them, so
+reversible circuits can be simulated on 40 or more qubits. Applying an
+operator takes time proportional to the number of nonzero amplitudes.
+A sparse state switches to a dense tensor once the fraction of nonzero
+amplitudes exceeds a threshold.
+
+The SparseState class is aliased at the top-level module, so that
+one can call ``qcircuits.SparseState()`` instead of
+``qcircuits.sparse_state.SparseState()``.
+"""
+
+
+import weakref
+
+import numpy as np
+
+from qcircuits.tensors import get_default_dtype
+from qcircuits.state import State, _check_measured_indices
+from qcircuits.kernels import KroneckerKernel, apply_kernel, _needs_renormalization
+from qcircuits.rng import resolve_rng, _choice
+
+
+# The largest number of qubits whose basis state indices fit in an int64
+max_sparse_qubits = 62
+
+# Amplitudes with a smaller magnitude after applying an operator are
+# dropped, so that cancelling amplitudes do not accumulate
+zero_tolerance = 1e-12
+
+# The nonzero entries of the kernels applied to sparse states, by column
+_columns = weakref.WeakKeyDictionary()
+
+
+def _kernel_columns(kernel):
+    # The nonzero entries of a kernel's matrix, sorted by column, with
+    # the offset of the first entry of each column
+    if kernel in _columns:
+        return _columns[kernel]
+
+    rows, cols, values = kernel.to_coo()
+    order = np.argsort(cols, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(np.bincount(cols, minlength=2**kernel.d))])
+    entry = (starts, np.asarray(rows)[order].astype(np.int64), np.asarray(values)[order])
+    _columns[kernel] = entry
+    return entry
+
+
+class SparseState:
+    """
+    A state of a `d`-qubit system stored as the indices of the
+    computational basis states with nonzero amplitudes, in ascending
+    order, and their amplitudes. The first qubit is the most significant
+    bit of the indices.
+
+    Operators and circuits are applied to a sparse state in the same
+    way as to a :py:class:`.State`, e.g., ``qc.CNOT()(x, [0, 3])``.
+    Once the fraction of the :math:`2^d` amplitudes that are nonzero
+    exceeds `densify_threshold`, the state is stored as a dense tensor,
+    and operators are applied to it as to a :py:class:`.State`.
+
+    Parameters
+    ----------
+    d : int
+        The number of qubits.
+    indices : iterable of int
+        The indices of the basis states with nonzero amplitudes.
+        Defaults to the single basis state :math:`|0\\ldots0⟩`.
+    amplitudes : iterable of complex
+        The amplitude of each basis state in `indices`. Defaults to
+        equal amplitudes. The state is renormalized.
+    densify_threshold : float
+        The fraction of nonzero amplitudes above which the state is
+        stored as a dense tensor.
+    dtype : numpy dtype
+        The precision of the amplitudes, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
+    """
+
+    def __init__(self, d, indices=None, amplitudes=None, densify_threshold=0.1, dtype=None):
+        if d < 1:
+            raise ValueError('Rank must be at least 1.')
+        if d > max_sparse_qubits:
+            raise ValueError('Sparse states have at most {} qubits.'.format(
+                max_sparse_qubits))
+        if dtype is None:
+            dtype = get_default_dtype()
+
+        if indices is None:
+            indices = [0]
+        indices = np.array(indices, dtype=np.int64).reshape(-1)
+        if amplitudes is None:
+            amplitudes = np.ones(len(indices))
+        amplitudes = np.array(amplitudes, dtype=dtype).reshape(-1)
+
+        if len(indices) == 0 or len(indices) != len(amplitudes):
+            raise ValueError('Supply an amplitude for each of at least one index.')
+        if np.any(indices < 0) or np.any(indices >= 2**d):
+            raise ValueError('Indices should be between 0 and 2^d-1 for a d-qubit state.')
+        if len(np.unique(indices)) != len(indices):
+            raise ValueError('Indices list contains repeated elements.')
+
+        self._d = d
+        self.densify_threshold = densify_threshold
+        order = np.argsort(indices)
+        self._indices = indices[order]
+        self._amplitudes = amplitudes[order]
+        # The dense tensor, once the state is densified
+        self._t = None
+        self._drop_zeros()
+        self._check_density()
+
+    @staticmethod
+    def from_state(state, densify_threshold=0.1):
+        """
+        Produce a sparse state from the nonzero amplitudes of a
+        :py:class:`.State`.
+
+        Parameters
+        ----------
+        state : State
+            The state.
+        densify_threshold : float
+            The fraction of nonzero amplitudes above which the state is
+            stored as a dense tensor.
+
+        Returns
+        -------
+        SparseState
+            The sparse state.
+        """
+
+        v = state._t.reshape(-1)
+        indices = np.flatnonzero(v)
+        return SparseState(state.rank, indices, v[indices], densify_threshold,
+                           dtype=state.dtype)
+
+    def __repr__(self):
+        return 'SparseState(d={}, nnz={})'.format(self.rank, self.nnz)
+
+    def __str__(self):
+        if self.dense:
+            return '{}-qubit sparse state, stored densely. Tensor:\n{}'.format(
+                self.rank, self._t)
+        terms = ['{}|{}⟩'.format(a, format(int(i), '0{}b'.format(self.rank)))
+                 for i, a in zip(self._indices, self._amplitudes)]
+        return '{}-qubit sparse state:\n{}'.format(self.rank, '\n'.join(terms))
+
+    @property
+    def rank(self):
+        """
+        Get the number of qubits of the state.
+
+        Returns
+        -------
+        int
+            The number of qubits.
+        """
+
+        return self._d
+
+    @property
+    def shape(self):
+        """
+        Get the shape of the tensor of the equivalent :py:class:`.State`.
+
+        Returns
+        -------
+        tuple of int
+            The shape, [2] :math:`\\times d`.
+        """
+
+        return (2,) * self.rank
+
+    @property
+    def dtype(self):
+        """
+        Get the precision of the amplitudes.
+
+        Returns
+        -------
+        numpy dtype
+            complex64 or complex128.
+        """
+
+        return self._amplitudes.dtype if self._t is None else self._t.dtype
+
+    @property
+    def dense(self):
+        """
+        Get whether the state has been densified, i.e., is stored as a
+        dense tensor.
+
+        Returns
+        -------
+        bool
+            Whether the state is stored densely.
+        """
+
+        return self._t is not None
+
+    @property
+    def nnz(self):
+        """
+        Get the number of nonzero amplitudes.
+
+        Returns
+        -------
+        int
+            The number of nonzero amplitudes.
+        """
+
+        if self.dense:
+            return int(np.count_nonzero(self._t))
+        return len(self._indices)
+
+    @property
+    def indices(self):
+        """
+        Get the indices of the computational basis states with nonzero
+        amplitudes, with the first qubit as the most significant bit.
+
+        Returns
+        -------
+        numpy int64 array
+            The indices, in ascending order.
+        """
+
+        if self.dense:
+            return np.flatnonzero(self._t)
+        return self._indices.copy()
+
+    @property
+    def amplitudes(self):
+        """
+        Get the nonzero amplitudes, in the order of :py:attr:`indices`.
+
+        Returns
+        -------
+        numpy complex128 array
+            The nonzero amplitudes.
+        """
+
+        if self.dense:
+            v = self._t.reshape(-1)
+            return v[np.flatnonzero(v)]
+        return self._amplitudes.copy()
+
+    def _copy_into(self, out):
+        # Copy the state into `out`, or a new state if it is None
+        if out is self:
+            return out
+        if out is None:
+            out = SparseState.__new__(SparseState)
+        out._d = self._d
+        out.densify_threshold = self.densify_threshold
+        out._indices = self._indices.copy()
+        out._amplitudes = self._amplitudes.copy()
+        out._t = None if self._t is None else self._t.copy()
+        return out
+
+    def _drop_zeros(self, unitary=False):
+        # Drop the negligible amplitudes, and renormalize unless nothing
+        # was dropped after applying a unitary operator
+        keep = np.abs(self._amplitudes) > zero_tolerance
+        dropped = not np.all(keep)
+        if dropped:
+            self._indices = self._indices[keep]
+            self._amplitudes = self._amplitudes[keep]
+        if not dropped and not _needs_renormalization(unitary, self.dtype):
+            return
+        norm = np.linalg.norm(self._amplitudes)
+        if norm == 0:
+            raise RuntimeError('The state has no nonzero amplitudes.')
+        self._amplitudes /= norm
+
+    def _check_density(self):
+        # Switch to a dense tensor once the state is dense enough
+        if not self.dense and len(self._indices) > self.densify_threshold * 2**self._d:
+            t = np.zeros(2**self._d, dtype=self._amplitudes.dtype)
+            t[self._indices] = self._amplitudes
+            self._t = t.reshape([2] * self._d)
+            self._indices = np.zeros(0, dtype=np.int64)
+            self._amplitudes = np.zeros(0, dtype=self._t.dtype)
+
+    def _apply_kernel(self, kernel, qubit_indices):
+        # Apply an operator's kernel to the given qubits
+        if self.dense:
+            apply_kernel(kernel, self._t, list(qubit_indices))
+            # As for a State, unitary operators need no renormalization
+            if _needs_renormalization(kernel.unitary, self.dtype):
+                self._t /= np.linalg.norm(self._t)
+            return
+
+        if isinstance(kernel, KroneckerKernel):
+            for factor, qubits in zip(kernel.factors, kernel.factor_qubits):
+                self._apply_kernel(factor, [qubit_indices[i] for i in qubits])
+            return
+
+        starts, rows, values = _kernel_columns(kernel)
+        k = len(qubit_indices)
+        shifts = self._d - 1 - np.array(qubit_indices, dtype=np.int64)
+
+        # The column of the kernel's matrix for each basis state, and
+        # its index with the kernel's qubits cleared
+        bits = (self._indices[:, None] >> shifts) & 1
+        cols = bits.dot(1 << np.arange(k - 1, -1, -1, dtype=np.int64))
+        rest = self._indices & ~np.bitwise_or.reduce(1 << shifts)
+
+        # Each basis state is mapped to the nonzero entries of its column
+        counts = starts[cols + 1] - starts[cols]
+        source = np.repeat(np.arange(len(cols)), counts)
+        first = np.cumsum(counts) - counts
+        entry = starts[cols][source] + np.arange(len(source)) - first[source]
+
+        new_bits = (rows[entry][:, None] >> np.arange(k - 1, -1, -1)) & 1
+        new_indices = rest[source] | np.bitwise_or.reduce(new_bits << shifts, axis=1)
+        new_amplitudes = self._amplitudes[source] * values[entry]
+
+        # Sum the amplitudes mapped to the same basis state
+        self._indices, inverse = np.unique(new_indices, return_inverse=True)
+        amplitudes = np.zeros(len(self._indices), dtype=np.result_type(
+            new_amplitudes.dtype, self._amplitudes.dtype))
+        np.add.at(amplitudes, inverse.reshape(-1), new_amplitudes)
+        self._amplitudes = amplitudes.astype(self.dtype, copy=False)
+
+        self._drop_zeros(kernel.unitary)
+        self._check_density()
+
+    def amplitude(self, bits):
+        """
+        Get the probability amplitude of a computational basis state.
+
+        Parameters
+        ----------
+        bits : iterable of int
+            The bit of each qubit in the basis state.
+
+        Returns
+        -------
+        complex
+            The amplitude.
+        """
+
+        bits = list(bits)
+        if len(bits) != self.rank or any(b not in [0, 1] for b in bits):
+            raise ValueError('Supply a bit for each qubit.')
+
+        if self.dense:
+            return complex(self._t[tuple(bits)])
+        index = int(''.join(str(b) for b in bits), 2)
+        i = np.searchsorted(self._indices, index)
+        if i < len(self._indices) and self._indices[i] == index:
+            return complex(self._amplitudes[i])
+        return 0j
+
+    def to_state(self):
+        """
+        Produce the :py:class:`.State` with the same amplitudes. The
+        state has :math:`2^d` amplitudes, so this is only feasible for
+        small numbers of qubits.
+
+        Returns
+        -------
+        State
+            The state vector.
+        """
+
+        if self.dense:
+            return State(self._t, dtype=self.dtype)
+        t = np.zeros(2**self._d, dtype=self.dtype)
+        t[self._indices] = self._amplitudes
+        return State(t.reshape([2] * self._d), copy=False, dtype=self.dtype)
+
+    def measure(self, qubit_indices=None, rng=None):
+        """
+        Measure the state with respect to the computational bases
+        of the qubits indicated by `qubit_indices`.
+        Measuring a state will modify the state in-place.
+        If no indices are indicated, the whole state is measured.
+
+        Parameters
+        ----------
+        qubit_indices : int or iterable
+            An index or indices indicating the qubit(s) whose
+            computational bases the measurement of the state will be
+            made with respect to. If no `qubit_indices` are given,
+            the whole state is measured.
+        rng : None, int, numpy.random.Generator, or numpy.random.RandomState
+            The random number generator, or a seed for one, to draw the
+            outcome with. If not given, numpy's global random state is
+            used. See :py:mod:`qcircuits.rng`.
+
+        Returns
+        -------
+        int or tuple of int
+            The measurement outcomes for the measured qubit(s).
+            If the `qubit_indices` parameter is supplied as an int,
+            an int is returned, otherwise a tuple.
+        """
+
+        if self.dense:
+            state = State(self._t, copy=False, dtype=self.dtype)
+            bits = state.measure(qubit_indices, rng=rng)
+            self._t = state._t
+            return bits
+
+        qubit_indices, int_arg = _check_measured_indices(qubit_indices, self.rank)
+        shifts = self._d - 1 - np.array(qubit_indices, dtype=np.int64)
+
+        # The outcome for each nonzero amplitude, and the probability of
+        # each outcome that occurs
+        outcomes = self._indices[:, None] >> shifts & 1
+        occurring, inverse = np.unique(outcomes, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        ps = np.bincount(inverse, weights=np.abs(self._amplitudes)**2)
+
+        outcome = _choice(resolve_rng(rng), ps)
+        keep = inverse == outcome
+        self._indices = self._indices[keep]
+        self._amplitudes = self._amplitudes[keep]
+        self._amplitudes /= np.linalg.norm(self._amplitudes)
+
+        bits = tuple(int(b) for b in occurring[outcome])
+        if int_arg:
+            return bits[0]
+        return bits
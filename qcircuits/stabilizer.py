@@ -0,0 +1,348 @@
+"""
+The stabilizer module contains the StabilizerState class, instances of
+which represent stabilizer states of multi-qubit systems in the tableau
+form of Aaronson and Gottesman, "Improved simulation of stabilizer
+circuits", Phys. Rev. A 70, 052328 (2004).
+
+A stabilizer state of `d` qubits is stored as :math:`2d` Pauli
+operators, rather than :math:`2^d` amplitudes, so circuits of Clifford
+operators (e.g., Hadamard, Phase, the Pauli operators, CNOT and Swap)
+and computational basis measurements can be simulated on thousands of
+qubits. Applying an operator to a few qubits takes O(d) time, and
+measuring a qubit takes O(d^2) time.
+
+The StabilizerState class is aliased at the top-level module, so that
+one can call ``qcircuits.StabilizerState()`` instead of
+``qcircuits.stabilizer.StabilizerState()``.
+"""
+
+
+from itertools import product
+import weakref
+
+import numpy as np
+
+from qcircuits.state import State, _check_measured_indices
+from qcircuits.kernels import KroneckerKernel, matrix_from_tensor
+from qcircuits.rng import resolve_rng
+
+
+# Operators on more qubits than this are not checked for being Clifford
+# operators, as the check takes O(16^k) time for a k-qubit operator
+max_clifford_qubits = 3
+
+# The conjugation tables of the kernels applied to stabilizer states
+_tables = weakref.WeakKeyDictionary()
+
+_paulis = {
+    (0, 0): np.eye(2, dtype=np.complex128),
+    (1, 0): np.array([[0, 1], [1, 0]], dtype=np.complex128),
+    (0, 1): np.array([[1, 0], [0, -1]], dtype=np.complex128),
+    (1, 1): np.array([[0, -1j], [1j, 0]], dtype=np.complex128),
+}
+
+
+def _pauli_matrices(k):
+    # The 4^k Hermitian Pauli operators on k qubits. Operator
+    # (x << k) | z has X on the qubits whose bits are set in x, Z on
+    # those set in z, and Y on those set in both, with the first qubit
+    # as the most significant bit.
+    matrices = []
+    for x, z in product(range(2**k), repeat=2):
+        M = np.ones((1, 1), dtype=np.complex128)
+        for j in range(k - 1, -1, -1):
+            M = np.kron(M, _paulis[(x >> j & 1, z >> j & 1)])
+        matrices.append(M)
+    return np.array(matrices)
+
+
+def _clifford_table(kernel):
+    # The action of a k-qubit Clifford operator U by conjugation, as a
+    # table over the 4^k Pauli operators P: the x and z bits of the Pauli
+    # operator P' with U P U^† = ±P', and whether the sign is negative
+    if kernel in _tables:
+        return _tables[kernel]
+
+    k = kernel.d
+    if k > max_clifford_qubits:
+        raise ValueError('Only Clifford operators on up to {} qubits, or tensor products '
+                         'of them, can be applied to stabilizer states.'.format(
+                             max_clifford_qubits))
+
+    U = matrix_from_tensor(kernel.to_tensor()).astype(np.complex128)
+    paulis = _pauli_matrices(k)
+    images = np.einsum('ij,ajk,lk->ail', U, paulis, np.conj(U))
+    # The coefficient of each Pauli operator in each image
+    coefficients = np.einsum('bij,aji->ab', paulis, images) / 2**k
+
+    image = np.argmax(np.abs(coefficients), axis=1)
+    signs = coefficients[np.arange(4**k), image]
+    if (not np.allclose(np.abs(signs), 1.0, atol=1e-6) or
+            not np.allclose(signs.imag, 0.0, atol=1e-6)):
+        raise ValueError('The operator is not a Clifford operator, so cannot be '
+                         'applied to a stabilizer state.')
+
+    bits = (image[:, None] >> np.arange(2*k - 1, -1, -1)) & 1
+    table = (bits[:, :k].astype(bool), bits[:, k:].astype(bool), signs.real < 0)
+    _tables[kernel] = table
+    return table
+
+
+def _phase_exponents(x1, z1, x2, z2):
+    # The power of i picked up by multiplying the single-qubit Pauli
+    # operators with bits (x1, z1) and (x2, z2), for each qubit
+    x1 = x1.astype(np.int8)
+    z1 = z1.astype(np.int8)
+    x2 = x2.astype(np.int8)
+    z2 = z2.astype(np.int8)
+    return (x1 * z1 * (z2 - x2) +
+            x1 * (1 - z1) * z2 * (2*x2 - 1) +
+            (1 - x1) * z1 * x2 * (1 - 2*z2))
+
+
+class StabilizerState:
+    """
+    A stabilizer state of a `d`-qubit system, stored as a tableau of
+    `d` destabilizer and `d` stabilizer Pauli operators, and associated
+    methods. The state is initially :math:`|0\\ldots0⟩`.
+
+    Clifford operators are applied to a stabilizer state in the same
+    way as to a :py:class:`.State`, e.g., ``qc.CNOT()(x, [0, 3])``, and
+    so are :py:class:`.Circuit` objects made of them. Other operators,
+    e.g., :py:func:`.PiBy8` and :py:func:`.Toffoli`, raise a ValueError.
+
+    Parameters
+    ----------
+    d : int
+        The number of qubits.
+    """
+
+    def __init__(self, d):
+        if d < 1:
+            raise ValueError('Rank must be at least 1.')
+
+        # Rows 0 to d-1 are the destabilizers, and rows d to 2d-1 the
+        # stabilizers
+        self._x = np.zeros((2*d, d), dtype=bool)
+        self._z = np.zeros((2*d, d), dtype=bool)
+        self._r = np.zeros(2*d, dtype=bool)
+        self._x[np.arange(d), np.arange(d)] = True
+        self._z[d + np.arange(d), np.arange(d)] = True
+
+    def __repr__(self):
+        return 'StabilizerState(d={})'.format(self.rank)
+
+    def __str__(self):
+        s = '{}-qubit stabilizer state. Stabilizers:\n'.format(self.rank)
+        s += '\n'.join(self.stabilizers)
+        return s
+
+    @property
+    def rank(self):
+        """
+        Get the number of qubits of the state.
+
+        Returns
+        -------
+        int
+            The number of qubits.
+        """
+
+        return self._x.shape[1]
+
+    @property
+    def shape(self):
+        """
+        Get the shape of the tensor of the equivalent :py:class:`.State`.
+
+        Returns
+        -------
+        tuple of int
+            The shape, [2] :math:`\\times d`.
+        """
+
+        return (2,) * self.rank
+
+    @property
+    def stabilizers(self):
+        """
+        Get the Pauli operators generating the stabilizer group of the
+        state.
+
+        Returns
+        -------
+        list of str
+            Each generator, as a sign followed by one of 'I', 'X', 'Y'
+            or 'Z' for each qubit, e.g., '+XX' and '+ZZ' for a Bell state.
+        """
+
+        d = self.rank
+        letters = np.array([['I', 'Z'], ['X', 'Y']])
+        return [('-' if self._r[i] else '+') +
+                ''.join(letters[self._x[i].astype(int), self._z[i].astype(int)])
+                for i in range(d, 2*d)]
+
+    def _copy_into(self, out):
+        # Copy the state into `out`, or a new state if it is None
+        if out is None:
+            out = StabilizerState.__new__(StabilizerState)
+            out._x = self._x.copy()
+            out._z = self._z.copy()
+            out._r = self._r.copy()
+        elif out is not self:
+            np.copyto(out._x, self._x)
+            np.copyto(out._z, self._z)
+            np.copyto(out._r, self._r)
+        return out
+
+    def _apply_kernel(self, kernel, qubit_indices):
+        # Update the tableau for conjugation by an operator's kernel. The
+        # factors of a tensor product are applied one at a time, so that,
+        # e.g., PauliX(d) is accepted for any d.
+        if isinstance(kernel, KroneckerKernel):
+            for factor, qubits in zip(kernel.factors, kernel.factor_qubits):
+                self._apply_kernel(factor, [qubit_indices[i] for i in qubits])
+            return
+
+        new_x, new_z, negate = _clifford_table(kernel)
+        k = len(qubit_indices)
+        weights = 1 << np.arange(k - 1, -1, -1)
+
+        x = self._x[:, qubit_indices]
+        z = self._z[:, qubit_indices]
+        index = (x.dot(weights) << k) | z.dot(weights)
+
+        self._r ^= negate[index]
+        self._x[:, qubit_indices] = new_x[index]
+        self._z[:, qubit_indices] = new_z[index]
+
+    def _rowsum(self, h, i):
+        # Multiply the Pauli operators of rows `h` by that of row `i`
+        exponents = np.sum(_phase_exponents(self._x[i], self._z[i], self._x[h], self._z[h]),
+                           axis=-1, dtype=np.int64)
+        exponents += 2 * self._r[h] + 2 * self._r[i]
+        self._r[h] = exponents % 4 == 2
+        self._x[h] ^= self._x[i]
+        self._z[h] ^= self._z[i]
+
+    def _measure_qubit(self, a, rng):
+        d = self.rank
+        anticommuting = np.flatnonzero(self._x[d:2*d, a])
+
+        if anticommuting.size > 0:
+            # The outcome is random. Make the first anticommuting
+            # stabilizer the only row that anticommutes with Z_a, then
+            # replace it with ±Z_a.
+            p = d + anticommuting[0]
+            rows = np.flatnonzero(self._x[:2*d, a])
+            rows = rows[rows != p]
+            if rows.size > 0:
+                self._rowsum(rows, p)
+
+            self._x[p - d] = self._x[p]
+            self._z[p - d] = self._z[p]
+            self._r[p - d] = self._r[p]
+
+            outcome = int(rng.random() < 0.5)
+            self._x[p] = False
+            self._z[p] = False
+            self._z[p, a] = True
+            self._r[p] = outcome
+            return outcome
+
+        # The outcome is determined: ±Z_a is the product of the
+        # stabilizers whose destabilizers anticommute with Z_a
+        return int(self._product_sign(d + np.flatnonzero(self._x[:d, a])))
+
+    def _product_sign(self, rows):
+        # Whether the product of the commuting Pauli operators of rows
+        # `rows` has a negative sign, computed for all the rows at once
+        # rather than with a rowsum per row. Writing each row as
+        # (-1)^r i^(x·z) X^x Z^z, moving each Z^z past the X^x of the
+        # later rows gives a sign (-1)^(z_k·x_l) for each pair k < l.
+        x = self._x[rows]
+        z = self._z[rows]
+        # The parity of the z bits of the earlier rows, for each row
+        earlier_z = np.logical_xor.accumulate(z, axis=0) ^ z
+        x_total = np.logical_xor.reduce(x, axis=0)
+        z_total = np.logical_xor.reduce(z, axis=0)
+
+        exponent = (2 * np.count_nonzero(self._r[rows]) +
+                    2 * np.count_nonzero(x & earlier_z) +
+                    np.count_nonzero(x & z) -
+                    np.count_nonzero(x_total & z_total))
+        return exponent % 4 == 2
+
+    def measure(self, qubit_indices=None, rng=None):
+        """
+        Measure the state with respect to the computational bases
+        of the qubits indicated by `qubit_indices`.
+        Measuring a state will modify the state in-place.
+        If no indices are indicated, the whole state is measured.
+
+        Parameters
+        ----------
+        qubit_indices : int or iterable
+            An index or indices indicating the qubit(s) whose
+            computational bases the measurement of the state will be
+            made with respect to. If no `qubit_indices` are given,
+            the whole state is measured.
+        rng : None, int, numpy.random.Generator, or numpy.random.RandomState
+            The random number generator, or a seed for one, to draw the
+            outcome with. If not given, numpy's global random state is
+            used. See :py:mod:`qcircuits.rng`.
+
+        Returns
+        -------
+        int or tuple of int
+            The measurement outcomes for the measured qubit(s).
+            If the `qubit_indices` parameter is supplied as an int,
+            an int is returned, otherwise a tuple.
+        """
+
+        qubit_indices, int_arg = _check_measured_indices(qubit_indices, self.rank)
+        rng = resolve_rng(rng)
+
+        bits = tuple(self._measure_qubit(a, rng) for a in qubit_indices)
+
+        if int_arg:
+            return bits[0]
+        return bits
+
+    def to_state(self):
+        """
+        Produce the :py:class:`.State` with the same amplitudes, up to
+        a global phase. The state has :math:`2^d` amplitudes, so this is
+        only feasible for small numbers of qubits.
+
+        Returns
+        -------
+        State
+            The state vector.
+        """
+
+        d = self.rank
+        n = 2**d
+        basis = np.arange(n)
+        # The bits of each basis state, with the first qubit as the most
+        # significant bit
+        basis_bits = (basis[:, None] >> np.arange(d - 1, -1, -1)) & 1
+
+        # Project a vector with no zero overlap with any stabilizer state
+        # onto the state, with the projector (I + S) / 2 of each stabilizer S
+        phases = np.random.default_rng(0).uniform(0, 2 * np.pi, size=n)
+        v = np.exp(1j * phases)
+        for i in range(d, 2*d):
+            x = self._x[i].astype(int)
+            z = self._z[i].astype(int)
+            # S |b⟩ = ±i^(#Y) (-1)^(b·z) |b ⊕ x⟩
+            signs = (-1.0) ** (basis_bits.dot(z) + self._r[i]) * 1j ** np.sum(x * z)
+            S_v = np.zeros_like(v)
+            S_v[basis ^ x.dot(1 << np.arange(d - 1, -1, -1))] = signs * v
+            v = (v + S_v) / 2
+
+        v /= np.linalg.norm(v)
+        # Fix the global phase so that the first nonzero amplitude is real
+        first = v[np.flatnonzero(np.abs(v) > 1e-8)[0]]
+        v *= np.abs(first) / first
+        return State.from_column_vector(v)
@@ -11,7 +11,9 @@ instead of ``qcircuits.state.zeros()``.
 
 import numpy as np
 
-from qcircuits.tensors import Tensor
+from qcircuits.tensors import Tensor, get_default_dtype
+from qcircuits.rng import resolve_rng, _choice
+from qcircuits import kernels
 
 
 class State(Tensor):
@@ -24,10 +26,15 @@ class State(Tensor):
     tensor : numpy complex128 multidimensional array
         The tensor representing the quantum state, giving the
         probability amplitudes.
+    copy : bool
+        If false, use a tensor of the right dtype directly rather than copying it.
+    dtype : numpy dtype
+        The precision of the tensor, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
     """
 
-    def __init__(self, tensor):
-        super().__init__(tensor)
+    def __init__(self, tensor, copy=True, dtype=None):
+        super().__init__(tensor, copy=copy, dtype=dtype)
 
     @staticmethod
     def from_column_vector(v):
@@ -50,7 +57,7 @@ class State(Tensor):
         """
 
         if type(v) is list:
-            v = np.array(v, dtype=np.complex128)
+            v = np.array(v, dtype=get_default_dtype())
 
         # Check the size is a power of 2
         d = np.log2(v.size)
@@ -86,7 +93,7 @@ class State(Tensor):
             The dot product with State arg.
         """
 
-        return np.sum(np.conj(self._t) * arg._t)
+        return np.vdot(self._t, arg._t)
 
     def renormalize_(self):
         """
@@ -163,26 +170,29 @@ class State(Tensor):
         return self
 
     def __add__(self, arg):
-        return State(self._t + arg._t)
+        t = self._t + arg._t
+        return State(t, copy=False, dtype=t.dtype)
 
     def __sub__(self, arg):
         return self + (-1) * arg
 
     def __neg__(self):
-        return State(-self._t)
+        return State(-self._t, copy=False, dtype=self.dtype)
 
+    # Scalars are converted to the state's precision, so that
+    # e.g. a numpy complex128 scalar does not upcast a complex64 state.
     def __mul__(self, scalar):
         if isinstance(scalar, (float, int, complex)):
-            return State(scalar * self._t)
+            return State(self.dtype.type(scalar) * self._t, copy=False, dtype=self.dtype)
         else:
             return super().__mul__(scalar)
 
     def __rmul__(self, scalar):
         if isinstance(scalar, (float, int, complex)):
-            return State(scalar * self._t)
+            return State(self.dtype.type(scalar) * self._t, copy=False, dtype=self.dtype)
 
     def __truediv__(self, scalar):
-        return State(self._t / scalar)
+        return State(self._t / self.dtype.type(scalar), copy=False, dtype=self.dtype)
 
     @property
     def probabilities(self):
@@ -197,7 +207,16 @@ class State(Tensor):
             vector.
         """
 
-        probs = np.real(np.conj(self._t) * self._t)
+        t = self._t
+        if kernels._is_memory_mapped(t):
+            # Fill in the probabilities one block of the file at a time
+            probs = np.empty(t.shape, dtype=t.real.dtype)
+            _, indices = kernels._blocks(t.shape, [], kernels.out_of_core_block_size)
+            for idx in indices:
+                block = t[idx]
+                np.add(np.square(block.real), np.square(block.imag), out=probs[idx])
+        else:
+            probs = np.real(np.conj(t) * t)
         assert abs(np.sum(probs) - 1.0) < 1e-4, ('State probabilities'
                                                  'do not sum to 1.')
         return probs
@@ -210,13 +229,18 @@ class State(Tensor):
         Returns
         -------
         numpy complex128 multidimensional array
-            The probability amplitudes of the state.
+            A read-only copy of the probability amplitudes of the state,
+            or, for a memory-mapped state, a read-only view of them.
         """
 
-        if abs(np.sum(self.probabilities) - 1.0) > 1e-4:
+        if abs(np.sum(self._marginal_probabilities([])) - 1.0) > 1e-4:
             raise RuntimeError('Vector is not a unit vector.')
 
-        amp = np.copy(self._t)
+        if kernels._is_memory_mapped(self._t):
+            # A read-only view rather than a copy of the file
+            amp = self._t.view(np.ndarray)
+        else:
+            amp = np.copy(self._t)
         amp.flags.writeable = False
         return amp
 
@@ -259,16 +283,31 @@ class State(Tensor):
         U, D, V = np.linalg.svd(M)
         return np.sum(D > 1e-10)
 
-    def _measurement_probabilites(self, qubit_indices):
-        num_outcomes = 2**len(qubit_indices)
-        unmeasured_indices = list(set(range(self.rank)) - set(qubit_indices))
-        permute = qubit_indices + unmeasured_indices
-        amplitudes = np.transpose(self._t, permute)
-        ps = np.reshape(np.real(amplitudes * np.conj(amplitudes)), (num_outcomes, -1)).sum(axis=1)
+    def _marginal_probabilities(self, qubit_indices):
+        # The unnormalized probability of each outcome of measuring the
+        # given qubits, as a float64 array of size 2^k, computed in a
+        # single read of the state: the squared magnitudes are summed
+        # over the unmeasured axes by einsum, without transposing the
+        # tensor or building an array of probabilities. A memory-mapped
+        # tensor is read one block at a time.
+        t = self._t
+        out_shape = (2**len(qubit_indices),)
+
+        if not kernels._is_memory_mapped(t):
+            return np.reshape(_squared_magnitude_sums(t, qubit_indices), out_shape)
+
+        qubit_indices = list(qubit_indices)
+        split_axes, indices = kernels._blocks(t.shape, qubit_indices,
+                                              kernels.out_of_core_block_size)
+        # The measured axes, renumbered for the fixed axes being removed
+        block_indices = [i - sum(s < i for s in split_axes) for i in qubit_indices]
+        ps = 0
+        for idx in indices:
+            ps = ps + _squared_magnitude_sums(t[idx], block_indices)
 
-        return ps, num_outcomes, amplitudes, permute
+        return np.reshape(ps, out_shape)
 
-    def measure(self, qubit_indices=None, remove=False):
+    def measure(self, qubit_indices=None, remove=False, rng=None):
         """
         Measure the state with respect to the computational bases
         of the qubits indicated by `qubit_indices`.
@@ -285,6 +324,10 @@ class State(Tensor):
         remove : bool
             Indicates whether the measured qubits should be removed from
             the state vector.
+        rng : None, int, numpy.random.Generator, or numpy.random.RandomState
+            The random number generator, or a seed for one, to draw the
+            outcome with. If not given, numpy's global random state is
+            used. See :py:mod:`qcircuits.rng`.
 
         Returns
         -------
@@ -294,70 +337,198 @@ class State(Tensor):
             an int is returned, otherwise a tuple.
         """
 
-        if abs(np.sum(self.probabilities) - 1.0) > 1e-4:
-            raise RuntimeError('Vector is not a unit vector.')
-
-        # If an int argument for qubit_indices is supplied, the return
-        # value should be an int giving the single measurement outcome.
-        # Otherwise, qubit_indices should be an iterable type and the
-        # return type will be a tuple of measurements.
-        int_arg = False
-        if isinstance(qubit_indices, int):
-            qubit_indices = [qubit_indices]
-            int_arg = True
-        # If no indices are supplied, the whole state should be measured
-        if qubit_indices is None:
-            qubit_indices = range(self.rank)
-
-        qubit_indices = list(qubit_indices)
-
-        if qubit_indices == []:
-            raise ValueError('Must measure at least one qubit.')
-
-        if min(qubit_indices) < 0 or max(qubit_indices) >= self.rank:
-            raise ValueError('Trying to measure qubit index i not 0<=i<d, '
-                             'where d is the rank of the state vector.')
-
-        if len(qubit_indices) != len(set(qubit_indices)):
-            raise ValueError('Qubit indices list contains repeated elements.')
+        qubit_indices, int_arg = _check_measured_indices(qubit_indices, self.rank)
 
-        # Compute probability of each outcome for the qubits being measured
-        ps, num_outcomes, amplitudes, permute = self._measurement_probabilites(qubit_indices)
+        # Compute probability of each outcome for the qubits being
+        # measured. Their sum is the squared norm of the state.
+        ps = self._marginal_probabilities(qubit_indices)
+        norm = np.sum(ps)
+        if abs(norm - 1.0) > 1e-4:
+            raise RuntimeError('Vector is not a unit vector.')
 
         # The binary representation of the measured state
-        outcome = np.random.choice(num_outcomes, p=ps)
+        outcome = _choice(resolve_rng(rng), ps)
         bits = tuple([outcome >> i & 1 for i in range(len(qubit_indices)-1, -1, -1)])
 
-        # The state of the remaining qubits post-measurement
-        p = ps[outcome]
-        collapsed_amplitudes = amplitudes[bits] / np.sqrt(p)
+        # Scaling the collapsed amplitudes by this makes the state exactly
+        # unit norm, so it need not be renormalized afterwards
+        scale = self.dtype.type(1 / np.sqrt(ps[outcome]))
+
+        idx = [slice(None)] * self.rank
+        for i, bit in zip(qubit_indices, bits):
+            idx[i] = bit
 
-        # If the measured qubits are still to be part of the state
-        # vector, put those axes back
-        if remove:
-            self._t = collapsed_amplitudes
+        if remove and kernels._is_memory_mapped(self._t) and \
+                self._t.flags.writeable and self._t.flags.c_contiguous:
+            self._t = _compact(self._t, tuple(idx), scale)
+        elif remove:
+            # Only the slice of the outcome is read
+            self._t = self._t[tuple(idx)] * scale
         else:
-            amplitudes = np.zeros_like(amplitudes)
-            amplitudes[bits] = collapsed_amplitudes
-            self._t = np.transpose(amplitudes, np.argsort(permute))
+            # Collapse in-place, zeroing the slices for the other outcomes
+            # and rescaling the outcome's slice, in one pass over the state
+            mask = np.zeros([2] * len(qubit_indices), dtype=self.dtype)
+            mask[bits] = scale
+            shape = [1] * self.rank
+            for i in qubit_indices:
+                shape[i] = 2
+            self._t *= np.transpose(mask, np.argsort(qubit_indices)).reshape(shape)
 
         # If the qubit_indices argument was an int, return the
         # single measurement as an int rather than a tuple
         if int_arg:
             bits = bits[0]
 
-        self.renormalize_()
+        return bits
+
+    def sample(self, qubit_indices=None, shots=1, rng=None, counts=False, packed=False):
+        """
+        Sample the outcomes of measuring the state `shots` times with
+        respect to the computational bases of the qubits indicated by
+        `qubit_indices`, as if each measurement were made on a fresh
+        copy of the state. The state is not modified.
+        If no indices are indicated, the whole state is measured.
+
+        The distribution of outcomes is computed once, and all the
+        outcomes are drawn from it at once, so this is much faster than
+        measuring copies of the state in a loop.
+
+        Parameters
+        ----------
+        qubit_indices : int or iterable
+            An index or indices indicating the qubit(s) whose
+            computational bases the measurements will be made with
+            respect to. If no `qubit_indices` are given, the whole
+            state is measured.
+        shots : int
+            The number of measurements to sample.
+        rng : None, int, numpy.random.Generator, or numpy.random.RandomState
+            The random number generator, or a seed for one, to draw the
+            outcomes with. If not given, numpy's global random state is
+            used. See :py:mod:`qcircuits.rng`.
+        counts : bool
+            If true, return the number of times each outcome occurred
+            rather than the individual outcomes.
+        packed : bool
+            If true, return the outcomes packed into a numpy uint64
+            array, one element per shot, with the first measured qubit
+            as the most significant bit. See :py:mod:`qcircuits.results`
+            for functions working with packed outcomes.
 
+        Returns
+        -------
+        numpy int array or dict
+            The measurement outcomes, with one row per shot and one
+            column per measured qubit. If the `qubit_indices` parameter
+            is supplied as an int, a 1D array of outcomes is returned.
+            If `counts` is true, a dict mapping each outcome that
+            occurred (a tuple of bits, or an int if `qubit_indices` is
+            an int) to the number of times it occurred.
+        """
+
+        if shots < 0:
+            raise ValueError('The number of shots should not be negative.')
+
+        qubit_indices, int_arg = _check_measured_indices(qubit_indices, self.rank)
+        ps = self._marginal_probabilities(qubit_indices)
+        norm = np.sum(ps)
+        if abs(norm - 1.0) > 1e-4:
+            raise RuntimeError('Vector is not a unit vector.')
+        ps /= norm
+
+        rng = resolve_rng(rng)
+        k = len(qubit_indices)
+
+        if counts:
+            outcome_counts = rng.multinomial(shots, ps)
+            result = {}
+            for outcome in np.flatnonzero(outcome_counts):
+                bits = tuple(int(outcome) >> i & 1 for i in range(k-1, -1, -1))
+                result[bits[0] if int_arg else bits] = int(outcome_counts[outcome])
+            return result
+
+        outcomes = _choice(rng, ps, size=shots)
+        # The outcome indices are already the packed bits
+        if packed:
+            return outcomes.astype(np.uint64)
+        bits = (outcomes[:, None] >> np.arange(k-1, -1, -1)) & 1
+        if int_arg:
+            return bits[:, 0]
         return bits
 
 
+def _squared_magnitude_sums(t, qubit_indices):
+    # The sums of the squared magnitudes of the elements of `t` over the
+    # axes not in `qubit_indices`, accumulated in double precision, as
+    # single precision rounding errors grow with the size of the state
+    d = len(t.shape)
+    axes = list(range(d))
+    dtype = np.float64
+
+    if d > 0 and t.strides[-1] == t.itemsize:
+        # A real view, with the real and imaginary parts as an extra axis
+        v = t.view(t.real.dtype).reshape(t.shape + (2,))
+        return np.einsum(v, axes + [d], v, axes + [d], list(qubit_indices), dtype=dtype)
+
+    re, im = t.real, t.imag
+    return (np.einsum(re, axes, re, axes, list(qubit_indices), dtype=dtype) +
+            np.einsum(im, axes, im, axes, list(qubit_indices), dtype=dtype))
+
+
+def _compact(t, idx, scale):
+    # Scale the slice `idx` of a C-contiguous memory-mapped tensor and
+    # move it to the start of the file, one block at a time, returning
+    # a view of it. Each element of the slice is moved no further than
+    # its own position, so no block overwrites elements yet to be read.
+    flat = t.reshape(-1)
+    kept = t[idx]
+    _, indices = kernels._blocks(kept.shape, [], kernels.out_of_core_block_size)
+    start = 0
+    for block_idx in indices:
+        block = kept[block_idx] * scale
+        flat[start:start + block.size] = block.reshape(-1)
+        start += block.size
+    return flat[:kept.size].reshape(kept.shape)
+
+
+def _check_measured_indices(qubit_indices, d):
+    # Validate the qubits to measure in a d-qubit state, and
+    # convert them to a list.
+    # If an int argument for qubit_indices is supplied, the return
+    # value of the measurement should be an int giving the single
+    # measurement outcome. Otherwise, qubit_indices should be an
+    # iterable type and the return type will be a tuple of measurements.
+    int_arg = False
+    if isinstance(qubit_indices, int):
+        qubit_indices = [qubit_indices]
+        int_arg = True
+    # If no indices are supplied, the whole state should be measured
+    if qubit_indices is None:
+        qubit_indices = range(d)
+
+    qubit_indices = list(qubit_indices)
+
+    if qubit_indices == []:
+        raise ValueError('Must measure at least one qubit.')
+
+    if min(qubit_indices) < 0 or max(qubit_indices) >= d:
+        raise ValueError('Trying to measure qubit index i not 0<=i<d, '
+                         'where d is the rank of the state vector.')
+
+    if len(qubit_indices) != len(set(qubit_indices)):
+        raise ValueError('Qubit indices list contains repeated elements.')
+
+    return qubit_indices, int_arg
+
+
 # Factory functions for building States
 from qcircuits.operators import Hadamard, CNOT
+from qcircuits.sparse_state import SparseState
 
 
 def qubit(*, alpha=None, beta=None,
           theta=None, phi=None,
-          global_phase=0.0):
+          global_phase=0.0, dtype=None):
     """
     Produce a given state for a single qubit.
 
@@ -377,6 +548,9 @@ def qubit(*, alpha=None, beta=None,
         Should not be specified in conjunction with alpha or beta.
     global_phase : float
         A global phase applied to the state.
+    dtype : numpy dtype
+        The precision of the state, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
 
     Returns
     -------
@@ -413,10 +587,10 @@ def qubit(*, alpha=None, beta=None,
         raise ValueError('Incorrect combination of arguments for qubit. '
                          'Supply alpha and beta, or theta and phi.')
 
-    return State(tensor * np.exp(1j * global_phase))
+    return State(tensor * np.exp(1j * global_phase), copy=False, dtype=dtype)
 
 
-def zeros(d=1):
+def zeros(d=1, dtype=None, sparse=False):
     """
     Produce the all-zero computational basis vector for `d` qubits.
     I.e., produces :math:`|0⟩^{\otimes d}`.
@@ -426,10 +600,16 @@ def zeros(d=1):
     d : int
         The number of qubits `d` for which we produce a computational
         basis vector, and the rank of the produced tensor.
+    dtype : numpy dtype
+        The precision of the state, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
+    sparse : bool
+        If true, produce a :py:class:`.SparseState`, which stores only
+        the nonzero amplitude.
 
     Returns
     -------
-    State
+    State or SparseState
         A `d`-rank tensor describing the all-zero `d`-qubit
         computational basis vector, :math:`|0⟩^{\otimes d}`
 
@@ -443,13 +623,19 @@ def zeros(d=1):
     if d < 1:
         raise ValueError('Rank must be at least 1.')
 
+    if dtype is None:
+        dtype = get_default_dtype()
+
+    if sparse:
+        return SparseState(d, [0], dtype=dtype)
+
     shape = [2] * d
-    t = np.zeros(shape, dtype=np.complex128)
+    t = np.zeros(shape, dtype=dtype)
     t.flat[0] = 1
-    return State(t)
+    return State(t, copy=False, dtype=dtype)
 
 
-def ones(d=1):
+def ones(d=1, dtype=None, sparse=False):
     """
     Produce the all-one computational basis vector for `d` qubits.
     I.e., produces :math:`|1⟩^{\otimes d}`.
@@ -459,10 +645,16 @@ def ones(d=1):
     d : int
         The number of qubits `d` for which we produce a computational
         basis vector, and the rank of the produced tensor.
+    dtype : numpy dtype
+        The precision of the state, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
+    sparse : bool
+        If true, produce a :py:class:`.SparseState`, which stores only
+        the nonzero amplitude.
 
     Returns
     -------
-    State
+    State or SparseState
         A `d`-rank tensor describing the all-one `d`-qubit
         computational basis vector, :math:`|1⟩^{\otimes d}`
 
@@ -476,13 +668,19 @@ def ones(d=1):
     if d < 1:
         raise ValueError('Rank must be at least 1.')
 
+    if dtype is None:
+        dtype = get_default_dtype()
+
+    if sparse:
+        return SparseState(d, [2**d - 1], dtype=dtype)
+
     shape = [2] * d
-    t = np.zeros(shape, dtype=np.complex128)
+    t = np.zeros(shape, dtype=dtype)
     t.flat[-1] = 1
-    return State(t)
+    return State(t, copy=False, dtype=dtype)
 
 
-def bitstring(*bits):
+def bitstring(*bits, dtype=None, sparse=False):
     """
     Produce a computational basis state from a given bit sequence.
 
@@ -490,10 +688,16 @@ def bitstring(*bits):
     ----------
     bits
         A variable number of arguments each in {0, 1}.
+    dtype : numpy dtype
+        The precision of the state, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
+    sparse : bool
+        If true, produce a :py:class:`.SparseState`, which stores only
+        the nonzero amplitude.
 
     Returns
     -------
-    State
+    State or SparseState
         If `d` arguments are supplied, returns a rank `d` tensor
         describing the computational basis state given by the sequence
         of input bits.
@@ -509,13 +713,19 @@ def bitstring(*bits):
     if d == 0:
         raise ValueError('Rank must be at least 1.')
 
+    if dtype is None:
+        dtype = get_default_dtype()
+
+    if sparse:
+        return SparseState(d, [int(''.join(str(b) for b in bits), 2)], dtype=dtype)
+
     shape = [2] * d
-    t = np.zeros(shape, dtype=np.complex128)
+    t = np.zeros(shape, dtype=dtype)
     t[bits] = 1
-    return State(t)
+    return State(t, copy=False, dtype=dtype)
 
 
-def positive_superposition(d=1):
+def positive_superposition(d=1, dtype=None):
     """
     Produce the positive superposition for a `d` qubit system, i.e.,
     the state resulting from applying the
@@ -527,6 +737,9 @@ def positive_superposition(d=1):
     ----------
     d : int
         The number of qubits `d` for the state.
+    dtype : numpy dtype
+        The precision of the state, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
 
     Returns
     -------
@@ -543,11 +756,11 @@ def positive_superposition(d=1):
         raise ValueError('Rank must be at least 1.')
 
     H = Hadamard(d)
-    x = zeros(d)
+    x = zeros(d, dtype=dtype)
     return H(x)
 
 
-def bell_state(a=0, b=0):
+def bell_state(a=0, b=0, dtype=None):
     """
     Produce one of the four Bell states for a two-qubit system,
     :math:`|\\beta_{ab}⟩`.
@@ -560,6 +773,9 @@ def bell_state(a=0, b=0):
     b : {0, 1}
         The computational basis state of the second qubit before
         entanglement.
+    dtype : numpy dtype
+        The precision of the state, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
 
     Returns
     -------
@@ -576,7 +792,56 @@ def bell_state(a=0, b=0):
     if a not in [0, 1] or b not in [0, 1]:
         raise ValueError('Bell state arguments are bits, and must be 0 or 1.')
 
-    phi = bitstring(a, b)
+    phi = bitstring(a, b, dtype=dtype)
     phi = Hadamard()(phi, qubit_indices=[0])
 
     return CNOT()(phi)
+
+
+def memmap_state(filename, d, mode='w+', dtype=None):
+    """
+    Produce a `d`-qubit state whose tensor is stored in a memory-mapped
+    file, for states too large to fit in memory. Operators are applied
+    to such a state one block at a time, and measurement reads the file
+    once, so a memory-mapped state is streamed through memory.
+
+    Applying an operator without `inplace` or `out` produces a copy of
+    the state in memory. To keep the state on disk, apply operators
+    with ``inplace=True``, or with `out` another memory-mapped state.
+
+    Parameters
+    ----------
+    filename : str or file-like object
+        The file storing the state's tensor.
+    d : int
+        The number of qubits.
+    mode : {'w+', 'r+', 'r', 'c'}
+        The mode the file is opened with, as for ``numpy.memmap``. With
+        the default, 'w+', a new file is created holding the all-zero
+        computational basis vector :math:`|0⟩^{\\otimes d}`. With 'r+',
+        the state already stored in the file is used.
+    dtype : numpy dtype
+        The precision of the state, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
+
+    Returns
+    -------
+    State
+        A rank `d` tensor describing the state.
+
+    See Also
+    --------
+    zeros
+    """
+
+    if d < 1:
+        raise ValueError('Rank must be at least 1.')
+
+    if dtype is None:
+        dtype = get_default_dtype()
+
+    t = np.memmap(filename, dtype=dtype, mode=mode, shape=tuple([2] * d))
+    if mode == 'w+':
+        # A new file is filled with zeros
+        t.flat[0] = 1
+    return State(t, copy=False, dtype=dtype)
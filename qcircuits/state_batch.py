@@ -0,0 +1,280 @@
+"""
+The state_batch module contains the StateBatch class, instances of which
+represent a batch of quantum states of multi-qubit systems of the same
+size, to which operators can be applied in a single vectorized call.
+
+The StateBatch class is aliased at the top-level module, so that one can
+call ``qcircuits.StateBatch()`` instead of
+``qcircuits.state_batch.StateBatch()``.
+"""
+
+
+import numpy as np
+
+from qcircuits.tensors import Tensor, get_default_dtype
+from qcircuits.state import State, _check_measured_indices
+from qcircuits.rng import resolve_rng
+
+
+class StateBatch(Tensor):
+    """
+    A container class for a tensor representing a batch of states of
+    `d`-qubit systems, and associated methods. The tensor has shape
+    [B] + [2] :math:`\\times d`, where the first axis indexes the states
+    in the batch.
+
+    Operators and circuits applied to a batch are applied to every state
+    in the batch, and the methods of this class act on each state
+    separately.
+
+    Parameters
+    ----------
+    tensor : numpy complex128 multidimensional array
+        The tensor representing the states, giving the probability
+        amplitudes of each state along the first axis.
+    copy : bool
+        If false, use a tensor of the right dtype directly rather than copying it.
+    dtype : numpy dtype
+        The precision of the tensor, complex64 or complex128.
+        Defaults to the precision set by :py:func:`.set_default_dtype`.
+    """
+
+    def __init__(self, tensor, copy=True, dtype=None):
+        super().__init__(tensor, copy=copy, dtype=dtype)
+
+        if self.rank < 2 or any(n != 2 for n in self.shape[1:]):
+            raise ValueError('The tensor should have shape [B] + [2] * d.')
+
+    @staticmethod
+    def from_states(states):
+        """
+        Produce a batch from a list of states of the same size.
+
+        Parameters
+        ----------
+        states : list of State
+            The states in the batch.
+
+        Returns
+        -------
+        StateBatch
+            The batch of states.
+        """
+
+        if len(set(state.shape for state in states)) != 1:
+            raise ValueError('The states should be non-empty and of the same size.')
+
+        dtype = np.result_type(*(state.dtype for state in states))
+        t = np.stack([state._t for state in states]).astype(dtype, copy=False)
+        return StateBatch(t, copy=False, dtype=dtype)
+
+    @staticmethod
+    def from_column_vectors(M):
+        """
+        Produce a batch from the column vector Kronecker-product
+        representations of the states, stacked as the rows of a matrix.
+
+        Parameters
+        ----------
+        M : numpy complex128 multidimensional array
+            An array of shape (B, 2**d).
+
+        Returns
+        -------
+        StateBatch
+            The batch of d-qubit states.
+        """
+
+        if type(M) is list:
+            M = np.array(M, dtype=get_default_dtype())
+
+        d = np.log2(M.shape[1])
+        if len(M.shape) != 2 or not d.is_integer():
+            raise ValueError('The array should have shape (B, 2**d).')
+        return StateBatch(M.reshape([M.shape[0]] + [2] * int(d)))
+
+    def __repr__(self):
+        s = 'StateBatch('
+        s += super().__str__().replace('\n', '\n' + ' ' * len(s))
+        s += ')'
+        return s
+
+    def __str__(self):
+        s = 'Batch of {} {}-qubit states.'.format(len(self), self.rank - 1)
+        s += ' Tensor:\n'
+        s += super().__str__()
+        return s
+
+    def __len__(self):
+        return self.shape[0]
+
+    def to_states(self):
+        """
+        Split the batch into separate states.
+
+        Returns
+        -------
+        list of State
+            Copies of the states in the batch.
+        """
+
+        return [State(t, dtype=self.dtype) for t in self._t]
+
+    def to_column_vectors(self):
+        """
+        Get the column vector Kronecker-product representations of the
+        states, stacked as the rows of a matrix.
+
+        Returns
+        -------
+        numpy complex128 multidimensional array
+            An array of shape (B, 2**d).
+        """
+
+        return self._t.reshape(len(self), -1).copy()
+
+    @property
+    def _qubit_axes(self):
+        return tuple(range(1, self.rank))
+
+    def dot(self, arg):
+        """
+        Give the dot product between each state in this batch and the
+        corresponding state in another batch, or a single state.
+
+        Parameters
+        ----------
+        arg : StateBatch or State
+            The batch of the same size, or the single state, with which
+            we take the dot products.
+
+        Returns
+        -------
+        numpy complex128 array
+            The B dot products.
+        """
+
+        if isinstance(arg, StateBatch):
+            return np.sum(np.conj(self._t) * arg._t, axis=self._qubit_axes)
+        else:
+            return np.tensordot(np.conj(self._t), arg._t, arg.rank)
+
+    def renormalize_(self):
+        """
+        Renormalize each state in the batch so that the sum of squared
+        amplitude magnitudes is 1.
+        """
+
+        norms = np.sqrt(np.sum(np.real(np.conj(self._t) * self._t),
+                               axis=self._qubit_axes, keepdims=True))
+        self._t /= norms
+
+    @property
+    def probabilities(self):
+        """
+        Get the probability of observing each computational basis
+        vector upon making a measurement, for each state in the batch.
+
+        Returns
+        -------
+        numpy float64 multidimensional array
+            The probability associated with each computational basis
+            vector, with shape [B] + [2] :math:`\\times d`.
+        """
+
+        probs = np.real(np.conj(self._t) * self._t)
+        assert np.all(np.abs(np.sum(probs, axis=self._qubit_axes) - 1.0) < 1e-4), (
+            'State probabilities do not sum to 1.')
+        return probs
+
+    def measure(self, qubit_indices=None, remove=False, packed=False, rng=None):
+        """
+        Measure each state in the batch with respect to the
+        computational bases of the qubits indicated by `qubit_indices`.
+        Measuring the batch will modify it in-place.
+        If no indices are indicated, the whole of each state is measured.
+
+        Parameters
+        ----------
+        qubit_indices : int or iterable
+            An index or indices indicating the qubit(s) whose
+            computational bases the measurement of the states will be
+            made with respect to. If no `qubit_indices` are given,
+            the whole of each state is measured.
+        remove : bool
+            Indicates whether the measured qubits should be removed from
+            the states.
+        packed : bool
+            If true, return the outcomes packed into a numpy uint64
+            array, one element per state, with the first measured qubit
+            as the most significant bit. See :py:mod:`qcircuits.results`
+            for functions working with packed outcomes.
+        rng : None, int, numpy.random.Generator, or numpy.random.RandomState
+            The random number generator, or a seed for one, to draw the
+            outcomes with. If not given, numpy's global random state is
+            used. See :py:mod:`qcircuits.rng`.
+
+        Returns
+        -------
+        numpy int array
+            The measurement outcomes, with one row per state in the
+            batch and one column per measured qubit. If the
+            `qubit_indices` parameter is supplied as an int, a 1D array
+            of the outcomes for that qubit is returned.
+        """
+
+        d = self.rank - 1
+        qubit_indices, int_arg = _check_measured_indices(qubit_indices, d)
+
+        B = len(self)
+        k = len(qubit_indices)
+        num_outcomes = 2**k
+        unmeasured_axes = tuple(1 + i for i in range(d) if i not in qubit_indices)
+        measured = sorted(qubit_indices)
+
+        # The probability of each outcome for each state, reduced over the
+        # unmeasured qubits without reordering the batch tensor
+        ps = np.sum(np.real(np.conj(self._t) * self._t), axis=unmeasured_axes,
+                    dtype=np.float64)
+        ps = np.transpose(ps, [0] + [1 + measured.index(i) for i in qubit_indices])
+        ps = ps.reshape(B, num_outcomes)
+        norms = np.sum(ps, axis=1)
+        if np.any(np.abs(norms - 1.0) > 1e-4):
+            raise RuntimeError('Vector is not a unit vector.')
+
+        # Sample an outcome for every state at once, by inverting the CDF.
+        # The draws are scaled to each state's total probability, as the
+        # probabilities need not sum to exactly 1, and a draw rounded up
+        # to the total falls back to the last outcome of nonzero
+        # probability, so that an impossible outcome is never drawn.
+        cdf = np.cumsum(ps, axis=1)
+        u = resolve_rng(rng).random((B, 1)) * cdf[:, -1:]
+        last = num_outcomes - 1 - np.argmax(ps[:, ::-1] > 0, axis=1)
+        outcomes = np.minimum(np.sum(cdf <= u, axis=1), last)
+        bits = (outcomes[:, None] >> np.arange(k - 1, -1, -1)) & 1
+
+        # The factor renormalizing each state post-measurement
+        rows = np.arange(B)
+        scale = (1 / np.sqrt(ps[rows, outcomes])).astype(self._t.real.dtype)
+
+        if remove:
+            index = [rows] + [bits[:, qubit_indices.index(i)] if i in qubit_indices
+                              else slice(None) for i in range(d)]
+            collapsed = self._t[tuple(index)]
+            collapsed *= scale.reshape([B] + [1] * (d - k))
+            self._t = collapsed
+        else:
+            # Zero the amplitudes of the outcomes not observed and scale the
+            # rest, with a mask broadcast over the unmeasured qubits
+            mask = np.zeros((B, num_outcomes), dtype=scale.dtype)
+            mask[rows, outcomes] = scale
+            mask = np.transpose(mask.reshape([B] + [2] * k),
+                                [0] + [1 + qubit_indices.index(i) for i in measured])
+            self._t *= mask.reshape([B] + [2 if i in qubit_indices else 1
+                                           for i in range(d)])
+
+        if packed:
+            return outcomes.astype(np.uint64)
+        if int_arg:
+            return bits[:, 0]
+        return bits
@@ -1,6 +1,55 @@
+"""
+The tensors module contains the Tensor class, the base class for
+:py:class:`.State` and :py:class:`.Operator`, and the default
+precision setting for the tensors of states and operators.
+
+The precision functions are aliased at the top-level module, so that,
+for example, one can call ``qcircuits.set_default_dtype()`` instead of
+``qcircuits.tensors.set_default_dtype()``.
+"""
+
+
 import numpy as np
 
 
+_default_dtype = np.dtype(np.complex128)
+
+
+def set_default_dtype(dtype):
+    """
+    Set the precision used for the tensors of states and operators
+    that are created without an explicit `dtype`. Single precision
+    (complex64) halves the memory used by states and operators,
+    at the cost of accuracy.
+
+    Parameters
+    ----------
+    dtype : numpy dtype
+        Either numpy.complex64 or numpy.complex128 (the default).
+    """
+
+    global _default_dtype
+
+    dtype = np.dtype(dtype)
+    if dtype not in [np.complex64, np.complex128]:
+        raise ValueError('The dtype should be complex64 or complex128.')
+    _default_dtype = dtype
+
+
+def get_default_dtype():
+    """
+    Get the precision used for the tensors of states and operators
+    that are created without an explicit `dtype`.
+
+    Returns
+    -------
+    numpy dtype
+        Either complex64 or complex128.
+    """
+
+    return _default_dtype
+
+
 class Tensor:
     """
     A container class for a tensor representing either a state vector
@@ -12,10 +61,28 @@ class Tensor:
     tensor : numpy complex128 multidimensional array
         The tensor representing either a quantum state or an operator
         on the vector space for a quantum state.
+    copy : bool
+        If true (the default), the object holds a copy of the supplied
+        tensor. If false, a numpy array of the right dtype is used
+        directly without copying, so that later modifications to the
+        array are visible in the object and vice versa. Arrays of other
+        types are always converted, and so copied.
+    dtype : numpy dtype
+        The precision of the tensor, either complex64 or complex128.
+        If not supplied, the default set by :py:func:`.set_default_dtype`
+        is used.
     """
 
-    def __init__(self, tensor):
-        self._t = np.array(tensor, dtype=np.complex128)
+    def __init__(self, tensor, copy=True, dtype=None):
+        if dtype is None:
+            dtype = _default_dtype
+        elif np.dtype(dtype) not in [np.complex64, np.complex128]:
+            raise ValueError('The dtype should be complex64 or complex128.')
+
+        if copy:
+            self._t = np.array(tensor, dtype=dtype)
+        else:
+            self._t = np.asarray(tensor, dtype=dtype)
 
     def __str__(self):
         return str(self._t)
@@ -38,6 +105,37 @@ class Tensor:
         """
         return self._t.shape
 
+    @property
+    def dtype(self):
+        """
+        Get the precision of the tensor.
+
+        Returns
+        -------
+        numpy dtype
+            Either complex64 or complex128.
+        """
+
+        return self._t.dtype
+
+    def astype(self, dtype):
+        """
+        Return a copy of this object with the tensor in a different
+        precision.
+
+        Parameters
+        ----------
+        dtype : numpy dtype
+            Either numpy.complex64 or numpy.complex128.
+
+        Returns
+        -------
+        State or Operator (depends on this object type)
+            The converted copy.
+        """
+
+        return self.__class__(self._t, dtype=dtype)
+
     @property
     def rank(self):
         """
@@ -73,7 +171,12 @@ class Tensor:
             returns :math:`A\\otimes B`.
         """
 
-        return self.__class__(np.tensordot(self._t, arg._t, axes=0))
+        if not isinstance(arg, Tensor):
+            raise TypeError('Cannot take the tensor product of a {} with a {}.'.format(
+                type(self).__name__, type(arg).__name__))
+
+        t = np.tensordot(self._t, arg._t, axes=0)
+        return self.__class__(t, copy=False, dtype=t.dtype)
 
     def tensor_power(self, n):
         """
@@ -98,9 +201,14 @@ class Tensor:
         for i in range(n-1):
             t = np.tensordot(t, self._t, axes=0)
 
-        return self.__class__(t)
+        # Only copy if no new tensor was produced, i.e., n = 1
+        return self.__class__(t, copy=t is self._t, dtype=t.dtype)
 
     def __mul__(self, arg):
+        # Products with other kinds of state, e.g., x * y for a
+        # ProductState y, are left to the other object's __rmul__
+        if not isinstance(arg, Tensor):
+            return NotImplemented
         return self.tensor_product(arg)
 
     def __pow__(self, n):
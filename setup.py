@@ -13,16 +13,15 @@ if __name__ == '__main__':
         license='MIT License',
         description='A package for simulating small-scale quantum computing',
         long_description=open('README.rst').read(),
-        python_requires='>=3.4.3',
+        python_requires='>=3.5',
         install_requires=[
-            "numpy >= 1.11.3",
+            "numpy >= 1.17",
         ],
         classifiers=[
             'License :: OSI Approved :: MIT License',
             'Operating System :: OS Independent',
             'Intended Audience :: End Users/Desktop',
             'Intended Audience :: Developers',
-            'Programming Language :: Python :: 3.4',
             'Programming Language :: Python :: 3.5',
             'Programming Language :: Python :: 3.6',
             'Programming Language :: Python :: 3.7',
@@ -5,8 +5,11 @@ import numpy as np
 from numpy.testing import assert_allclose
 from itertools import product
 from scipy.stats import unitary_group, dirichlet, binom
+import scipy.sparse
 
 import sys
+import os
+import tempfile
 sys.path.append('..')
 import qcircuits as qc
 
@@ -50,6 +53,19 @@ def random_state(d):
     return qc.state.State(amplitudes)
 
 
+def reference_application(Op, x, qubit_indices):
+    # Apply an operator to a subset of qubits of a state with explicit
+    # matrix-vector multiplication, as a reference for the kernels
+    d = x.rank
+    op_d = Op.rank // 2
+    qubit_indices = list(qubit_indices)
+    rest = [i for i in range(d) if i not in qubit_indices]
+    permutation = qubit_indices + rest
+    v = np.transpose(x[:], permutation).reshape(2**op_d, -1)
+    v = Op.to_matrix().dot(v).reshape([2] * d)
+    return np.transpose(v, np.argsort(permutation))
+
+
 def random_boolean_function(d):
     ans = np.random.choice([0, 1], 2**d)
 
@@ -973,6 +989,43 @@ class DensityOperatorTests(unittest.TestCase):
 
             assert_allclose(result1._t, result2._t)
 
+    def test_structured_operator_application(self):
+        ops = [
+            (qc.PauliZ(d=2) * qc.Phase(), [0, 2, 3]),
+            (qc.Toffoli(), [3, 0, 1]),
+            (qc.PauliY(), [2]),
+            (qc.ControlledU(random_unitary_operator(1)), [1, 3]),
+            (qc.Hadamard(d=2) * random_unitary_operator(1), [3, 1, 0]),
+            (random_unitary_operator(2).adj, [2, 0]),
+            (qc.Operator.from_coo([0, 1, 2, 3, 3], [1, 0, 3, 2, 0],
+                                  [1, 1, 1, 0.6, 0.8j], d=2), [1, 2]),
+        ]
+        states = [random_state(4) for i in range(3)]
+        ps = [0.2, 0.3, 0.5]
+        rho = qc.DensityOperator.from_ensemble(states, ps)
+
+        for Op, qubit_indices in ops:
+            result1 = Op(rho, qubit_indices=qubit_indices)
+            M = qc.Operator.from_matrix(Op.to_matrix())
+            post_states = [M(state, qubit_indices=qubit_indices) for state in states]
+            # Non-unitary operators renormalize states, so compare the
+            # unnormalized mixture
+            norms = [np.linalg.norm(reference_application(M, state, qubit_indices))**2
+                     for state in states]
+            result2 = qc.DensityOperator.from_ensemble(
+                post_states, np.array(ps) * norms / np.dot(ps, norms))
+            assert_allclose(result1._t, result2._t * np.dot(ps, norms), atol=1e-12)
+
+        # Compiled circuits apply the same kernels
+        circuit = qc.Circuit(4)
+        for Op, qubit_indices in ops[:6]:
+            circuit.add(Op, qubit_indices)
+        expected = rho
+        for Op, qubit_indices in ops[:6]:
+            expected = Op(expected, qubit_indices=qubit_indices)
+        assert_allclose(circuit.compile()(rho)._t, expected._t, atol=1e-12)
+        assert_allclose(circuit.compile(max_width=None)(rho)._t, expected._t, atol=1e-12)
+
     def test_permutation_of_density_operators(self):
         num_tests = 10
 
@@ -1028,7 +1081,7 @@ class DensityOperatorTests(unittest.TestCase):
             ps1, _ = rho._measurement_probabilites(qubit_indices=measurement_qubits)
             ps2 = np.zeros_like(ps1)
             for ensemble_p, state in zip(ensemble_ps, states):
-                ps, _, _, _ = state._measurement_probabilites(qubit_indices=measurement_qubits)
+                ps = state._marginal_probabilities(measurement_qubits)
                 ps2 += ensemble_p * ps
 
             assert_allclose(ps1, ps2)
@@ -1195,7 +1248,7 @@ class DensityOperatorTests(unittest.TestCase):
 
                 p_m_given_i = []
                 for state in states:
-                    ps, _, _, _ = state._measurement_probabilites(measure_idx)
+                    ps = state._marginal_probabilities(measure_idx)
                     p_m_given_i.append(ps[outcome])
                 p_m_given_i = np.array(p_m_given_i)
 
@@ -1218,6 +1271,24 @@ class DensityOperatorTests(unittest.TestCase):
 
                 assert_allclose(rho._t, rho2._t)
 
+    def test_conjugate_kernel_cached(self):
+        U = random_unitary_operator(2)
+        M = U.to_matrix()
+        rho = qc.DensityOperator.from_ensemble([random_state(3), random_state(3)], [0.3, 0.7])
+        expected = rho.to_matrix()
+        M = np.kron(M, np.eye(2))
+
+        for i in range(3):
+            rho = U(rho, qubit_indices=[0, 1])
+            expected = M @ expected @ M.conj().T
+            self.assertLess(np.max(np.abs(rho.to_matrix() - expected)), epsilon)
+        kernel = U._get_conjugate_kernel()
+        self.assertIs(U._get_conjugate_kernel(), kernel)
+
+        # A new tensor discards the cached kernel
+        U._t = qc.Hadamard(2)._t
+        self.assertIsNot(U._get_conjugate_kernel(), kernel)
+
 
 class FastMeasurementTests(unittest.TestCase):
 
@@ -1288,6 +1359,1781 @@ class FastMeasurementTests(unittest.TestCase):
             self.assertEqual(answer, measured_ans)
 
 
+class SingleQubitKernelTests(unittest.TestCase):
+
+    def test_single_qubit_application(self):
+        num_tests = 10
+        for test_i in range(num_tests):
+            d = np.random.randint(1, 8)
+            x = random_state(d)
+            U = random_unitary_operator(1)
+            qubit_index = np.random.randint(d)
+
+            result = U(x, qubit_indices=[qubit_index])
+            expected = reference_application(U, x, [qubit_index])
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+    def test_state_unchanged(self):
+        num_tests = 10
+        for test_i in range(num_tests):
+            d = np.random.randint(1, 8)
+            x = random_state(d)
+            x_copy = copy.deepcopy(x)
+            U = random_unitary_operator(1)
+            U(x, qubit_indices=[np.random.randint(d)])
+            self.assertLess(max_absolute_difference(x, x_copy), epsilon)
+
+    def test_permuted_state(self):
+        num_tests = 10
+        for test_i in range(num_tests):
+            d = np.random.randint(2, 8)
+            x = random_state(d)
+            indices = np.arange(d)
+            np.random.shuffle(indices)
+            x.permute_qubits(indices)
+            U = random_unitary_operator(1)
+            qubit_index = np.random.randint(d)
+
+            result = U(x, qubit_indices=[qubit_index])
+            expected = reference_application(U, x, [qubit_index])
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+    def test_renormalization(self):
+        self.assertTrue(random_unitary_operator(1)._get_kernel().unitary)
+        self.assertTrue(qc.CNOT()._get_kernel().unitary)
+        self.assertTrue(qc.QFT(3)._get_kernel().unitary)
+        self.assertTrue(random_unitary_operator(3)._get_kernel().unitary)
+        projector = qc.Operator.from_matrix(np.array([[1, 0], [0, 0]]))
+        self.assertFalse(projector._get_kernel().unitary)
+        self.assertFalse((2 * qc.Hadamard())._get_kernel().unitary)
+
+        # Unitary operators are applied without renormalizing the state,
+        # and other operators renormalize it
+        x = qc.State(2 * random_state(3)[:])
+        y = qc.Hadamard()(x, qubit_indices=[1])
+        self.assertAlmostEqual(np.real(y.dot(y)), 4.0)
+        y = projector(qc.Hadamard()(qc.zeros(3), [1]), qubit_indices=[1])
+        self.assertAlmostEqual(np.real(y.dot(y)), 1.0)
+
+        circuit = qc.Circuit(3).add(qc.Hadamard(), [0]).add(projector, [0])
+        y = circuit.compile()(qc.zeros(3))
+        self.assertAlmostEqual(np.real(y.dot(y)), 1.0)
+
+
+class DiagonalOperatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.diagonal_operators = [
+            qc.PauliZ(), qc.Phase(), qc.PiBy8(), qc.RotationZ(0.3),
+            qc.PauliZ(2), qc.Phase(3), qc.PiBy8(5),
+            qc.ControlledU(qc.Phase()), qc.ControlledU(qc.ControlledU(qc.PiBy8())),
+            qc.Operator.from_matrix(np.diag(np.exp(1j * np.arange(8)))),
+            qc.Operator.from_matrix(np.diag(np.exp(1j * np.arange(64))))
+        ]
+
+    def test_diagonal_operators_detected(self):
+        for Op in self.diagonal_operators:
+            kernel = Op._get_kernel()
+            # Tensor powers keep their single-qubit diagonal factors
+            factors = getattr(kernel, 'factors', [kernel])
+            for factor in factors:
+                self.assertIsInstance(factor, qc.kernels.DiagonalKernel)
+        for Op in [qc.Hadamard(), qc.PauliX(2), qc.CNOT()]:
+            self.assertNotIsInstance(Op._get_kernel(), qc.kernels.DiagonalKernel)
+
+    def test_diagonal_application(self):
+        for Op in self.diagonal_operators:
+            op_d = Op.rank // 2
+            d = np.random.randint(op_d, 8)
+            x = random_state(d)
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+
+            result = Op(x, qubit_indices=qubit_indices)
+            expected = reference_application(Op, x, qubit_indices)
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+    def test_declared_diagonal_matches_dense(self):
+        for Op in self.diagonal_operators:
+            M = Op.to_matrix()
+            Op_dense = qc.Operator(Op._t)
+            self.assertLess(max_absolute_difference(M, np.diag(np.diag(M))), epsilon)
+            self.assertLess(max_absolute_difference(Op_dense, Op), epsilon)
+
+    def test_scaled_diagonal(self):
+        R_k = np.exp(np.pi * 1j / 4) * qc.RotationZ(np.pi / 2)
+        self.assertIsInstance(R_k._get_kernel(), qc.kernels.DiagonalKernel)
+        self.assertLess(max_absolute_difference(R_k, qc.Phase()), epsilon)
+
+
+class PermutationOperatorTests(unittest.TestCase):
+
+    def setUp(self):
+        self.permutation_operators = [
+            qc.PauliX(), qc.PauliX(3), qc.PauliY(), qc.PauliY(2),
+            qc.CNOT(), qc.Toffoli(), qc.Swap(),
+            qc.U_f(random_boolean_function(3), d=4),
+            qc.Operator.from_matrix(np.eye(8)[np.random.permutation(8)]),
+            qc.Operator.from_matrix(np.eye(4)[[1, 0, 3, 2]] * np.exp(1j * np.arange(4)))
+        ]
+
+    def test_permutation_operators_detected(self):
+        for Op in self.permutation_operators:
+            kernel = Op._get_kernel()
+            # Tensor powers keep their single-qubit permutation factors
+            factors = getattr(kernel, 'factors', [kernel])
+            for factor in factors:
+                self.assertIsInstance(factor, qc.kernels.PermutationKernel)
+
+    def test_factory_operators_not_dense(self):
+        for Op in self.permutation_operators[:8]:
+            self.assertIsNone(Op._tensor)
+
+    def test_permutation_application(self):
+        for Op in self.permutation_operators:
+            op_d = Op.rank // 2
+            d = np.random.randint(op_d, 8)
+            x = random_state(d)
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+
+            result = Op(x, qubit_indices=qubit_indices)
+            expected = reference_application(Op, x, qubit_indices)
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+    def test_permutation_density_operator_application(self):
+        for Op in self.permutation_operators:
+            op_d = Op.rank // 2
+            d = np.random.randint(op_d, 6)
+            x = random_state(d)
+            rho = qc.DensityOperator.from_ensemble([x])
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+
+            rho1 = Op(rho, qubit_indices=qubit_indices)
+            rho2 = qc.DensityOperator.from_ensemble([Op(x, qubit_indices=qubit_indices)])
+            self.assertLess(max_absolute_difference(rho1, rho2), epsilon)
+
+    def test_permutation_operator_composition(self):
+        for Op in self.permutation_operators:
+            op_d = Op.rank // 2
+            U = random_unitary_operator(op_d)
+            R1 = Op(U)
+            R2 = qc.Operator.from_matrix(Op.to_matrix().dot(U.to_matrix()))
+            self.assertLess(max_absolute_difference(R1, R2), epsilon)
+
+
+class ControlledOperatorTests(unittest.TestCase):
+
+    def controlled_matrix(self, U, num_controls):
+        M = np.eye(2**(U.rank // 2 + num_controls), dtype=np.complex128)
+        n = 2**(U.rank // 2)
+        M[-n:, -n:] = U.to_matrix()
+        return M
+
+    def test_controlled_matrix(self):
+        num_tests = 10
+        for test_i in range(num_tests):
+            U = random_unitary_operator(np.random.randint(1, 3))
+            num_controls = np.random.randint(1, 4)
+            C_U = qc.ControlledU(U, num_controls=num_controls)
+            M = self.controlled_matrix(U, num_controls)
+            self.assertLess(max_absolute_difference(C_U.to_matrix(), M), epsilon)
+
+    def test_nested_controlled(self):
+        U = random_unitary_operator(2)
+        C_U1 = qc.ControlledU(qc.ControlledU(U))
+        C_U2 = qc.ControlledU(U, num_controls=2)
+        self.assertEqual(C_U1._get_kernel().num_controls, 2)
+        self.assertLess(max_absolute_difference(C_U1, C_U2), epsilon)
+        self.assertLess(max_absolute_difference(qc.ControlledU(qc.PauliX()), qc.CNOT()), epsilon)
+        self.assertLess(max_absolute_difference(qc.ControlledU(qc.CNOT()), qc.Toffoli()), epsilon)
+
+    def test_controlled_application(self):
+        num_tests = 10
+        for test_i in range(num_tests):
+            U = random_unitary_operator(np.random.randint(1, 3))
+            num_controls = np.random.randint(1, 3)
+            C_U = qc.ControlledU(U, num_controls=num_controls)
+            op_d = C_U.rank // 2
+            d = np.random.randint(op_d, 8)
+            x = random_state(d)
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+
+            result = C_U(x, qubit_indices=qubit_indices)
+            self.assertIsNone(C_U._tensor)
+            expected = reference_application(C_U, x, qubit_indices)
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+    def test_controlled_structured_operators(self):
+        for U in [qc.Hadamard(), qc.PauliX(), qc.Swap(), qc.Phase()]:
+            C_U = qc.ControlledU(U, num_controls=2)
+            op_d = C_U.rank // 2
+            x = random_state(op_d + 1)
+            qubit_indices = np.random.choice(op_d + 1, size=op_d, replace=False)
+
+            result = C_U(x, qubit_indices=qubit_indices)
+            expected = reference_application(C_U, x, qubit_indices)
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+
+class InPlaceApplicationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.operators = [
+            qc.Hadamard(), qc.Phase(), qc.CNOT(), qc.ControlledU(qc.Hadamard()),
+            random_unitary_operator(1), random_unitary_operator(2)
+        ]
+
+    def test_inplace_state_application(self):
+        for Op in self.operators:
+            op_d = Op.rank // 2
+            d = np.random.randint(op_d, 8)
+            x = random_state(d)
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+
+            expected = Op(x, qubit_indices=qubit_indices)
+            result = Op(x, qubit_indices=qubit_indices, inplace=True)
+            self.assertIs(result, x)
+            self.assertLess(max_absolute_difference(x, expected), epsilon)
+
+    def test_out_state_application(self):
+        for Op in self.operators:
+            op_d = Op.rank // 2
+            d = np.random.randint(op_d, 8)
+            x = random_state(d)
+            x_copy = copy.deepcopy(x)
+            buffer = qc.zeros(d)
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+
+            expected = Op(x, qubit_indices=qubit_indices)
+            result = Op(x, qubit_indices=qubit_indices, out=buffer)
+            self.assertIs(result, buffer)
+            self.assertLess(max_absolute_difference(buffer, expected), epsilon)
+            self.assertLess(max_absolute_difference(x, x_copy), epsilon)
+
+    def test_ping_pong_buffers(self):
+        d = 5
+        x = random_state(d)
+        a = copy.deepcopy(x)
+        b = qc.zeros(d)
+        for Op in self.operators:
+            op_d = Op.rank // 2
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+            x = Op(x, qubit_indices=qubit_indices)
+            Op(a, qubit_indices=qubit_indices, out=b)
+            a, b = b, a
+        self.assertLess(max_absolute_difference(a, x), epsilon)
+
+    def test_inplace_operator_and_density_operator_application(self):
+        for Op in self.operators:
+            op_d = Op.rank // 2
+            d = np.random.randint(op_d, 5)
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+
+            M = random_unitary_operator(d)
+            expected = Op(M, qubit_indices=qubit_indices)
+            Op(M, qubit_indices=qubit_indices, inplace=True)
+            self.assertLess(max_absolute_difference(M, expected), epsilon)
+
+            rho = qc.DensityOperator.from_ensemble([random_state(d), random_state(d)])
+            expected = Op(rho, qubit_indices=qubit_indices)
+            Op(rho, qubit_indices=qubit_indices, inplace=True)
+            self.assertLess(max_absolute_difference(rho, expected), epsilon)
+
+    def test_inplace_structured_operator_argument(self):
+        X = qc.PauliX()
+        qc.Hadamard()(X, inplace=True)
+        self.assertLess(max_absolute_difference(X, qc.Hadamard()(qc.PauliX())), epsilon)
+        self.assertNotIsInstance(X._get_kernel(), qc.kernels.PermutationKernel)
+
+    def test_operators_built_from_the_output_are_unchanged(self):
+        # Writing in-place into an operator that another operator was
+        # built from must not change the other operator
+        for A in [qc.Hadamard(), random_unitary_operator(1), random_unitary_operator(2)]:
+            d = A.rank // 2
+            controlled = qc.ControlledU(A)
+            expected = controlled.to_matrix()
+            x = random_state(d + 1)
+            expected_x = controlled(x)
+
+            qc.PauliZ(d)(A, inplace=True)
+            assert_allclose(controlled.to_matrix(), expected)
+            self.assertLess(max_absolute_difference(controlled(x), expected_x), epsilon)
+
+            B = random_unitary_operator(d)
+            controlled = qc.ControlledU(B)
+            expected = controlled.to_matrix()
+            qc.PauliX(d)(random_unitary_operator(d), out=B)
+            assert_allclose(controlled.to_matrix(), expected)
+
+    def test_writes_after_permuting_shared_operators(self):
+        # Permuting the qubits of an operator gives it a view of storage
+        # still shared with operators built from it, which later writes
+        # into the operator must not change
+        for inplace in [True, False]:
+            A = random_unitary_operator(2)
+            controlled = qc.ControlledU(A)
+            expected = controlled.to_matrix()
+            x = random_state(3)
+            expected_x = controlled(x)
+
+            A.swap_qubits(0, 1)
+            if inplace:
+                qc.Hadamard()(A, [0], inplace=True)
+            else:
+                qc.Hadamard()(random_unitary_operator(2), [0], out=A)
+            assert_allclose(controlled.to_matrix(), expected)
+            self.assertLess(max_absolute_difference(controlled(x), expected_x), epsilon)
+            self.assertLess(max_absolute_difference(controlled.adj(controlled(x)), x), epsilon)
+
+    def test_bad_out(self):
+        H = qc.Hadamard()
+        x = qc.zeros(2)
+        with self.assertRaises(ValueError):
+            H(x, qubit_indices=[0], out=qc.zeros(3))
+        with self.assertRaises(ValueError):
+            H(x, qubit_indices=[0], out=qc.Identity(2))
+        with self.assertRaises(ValueError):
+            H(x, qubit_indices=[0], inplace=True, out=qc.zeros(2))
+
+
+class CopyPolicyTests(unittest.TestCase):
+
+    def test_copy_argument(self):
+        for cls, shape in [(qc.State, [2] * 3), (qc.Operator, [2] * 4),
+                           (qc.DensityOperator, [2] * 4)]:
+            t = np.zeros(shape, dtype=np.complex128)
+            self.assertTrue(np.shares_memory(cls(t, copy=False)._t, t))
+            self.assertFalse(np.shares_memory(cls(t)._t, t))
+            self.assertFalse(np.shares_memory(cls(t.real, copy=False)._t, t))
+
+    def test_results_do_not_alias_arguments(self):
+        x = random_state(3)
+        U = random_unitary_operator(2)
+        for result in [x * 1.0, 1.0 * x, x / 1.0, -x, x + x, x ** 1, x * x, U(x, qubit_indices=[0, 2])]:
+            self.assertFalse(np.shares_memory(result._t, x._t))
+        for result in [U.adj, U + U, U ** 1, U * U, U(U)]:
+            self.assertFalse(np.shares_memory(result._t, U._t))
+
+
+class SinglePrecisionTests(unittest.TestCase):
+
+    def setUp(self):
+        qc.set_default_dtype(np.complex64)
+
+    def tearDown(self):
+        qc.set_default_dtype(np.complex128)
+
+    def test_factories_single_precision(self):
+        operators = [
+            qc.Identity(2), qc.PauliX(), qc.PauliY(2), qc.PauliZ(), qc.Hadamard(2),
+            qc.Phase(), qc.PiBy8(), qc.SqrtNot(), qc.RotationX(0.3), qc.RotationZ(0.1),
+            qc.CNOT(), qc.Toffoli(), qc.Swap(), qc.SqrtSwap(),
+            qc.ControlledU(qc.Hadamard()), qc.U_f(random_boolean_function(2), d=3)
+        ]
+        states = [qc.zeros(2), qc.ones(2), qc.bitstring(0, 1), qc.bell_state(),
+                  qc.positive_superposition(3), qc.qubit(theta=1.0, phi=2.0)]
+
+        for Op in operators:
+            self.assertEqual(Op.dtype, np.complex64)
+            self.assertEqual(Op._t.dtype, np.complex64)
+            self.assertEqual(Op.adj.dtype, np.complex64)
+            self.assertEqual(Op(Op).dtype, np.complex64)
+        for x in states:
+            self.assertEqual(x.dtype, np.complex64)
+
+    def test_no_upcasting(self):
+        x = qc.positive_superposition(4)
+        for y in [np.complex128(2.0) * x, x * np.float64(2.0), x + x, x - x,
+                  x / np.float64(2.0), x * x, qc.CNOT()(x, qubit_indices=[3, 1]),
+                  qc.RotationY(0.5)(x, qubit_indices=[2])]:
+            self.assertEqual(y.dtype, np.complex64)
+
+        x.measure(qubit_indices=[0, 2])
+        self.assertEqual(x.dtype, np.complex64)
+
+        rho = qc.DensityOperator.from_ensemble([qc.positive_superposition(3), qc.zeros(3)])
+        rho = qc.Hadamard()(rho, qubit_indices=[1])
+        rho.measure(qubit_indices=[1])
+        self.assertEqual(rho.dtype, np.complex64)
+
+    def test_double_precision_operator_on_single_precision_state(self):
+        qc.set_default_dtype(np.complex128)
+        U = random_unitary_operator(2)
+        x = random_state(4)
+        x64 = x.astype(np.complex64)
+        y = U(x, qubit_indices=[2, 0])
+        y64 = U(x64, qubit_indices=[2, 0])
+        self.assertEqual(y64.dtype, np.complex64)
+        self.assertLess(max_absolute_difference(y, y64), 1e-5)
+
+    def test_single_precision_measurement(self):
+        d = 10
+        x = qc.positive_superposition(d)
+        self.assertEqual(len(x.measure()), d)
+
+    def test_long_single_precision_circuit(self):
+        # The rounding errors of many unitary operators must not push the
+        # norm of a single precision state outside the unit-norm tolerance
+        d = 10
+        operators = [random_unitary_operator(op_d).astype(np.complex64)
+                     for op_d in [1, 2] * 4]
+        x = qc.zeros(d, dtype=np.complex64)
+        for step in range(20000):
+            Op = operators[np.random.randint(len(operators))]
+            qubit_indices = np.random.choice(d, size=Op.rank // 2, replace=False)
+            Op(x, qubit_indices, inplace=True)
+
+        self.assertLess(abs(np.linalg.norm(x._t.astype(np.complex128)) - 1), 1e-5)
+        self.assertEqual(len(x.measure()), d)
+
+
+class CircuitTests(unittest.TestCase):
+
+    def random_circuit(self, d, num_steps=8):
+        operators = [
+            qc.Hadamard(), qc.PauliX(), qc.Phase(), qc.CNOT(), qc.Toffoli(),
+            qc.ControlledU(qc.Hadamard()), random_unitary_operator(1),
+            random_unitary_operator(2)
+        ]
+        circuit = qc.Circuit(d)
+        for _ in range(num_steps):
+            Op = operators[np.random.randint(len(operators))]
+            op_d = Op.rank // 2
+            if op_d > d:
+                continue
+            circuit.add(Op, np.random.choice(d, size=op_d, replace=False))
+        return circuit
+
+    def sequential_application(self, circuit, x):
+        for Op, qubit_indices in circuit.steps:
+            x = Op(x, qubit_indices=qubit_indices)
+        return x
+
+    def test_circuit_matches_sequential_application(self):
+        for test_i in range(10):
+            d = np.random.randint(1, 7)
+            circuit = self.random_circuit(d)
+            x = random_state(d)
+            x_copy = copy.deepcopy(x)
+
+            result = circuit(x)
+            expected = self.sequential_application(circuit, x)
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+            self.assertLess(max_absolute_difference(x, x_copy), epsilon)
+
+    def test_circuit_to_operator(self):
+        for test_i in range(10):
+            d = np.random.randint(1, 5)
+            circuit = self.random_circuit(d)
+            x = random_state(d)
+
+            U = circuit.to_operator()
+            self.assertLess(max_absolute_difference(U(x), circuit(x)), epsilon)
+            self.assertLess(max_absolute_difference(circuit(qc.Identity(d)), U), epsilon)
+
+    def test_circuit_adjoint_inverts(self):
+        for test_i in range(10):
+            d = np.random.randint(1, 7)
+            circuit = self.random_circuit(d)
+            x = random_state(d)
+
+            result = circuit.adj(circuit(x))
+            self.assertLess(max_absolute_difference(result, x), epsilon)
+
+    def test_circuit_density_operator(self):
+        for test_i in range(5):
+            d = np.random.randint(1, 5)
+            circuit = self.random_circuit(d)
+            x = random_state(d)
+
+            rho = circuit(qc.DensityOperator.from_ensemble([x]))
+            expected = qc.DensityOperator.from_ensemble([circuit(x)])
+            self.assertLess(max_absolute_difference(rho, expected), epsilon)
+
+    def test_nested_circuit(self):
+        bell = qc.Circuit(2).add(qc.Hadamard(), [0]).add(qc.CNOT())
+        circuit = qc.Circuit(4).add(bell, [3, 1])
+        self.assertEqual(circuit.steps[0][1], (3,))
+        self.assertEqual(circuit.steps[1][1], (3, 1))
+
+        result = circuit(qc.zeros(4))
+        expected = qc.CNOT()(qc.Hadamard()(qc.zeros(4), [3]), [3, 1])
+        self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+    def test_circuit_inplace_and_out(self):
+        d = 4
+        circuit = self.random_circuit(d)
+        x = random_state(d)
+        expected = circuit(x)
+
+        buffer = qc.zeros(d)
+        result = circuit(x, out=buffer)
+        self.assertIs(result, buffer)
+        self.assertLess(max_absolute_difference(buffer, expected), epsilon)
+
+        result = circuit(x, inplace=True)
+        self.assertIs(result, x)
+        self.assertLess(max_absolute_difference(x, expected), epsilon)
+
+    def test_fused_circuit_equivalent(self):
+        for test_i in range(10):
+            d = np.random.randint(1, 7)
+            circuit = self.random_circuit(d, num_steps=20)
+            x = random_state(d)
+            expected = circuit(x)
+
+            for max_width in [1, 2, 3]:
+                fused = circuit.fuse(max_width)
+                self.assertLessEqual(len(fused), len(circuit))
+                for Op, qubit_indices in fused.steps:
+                    self.assertTrue(len(qubit_indices) <= max_width
+                                    or any(Op is Op2 for Op2, _ in circuit.steps))
+                self.assertLess(max_absolute_difference(fused(x), expected), epsilon)
+
+    def test_fuse_single_qubit_chain(self):
+        circuit = qc.Circuit(3)
+        for i in range(3):
+            circuit.add(qc.Hadamard(), [1]).add(qc.RotationZ(0.3), [1])
+        circuit.add(qc.Hadamard(), [1])
+        circuit.add(qc.CNOT(), [0, 2])
+
+        fused = circuit.fuse(max_width=1)
+        self.assertEqual(len(fused), 2)
+        self.assertEqual(fused.steps[0][1], (1,))
+        self.assertEqual(fused.steps[1][1], (0, 2))
+        # An operator that is not merged keeps its structure
+        self.assertIs(fused.steps[1][0], circuit.steps[-1][0])
+
+        x = random_state(3)
+        self.assertLess(max_absolute_difference(fused(x), circuit(x)), epsilon)
+
+        with self.assertRaises(ValueError):
+            circuit.fuse(max_width=0)
+
+    def test_compiled_circuit_equivalent(self):
+        for test_i in range(10):
+            d = np.random.randint(1, 7)
+            circuit = self.random_circuit(d, num_steps=20)
+
+            for max_width in [None, 1, 2]:
+                compiled = circuit.compile(max_width)
+                for state_i in range(3):
+                    x = random_state(d)
+                    self.assertLess(max_absolute_difference(compiled(x), circuit(x)), epsilon)
+
+            rho = qc.DensityOperator.from_ensemble([random_state(d)])
+            self.assertLess(max_absolute_difference(circuit.compile()(rho), circuit(rho)),
+                            epsilon)
+
+    def test_compile_cache(self):
+        H, CNOT = qc.Hadamard(), qc.CNOT()
+        circuit = qc.Circuit(3).add(H, [0]).add(CNOT, [0, 1]).add(CNOT, [1, 2])
+        compiled = circuit.compile()
+        self.assertIs(circuit.compile(), compiled)
+
+        # A separately built circuit with the same structure hits the cache
+        same = qc.Circuit(3).add(H, [0]).add(CNOT, [0, 1]).add(CNOT, [1, 2])
+        self.assertIs(same.compile(), compiled)
+
+        # So does one built from fresh operators with the same data
+        same = qc.Circuit(3).add(qc.Hadamard(), [0]).add(qc.CNOT(), [0, 1])
+        same.add(qc.CNOT(), [1, 2])
+        self.assertIs(same.compile(), compiled)
+        U = random_unitary_operator(2)
+        fresh = qc.Circuit(2).add(U, [0, 1])
+        self.assertIs(qc.Circuit(2).add(qc.Operator(U[:]), [0, 1]).compile(),
+                      fresh.compile())
+
+        # But not one with different operators
+        other = qc.Circuit(3).add(qc.PauliX(), [0]).add(CNOT, [0, 1]).add(CNOT, [1, 2])
+        self.assertIsNot(other.compile(), compiled)
+        self.assertIsNot(qc.Circuit(2).add(U.adj, [0, 1]).compile(), fresh.compile())
+
+        # Changing the circuit or the fusion width misses it
+        self.assertIsNot(circuit.compile(max_width=1), compiled)
+        circuit.add(H, [2])
+        self.assertIsNot(circuit.compile(), compiled)
+
+    def test_circuit_bad_arguments(self):
+        circuit = qc.Circuit(3)
+        with self.assertRaises(ValueError):
+            circuit.add(qc.CNOT(), [0, 0])
+        with self.assertRaises(ValueError):
+            circuit.add(qc.CNOT(), [0, 3])
+        with self.assertRaises(ValueError):
+            circuit.add(qc.Hadamard())
+        with self.assertRaises(TypeError):
+            circuit.add(qc.zeros(1), [0])
+        with self.assertRaises(ValueError):
+            circuit(qc.zeros(2))
+
+
+class StateBatchTests(unittest.TestCase):
+
+    def random_batch(self, B, d):
+        return qc.StateBatch.from_states([random_state(d) for _ in range(B)])
+
+    def test_operator_application_matches_per_state(self):
+        operators = [
+            qc.Hadamard(), qc.Phase(), qc.PauliY(), qc.CNOT(), qc.Toffoli(),
+            qc.ControlledU(qc.Hadamard()), random_unitary_operator(2)
+        ]
+        for Op in operators:
+            op_d = Op.rank // 2
+            d = np.random.randint(op_d, 6)
+            batch = self.random_batch(5, d)
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+
+            result = Op(batch, qubit_indices=qubit_indices)
+            self.assertIsInstance(result, qc.StateBatch)
+            for x, y in zip(batch.to_states(), result.to_states()):
+                expected = Op(x, qubit_indices=qubit_indices)
+                self.assertLess(max_absolute_difference(y, expected), epsilon)
+
+    def test_circuit_application(self):
+        d = 4
+        circuit = qc.Circuit(d).add(qc.Hadamard(), [2]).add(qc.CNOT(), [2, 0])
+        circuit.add(random_unitary_operator(2), [1, 3])
+        batch = self.random_batch(6, d)
+
+        for result in [circuit(batch), circuit.compile()(batch)]:
+            for x, y in zip(batch.to_states(), result.to_states()):
+                self.assertLess(max_absolute_difference(y, circuit(x)), epsilon)
+
+    def test_dot_and_renormalize(self):
+        batch = self.random_batch(4, 3)
+        other = self.random_batch(4, 3)
+        x = random_state(3)
+
+        dots = batch.dot(other)
+        single_dots = batch.dot(x)
+        for i, (a, b) in enumerate(zip(batch.to_states(), other.to_states())):
+            self.assertLess(abs(dots[i] - a.dot(b)), epsilon)
+            self.assertLess(abs(single_dots[i] - a.dot(x)), epsilon)
+
+        scaled = qc.StateBatch(batch._t * np.arange(1, 5).reshape(4, 1, 1, 1))
+        scaled.renormalize_()
+        self.assertLess(max_absolute_difference(scaled, batch), epsilon)
+
+    def test_probabilities(self):
+        batch = self.random_batch(3, 3)
+        probs = batch.probabilities
+        self.assertEqual(probs.shape, (3, 2, 2, 2))
+        for i, x in enumerate(batch.to_states()):
+            self.assertLess(np.max(np.abs(probs[i] - x.probabilities)), epsilon)
+
+    def test_measure_basis_states(self):
+        bits = np.random.randint(2, size=(50, 4))
+        batch = qc.StateBatch.from_states([qc.bitstring(*b) for b in bits])
+        batch = qc.Hadamard()(qc.Hadamard()(batch, [1]), [1])
+
+        self.assertTrue(np.all(batch.measure([2, 0]) == bits[:, [2, 0]]))
+        self.assertTrue(np.all(batch.measure(3) == bits[:, 3]))
+        self.assertTrue(np.all(batch.measure(remove=True) == bits))
+
+    def test_measure_statistics(self):
+        B = 4000
+        x = qc.positive_superposition(d=2)
+        batch = qc.StateBatch.from_states([x] * B)
+        outcomes = batch.measure(qubit_indices=[1])
+        # The measured qubit is collapsed, and the other is untouched
+        for i in [0, 1, B - 1]:
+            expected = qc.positive_superposition() * qc.bitstring(int(outcomes[i, 0]))
+            self.assertLess(max_absolute_difference(batch.to_states()[i], expected), epsilon)
+
+        self.assertTrue(binom(B, 0.5).ppf(0.001) < np.sum(outcomes) < binom(B, 0.5).ppf(0.999))
+
+    def test_measure_never_draws_impossible_outcomes(self):
+        class LargestDraws(np.random.RandomState):
+            # Always draws the largest value below 1
+            def random(self, size=None):
+                return np.full(size, 1 - 2**-53)
+
+        # States with zero probability for the last outcome, for which the
+        # sum of the probabilities may round to below the draw
+        M = np.random.normal(size=(1000, 4)) + 1j * np.random.normal(size=(1000, 4))
+        M[:, 3] = 0
+        M /= np.linalg.norm(M, axis=1, keepdims=True)
+        batch = qc.StateBatch.from_column_vectors(M)
+        outcomes = batch.measure(packed=True, rng=LargestDraws())
+        self.assertTrue(np.all(outcomes < 3))
+        self.assertTrue(np.all(np.isfinite(batch.to_column_vectors())))
+
+    def test_column_vectors_and_precision(self):
+        M = np.random.normal(size=(5, 8)) + 1j * np.random.normal(size=(5, 8))
+        M /= np.linalg.norm(M, axis=1, keepdims=True)
+        batch = qc.StateBatch.from_column_vectors(M)
+        self.assertEqual(batch.shape, (5, 2, 2, 2))
+        self.assertLess(np.max(np.abs(batch.to_column_vectors() - M)), epsilon)
+
+        batch = batch.astype(np.complex64)
+        result = qc.Hadamard(3)(batch)
+        self.assertEqual(result.dtype, np.complex64)
+        self.assertEqual(result.measure().shape, (5, 3))
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            qc.StateBatch(np.zeros((3, 2, 3)))
+        with self.assertRaises(ValueError):
+            qc.StateBatch.from_states([qc.zeros(2), qc.zeros(3)])
+        with self.assertRaises(ValueError):
+            qc.Hadamard()(self.random_batch(2, 2), [2])
+
+
+class SamplingTests(unittest.TestCase):
+
+    def test_sample_distribution(self):
+        shots = 200000
+        for test_i in range(3):
+            d = np.random.randint(1, 4)
+            x = random_state(d)
+            x_copy = copy.deepcopy(x)
+            ps = x.probabilities
+
+            samples = x.sample(shots=shots)
+            self.assertEqual(samples.shape, (shots, d))
+            counts = np.zeros_like(ps)
+            np.add.at(counts, tuple(samples.T), 1)
+            self.assertLess(np.max(np.abs(ps - counts / shots)), 0.01)
+
+            # Sampling leaves the state untouched
+            self.assertLess(max_absolute_difference(x, x_copy), epsilon)
+
+    def test_sample_counts(self):
+        shots = 200000
+        x = random_state(3)
+        ps = x.probabilities
+
+        counts = x.sample(qubit_indices=[2, 0], shots=shots, counts=True)
+        self.assertEqual(sum(counts.values()), shots)
+        marginal = ps.sum(axis=1)
+        for (b2, b0), count in counts.items():
+            self.assertLess(abs(count / shots - marginal[b0, b2]), 0.01)
+
+        counts = x.sample(qubit_indices=1, shots=shots, counts=True)
+        self.assertTrue(set(counts.keys()) <= {0, 1})
+        self.assertLess(abs(counts.get(1, 0) / shots - ps[:, 1, :].sum()), 0.01)
+
+    def test_sample_deterministic_and_rng(self):
+        bits = (1, 0, 1, 1)
+        x = qc.bitstring(*bits)
+        self.assertTrue(np.all(x.sample(shots=10) == bits))
+        self.assertTrue(np.all(x.sample(qubit_indices=2, shots=10) == 1))
+        self.assertEqual(x.sample(shots=10, counts=True), {bits: 10})
+
+        y = random_state(3)
+        samples1 = y.sample(shots=100, rng=np.random.RandomState(42))
+        samples2 = y.sample(shots=100, rng=np.random.RandomState(42))
+        self.assertTrue(np.all(samples1 == samples2))
+
+        with self.assertRaises(ValueError):
+            y.sample(qubit_indices=[3])
+        with self.assertRaises(ValueError):
+            y.sample(shots=-1)
+
+
+class PackedResultsTests(unittest.TestCase):
+
+    def test_pack_unpack_roundtrip(self):
+        for num_qubits in [1, 5, 64, 65, 130]:
+            bits = np.random.randint(2, size=(100, num_qubits))
+            packed = qc.results.pack_bits(bits)
+            if num_qubits <= 64:
+                self.assertEqual(packed.dtype, np.uint64)
+                self.assertEqual(packed.shape, (100,))
+            else:
+                self.assertEqual(packed.dtype, np.uint8)
+                self.assertEqual(packed.shape, (100, (num_qubits + 7) // 8))
+            self.assertTrue(np.all(qc.results.unpack_bits(packed, num_qubits) == bits))
+
+    def test_packed_sample_matches_bits(self):
+        x = random_state(4)
+        rng_state = np.random.RandomState(3)
+        packed = x.sample(shots=1000, rng=rng_state, packed=True)
+        bits = x.sample(shots=1000, rng=np.random.RandomState(3))
+        self.assertEqual(packed.dtype, np.uint64)
+        self.assertTrue(np.all(qc.results.unpack_bits(packed, 4) == bits))
+        self.assertTrue(np.all(qc.results.pack_bits(bits) == packed))
+
+    def test_marginal_histogram_bitstrings(self):
+        for num_qubits in [6, 70]:
+            bits = np.random.randint(2, size=(500, num_qubits))
+            packed = qc.results.pack_bits(bits)
+
+            positions = [num_qubits - 1, 0, 3]
+            marginal = qc.results.marginal(packed, num_qubits, positions)
+            self.assertTrue(np.all(qc.results.unpack_bits(marginal, 3) == bits[:, positions]))
+
+            outcomes, counts = qc.results.histogram(marginal, 3)
+            self.assertEqual(np.sum(counts), 500)
+            for outcome, count in zip(outcomes, counts):
+                expected_bits = [int(outcome) >> i & 1 for i in [2, 1, 0]]
+                self.assertEqual(count, np.sum(np.all(bits[:, positions] == expected_bits, axis=1)))
+
+            strings = qc.results.to_bitstrings(packed, num_qubits)
+            self.assertEqual(strings[7], ''.join(str(b) for b in bits[7]))
+
+    def test_batch_packed_measurement(self):
+        bits = np.random.randint(2, size=(20, 3))
+        batch = qc.StateBatch.from_states([qc.bitstring(*b) for b in bits])
+        packed = batch.measure(packed=True)
+        self.assertTrue(np.all(packed == qc.results.pack_bits(bits)))
+
+    def test_bad_arguments(self):
+        with self.assertRaises(ValueError):
+            qc.results.pack_bits(np.zeros(5))
+        with self.assertRaises(ValueError):
+            qc.results.unpack_bits(np.zeros((5, 2), dtype=np.uint8), 4)
+        with self.assertRaises(ValueError):
+            qc.results.marginal(np.zeros(5, dtype=np.uint64), 4, [4])
+
+
+class RandomNumberGeneratorTests(unittest.TestCase):
+
+    def test_seeded_measurement_reproducible(self):
+        x = random_state(5)
+        rho = qc.DensityOperator.from_ensemble([x, random_state(5)])
+        batch = qc.StateBatch.from_states([x] * 10)
+
+        for rng1, rng2 in [(7, 7), (np.random.default_rng(7), np.random.default_rng(7)),
+                           (np.random.RandomState(7), np.random.RandomState(7))]:
+            self.assertEqual(copy.deepcopy(x).measure(rng=rng1),
+                             copy.deepcopy(x).measure(rng=rng2))
+        self.assertEqual(copy.deepcopy(rho).measure(rng=3), copy.deepcopy(rho).measure(rng=3))
+        self.assertTrue(np.all(copy.deepcopy(batch).measure(rng=3) ==
+                               copy.deepcopy(batch).measure(rng=3)))
+        self.assertTrue(np.all(x.sample(shots=50, rng=3) == x.sample(shots=50, rng=3)))
+
+        # The same generator continues its stream
+        rng = np.random.default_rng(0)
+        self.assertFalse(np.all(x.sample(shots=50, rng=rng) == x.sample(shots=50, rng=rng)))
+
+    def test_global_random_state(self):
+        x = random_state(4)
+        # Restore the global state afterwards, so later tests stay random
+        state = np.random.get_state()
+        np.random.seed(11)
+        samples1 = x.sample(shots=20)
+        np.random.seed(11)
+        samples2 = x.sample(shots=20)
+        np.random.set_state(state)
+        self.assertTrue(np.all(samples1 == samples2))
+
+    def test_spawn(self):
+        x = random_state(6)
+        streams1 = qc.rng.spawn(42, 4)
+        streams2 = qc.rng.spawn(np.random.SeedSequence(42), 4)
+        samples1 = [x.sample(shots=100, rng=g, packed=True) for g in streams1]
+        samples2 = [x.sample(shots=100, rng=g, packed=True) for g in streams2]
+        for a, b in zip(samples1, samples2):
+            self.assertTrue(np.all(a == b))
+        # Different workers get different streams
+        self.assertFalse(np.all(samples1[0] == samples1[1]))
+
+        self.assertEqual(len(qc.rng.spawn(np.random.default_rng(1), 3)), 3)
+        self.assertEqual(len(qc.rng.spawn(None, 2)), 2)
+
+    def test_choice_distribution(self):
+        ps = np.array([0.1, 0.0, 0.6, 0.3, 0.0])
+        outcomes = qc.rng._choice(np.random.default_rng(5), ps, size=100000)
+        frequencies = np.bincount(outcomes, minlength=5) / 100000
+        self.assertLess(np.max(np.abs(frequencies - ps)), 0.01)
+        self.assertEqual(frequencies[1], 0)
+        self.assertEqual(frequencies[4], 0)
+
+    def test_bad_rng(self):
+        with self.assertRaises(ValueError):
+            qc.zeros(2).measure(rng='seed')
+        with self.assertRaises(ValueError):
+            qc.rng.spawn(np.random.RandomState(0), 2)
+
+
+class FusedMeasurementTests(unittest.TestCase):
+
+    def reference_marginal(self, x, qubit_indices):
+        d = x.rank
+        rest = [i for i in range(d) if i not in qubit_indices]
+        probs = np.transpose(x.probabilities, list(qubit_indices) + rest)
+        return probs.reshape(2**len(qubit_indices), -1).sum(axis=1)
+
+    def test_marginal_probabilities(self):
+        for test_i in range(20):
+            d = np.random.randint(1, 8)
+            x = random_state(d)
+            if np.random.rand() < 0.5:
+                # A non-contiguous view of a tensor
+                x.permute_qubits(np.random.permutation(d))
+            k = np.random.randint(1, d + 1)
+            qubit_indices = list(np.random.choice(d, size=k, replace=False))
+
+            ps = x._marginal_probabilities(qubit_indices)
+            self.assertEqual(ps.dtype, np.float64)
+            assert_allclose(ps, self.reference_marginal(x, qubit_indices), atol=epsilon)
+
+    def test_collapse_in_place(self):
+        for test_i in range(20):
+            d = np.random.randint(2, 8)
+            x = random_state(d)
+            if np.random.rand() < 0.5:
+                x.permute_qubits(np.random.permutation(d))
+            qubit_indices = list(np.random.choice(d, size=np.random.randint(1, d), replace=False))
+            x_copy = copy.deepcopy(x)
+            t = x._t
+
+            bits = x.measure(qubit_indices)
+            self.assertIs(x._t, t)
+            self.assertLess(abs(np.sum(x.probabilities) - 1.0), epsilon)
+
+            # The expected collapsed state, from the pre-measurement state
+            idx = [slice(None)] * d
+            for i, b in zip(qubit_indices, bits):
+                idx[i] = b
+            expected = np.zeros_like(x_copy._t)
+            expected[tuple(idx)] = x_copy._t[tuple(idx)]
+            expected /= np.linalg.norm(expected)
+            self.assertLess(np.max(np.abs(x._t - expected)), epsilon)
+
+            # Removing the measured qubits keeps only the outcome's slice
+            y = copy.deepcopy(x_copy)
+            bits2 = y.measure(qubit_indices, remove=True, rng=np.random.default_rng(0))
+            z = copy.deepcopy(x_copy)
+            z.measure(qubit_indices, rng=np.random.default_rng(0))
+            idx = [slice(None)] * d
+            for i, b in zip(qubit_indices, bits2):
+                idx[i] = b
+            self.assertLess(np.max(np.abs(y._t - z._t[tuple(idx)])), epsilon)
+
+    def test_non_unit_state(self):
+        with self.assertRaises(RuntimeError):
+            qc.State(np.ones((2, 2))).measure()
+
+
+class OutOfCoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.block_size = qc.kernels.out_of_core_block_size
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        qc.kernels.out_of_core_block_size = self.block_size
+        self.directory.cleanup()
+
+    def test_blocked_application(self):
+        operators = [
+            qc.Hadamard(), qc.Phase(), qc.PauliY(), qc.CNOT(), qc.Toffoli(),
+            qc.ControlledU(random_unitary_operator(1)), random_unitary_operator(2)
+        ]
+        for Op in operators:
+            for block_size in [1, 4, 32, 2**10]:
+                op_d = Op.rank // 2
+                d = np.random.randint(op_d, 8)
+                x = random_state(d)
+                qubit_indices = list(np.random.choice(d, size=op_d, replace=False))
+
+                expected = Op(x, qubit_indices=qubit_indices)
+                t = np.copy(x._t)
+                qc.kernels.apply_blocked(Op._get_kernel(), t, qubit_indices, block_size)
+                self.assertLess(np.max(np.abs(t - expected._t)), epsilon)
+
+    def test_memmap_state(self):
+        qc.kernels.out_of_core_block_size = 16
+        d = 8
+        filename = os.path.join(self.directory.name, 'state.dat')
+        x = qc.memmap_state(filename, d)
+        y = qc.zeros(d)
+        self.assertLess(max_absolute_difference(x, y), epsilon)
+
+        circuit = qc.Circuit(d)
+        for i in range(d):
+            circuit.add(qc.Hadamard(), [i])
+        circuit.add(qc.CNOT(), [0, 7]).add(random_unitary_operator(2), [6, 1])
+        circuit.add(qc.RotationZ(0.3), [4])
+
+        t = x._t
+        circuit(x, inplace=True)
+        y = circuit(y)
+        self.assertIs(x._t, t)
+        self.assertLess(max_absolute_difference(x, y), epsilon)
+
+        # Measurement collapses the file in place
+        bits = x.measure([2, 5], rng=1)
+        y.measure([2, 5], rng=1)
+        self.assertIs(x._t, t)
+        self.assertLess(max_absolute_difference(x, y), epsilon)
+
+        # The state persists in the file
+        del x, t
+        z = qc.memmap_state(filename, d, mode='r+')
+        self.assertLess(max_absolute_difference(z, y), epsilon)
+
+    def test_memmap_reductions(self):
+        qc.kernels.out_of_core_block_size = 8
+        d = 7
+        filename = os.path.join(self.directory.name, 'state.dat')
+        x = qc.memmap_state(filename, d)
+        y = random_state(d)
+        x._t[...] = y._t
+
+        assert_allclose(x.probabilities, y.probabilities)
+        assert_allclose(x.amplitudes, y.amplitudes)
+        self.assertFalse(x.amplitudes.flags.writeable)
+        for qubit_indices in [[], [3], [6, 0], [1, 4, 2]]:
+            assert_allclose(x._marginal_probabilities(qubit_indices),
+                            y._marginal_probabilities(qubit_indices))
+
+        # Removing measured qubits compacts the state into the file
+        t = x._t
+        x.measure([5, 0], remove=True, rng=2)
+        y.measure([5, 0], remove=True, rng=2)
+        self.assertEqual(x.shape, (2,) * (d - 2))
+        self.assertTrue(np.shares_memory(x._t, t))
+        self.assertLess(max_absolute_difference(x, y), epsilon)
+        self.assertLess(abs(np.sum(x.probabilities) - 1), epsilon)
+
+
+class SparseOperatorTests(unittest.TestCase):
+
+    def random_sparse_operator(self, d):
+        # Two entries in each row, so the operator is neither diagonal
+        # nor a permutation
+        n = 2**d
+        permutation = np.random.permutation(n)
+        rows = np.repeat(np.arange(n), 2)
+        cols = np.stack([permutation, (permutation + 1) % n], axis=1).ravel()
+        values = np.random.normal(size=2*n) + 1j * np.random.normal(size=2*n)
+        M = scipy.sparse.coo_matrix((values, (rows, cols)), shape=(n, n))
+        return qc.Operator.from_matrix(M), M.toarray()
+
+    def test_sparse_application(self):
+        for test_i in range(10):
+            op_d = np.random.randint(2, 5)
+            d = np.random.randint(op_d, 7)
+            Op, M = self.random_sparse_operator(op_d)
+            self.assertIsNone(Op._tensor)
+            self.assertIsInstance(Op._get_kernel(), qc.kernels.SparseKernel)
+            x = random_state(d)
+            qubit_indices = np.random.choice(d, size=op_d, replace=False)
+
+            # Non-unitary operators renormalize the state
+            result = Op(x, qubit_indices=qubit_indices)
+            dense = qc.Operator.from_matrix(M)
+            expected = reference_application(dense, x, qubit_indices)
+            expected /= np.linalg.norm(expected)
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+            self.assertIsNone(Op._tensor)
+
+    def test_sparse_detection(self):
+        M = np.zeros((16, 16), dtype=np.complex128)
+        M[np.arange(16), np.arange(16)] = 1
+        M[3, 7] = 0.5
+        Op = qc.Operator.from_matrix(M)
+        self.assertIsInstance(Op._get_kernel(), qc.kernels.SparseKernel)
+        x = random_state(4)
+        v = M @ x.to_column_vector()
+        expected = qc.State.from_column_vector(v / np.linalg.norm(v))
+        self.assertLess(max_absolute_difference(Op(x), expected), epsilon)
+
+    def test_sparse_stays_sparse(self):
+        for test_i in range(10):
+            d = np.random.randint(2, 5)
+            A, M_A = self.random_sparse_operator(d)
+            B, M_B = self.random_sparse_operator(d)
+
+            # Composition
+            AB = A(B)
+            self.assertIsNone(AB._tensor)
+            self.assertLess(np.max(np.abs(AB.to_matrix() - M_A @ M_B)), epsilon)
+
+            # Composition with a smaller operator
+            C = qc.CNOT()(B, qubit_indices=[d-1, 0])
+            self.assertIsNone(C._tensor)
+            expected = qc.CNOT()(qc.Identity(d), qubit_indices=[d-1, 0]).to_matrix() @ M_B
+            self.assertLess(np.max(np.abs(C.to_matrix() - expected)), epsilon)
+
+            # Adjoint
+            A_adj = A.adj
+            self.assertIsNone(A_adj._tensor)
+            self.assertLess(np.max(np.abs(A_adj.to_matrix() - M_A.conj().T)), epsilon)
+
+            # Tensor products
+            AX = A * qc.PauliX()
+            self.assertIsNone(AX._tensor)
+            self.assertLess(np.max(np.abs(AX.to_matrix() - np.kron(M_A, [[0, 1], [1, 0]]))),
+                            epsilon)
+            A2 = A**2
+            self.assertIsNone(A2._tensor)
+            self.assertLess(np.max(np.abs(A2.to_matrix() - np.kron(M_A, M_A))), epsilon)
+
+    def test_structured_results(self):
+        # Products of permutations and diagonals keep the specific structure
+        U = qc.CNOT()(qc.Swap())
+        self.assertIsInstance(U._get_kernel(), qc.kernels.PermutationKernel)
+        U = qc.PauliZ()(qc.Phase())
+        self.assertIsInstance(U._get_kernel(), qc.kernels.DiagonalKernel)
+        U = qc.Toffoli() * qc.CNOT()
+        self.assertIsInstance(U._get_kernel(), qc.kernels.PermutationKernel)
+        self.assertLess(np.max(np.abs(
+            U.to_matrix() - np.kron(qc.Toffoli().to_matrix(), qc.CNOT().to_matrix()))), epsilon)
+        # Single-qubit factors are kept as they are
+        U = qc.Toffoli() * qc.PauliY()
+        self.assertIsInstance(U._get_kernel(), qc.kernels.KroneckerKernel)
+        self.assertLess(np.max(np.abs(
+            U.to_matrix() - np.kron(qc.Toffoli().to_matrix(), qc.PauliY().to_matrix()))), epsilon)
+        U = qc.ControlledU(qc.Hadamard()).adj
+        self.assertIsInstance(U._get_kernel(), qc.kernels.ControlledKernel)
+
+    def test_sparse_density_operator(self):
+        A, M = self.random_sparse_operator(3)
+        rho = qc.DensityOperator.from_ensemble([random_state(3), random_state(3)], [0.3, 0.7])
+        result = A(rho)
+        expected = M @ rho.to_matrix() @ M.conj().T
+        self.assertLess(np.max(np.abs(result.to_matrix() - expected)), epsilon)
+
+    def test_from_coo(self):
+        Op = qc.Operator.from_coo([0, 1, 1], [1, 0, 0], [1.0, 0.5, 0.5], d=1)
+        self.assertIsInstance(Op._get_kernel(), qc.kernels.PermutationKernel)
+        self.assertLess(max_absolute_difference(Op, qc.PauliX()), epsilon)
+        with self.assertRaises(ValueError):
+            qc.Operator.from_coo([0, 2], [0, 1], [1.0, 1.0], d=1)
+        with self.assertRaises(ValueError):
+            qc.Operator.from_coo([0, 1], [0], [1.0, 1.0], d=1)
+
+
+class KroneckerOperatorTests(unittest.TestCase):
+
+    def random_product(self, widths):
+        factors = [random_unitary_operator(w) for w in widths]
+        Op = factors[0]
+        for factor in factors[1:]:
+            Op = Op * factor
+        M = factors[0].to_matrix()
+        for factor in factors[1:]:
+            M = np.kron(M, factor.to_matrix())
+        return Op, M
+
+    def test_factors_kept(self):
+        H = qc.Hadamard(20)
+        self.assertIsNone(H._tensor)
+        self.assertEqual(len(H._get_kernel().factors), 20)
+        self.assertIsNone((H * H)._tensor)
+        self.assertEqual(qc.Hadamard(3).shape, (2,) * 6)
+
+        x = qc.positive_superposition(20)
+        self.assertLess(np.max(np.abs(x.probabilities - 2**-20)), epsilon)
+
+    def test_factory_tensor_powers(self):
+        factories = [qc.Identity, qc.PauliX, qc.PauliY, qc.PauliZ, qc.Hadamard,
+                     qc.Phase, qc.PiBy8, qc.SqrtNot]
+        for factory in factories:
+            # Built from 2x2 factors, without arrays of size 2^d
+            Op = factory(40)
+            self.assertIsNone(Op._tensor)
+            kernel = Op._get_kernel()
+            self.assertIsInstance(kernel, qc.kernels.KroneckerKernel)
+            self.assertEqual([f.d for f in kernel.factors], [1] * 40)
+
+            M = factory().to_matrix()
+            expected = np.kron(np.kron(M, M), M)
+            self.assertLess(np.max(np.abs(factory(3).to_matrix() - expected)), epsilon)
+
+    def test_tensor_product(self):
+        for test_i in range(10):
+            widths = list(np.random.randint(1, 3, size=3))
+            Op, M = self.random_product(widths)
+            self.assertIsInstance(Op._get_kernel(), qc.kernels.KroneckerKernel)
+            self.assertLess(np.max(np.abs(Op.to_matrix() - M)), epsilon)
+
+            # Application factor by factor
+            d = sum(widths)
+            n = np.random.randint(d, d + 3)
+            x = random_state(n)
+            qubit_indices = np.random.choice(n, size=d, replace=False)
+            expected = reference_application(qc.Operator.from_matrix(M), x, qubit_indices)
+            result = Op(x, qubit_indices=qubit_indices)
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+    def test_factorwise_composition(self):
+        for test_i in range(10):
+            A, M_A = self.random_product([1, 2, 1])
+            B, M_B = self.random_product([1, 2, 1])
+            AB = A(B)
+            self.assertIsNone(AB._tensor)
+            self.assertEqual([f.d for f in AB._get_kernel().factors], [1, 2, 1])
+            self.assertLess(np.max(np.abs(AB.to_matrix() - M_A @ M_B)), epsilon)
+
+            # An operator acting across factors merges only those factors
+            C = qc.CNOT()(B, qubit_indices=[3, 2])
+            self.assertEqual([f.d for f in C._get_kernel().factors], [1, 3])
+            expected = qc.CNOT()(qc.Identity(4), qubit_indices=[3, 2]).to_matrix() @ M_B
+            self.assertLess(np.max(np.abs(C.to_matrix() - expected)), epsilon)
+
+    def test_adjoint_and_scaling(self):
+        Op, M = self.random_product([2, 1])
+        self.assertIsNone(Op.adj._tensor)
+        self.assertLess(np.max(np.abs(Op.adj.to_matrix() - M.conj().T)), epsilon)
+        self.assertLess(np.max(np.abs((2j * Op).to_matrix() - 2j * M)), epsilon)
+        self.assertEqual(Op.astype(np.complex64).dtype, np.complex64)
+
+    def test_density_operator(self):
+        Op, M = self.random_product([1, 1, 1])
+        rho = qc.DensityOperator.from_ensemble([random_state(3), random_state(3)], [0.4, 0.6])
+        expected = M @ rho.to_matrix() @ M.conj().T
+        self.assertLess(np.max(np.abs(Op(rho).to_matrix() - expected)), epsilon)
+
+
+class LazyAdjointTests(unittest.TestCase):
+
+    def test_adjoint_shares_tensor(self):
+        for test_i in range(10):
+            d = np.random.randint(2, 4)
+            U = random_unitary_operator(d)
+            M = U.to_matrix()
+            U_adj = U.adj
+
+            kernel = U_adj._get_kernel()
+            self.assertIsInstance(kernel, qc.kernels.DenseKernel)
+            self.assertIs(kernel.tensor, U._get_kernel().tensor)
+            self.assertIsNone(U_adj._tensor)
+
+            # Application honours the conjugate and transpose flags
+            n = np.random.randint(d, d + 3)
+            x = random_state(n)
+            qubit_indices = np.random.choice(n, size=d, replace=False)
+            expected = reference_application(qc.Operator.from_matrix(M.conj().T), x, qubit_indices)
+            result = U_adj(x, qubit_indices=qubit_indices)
+            self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+            self.assertLess(max_absolute_difference(U_adj(U), qc.Identity(d)), epsilon)
+            self.assertLess(np.max(np.abs(U_adj.to_matrix() - M.conj().T)), epsilon)
+            self.assertIs(U_adj.adj._get_kernel().tensor, U._get_kernel().tensor)
+            self.assertLess(max_absolute_difference(U_adj.adj, U), epsilon)
+
+    def test_adjoint_operations(self):
+        U = random_unitary_operator(2)
+        M = U.to_matrix()
+        U_adj = U.adj
+        self.assertLess(np.max(np.abs((1j * U_adj).to_matrix() - 1j * M.conj().T)), epsilon)
+        self.assertLess(
+            np.max(np.abs(U_adj.astype(np.complex64).to_matrix() - M.conj().T)), 1e-6)
+        rho = qc.DensityOperator.from_ensemble([random_state(2), random_state(2)], [0.5, 0.5])
+        expected = M.conj().T @ rho.to_matrix() @ M
+        self.assertLess(np.max(np.abs(U_adj(rho).to_matrix() - expected)), epsilon)
+
+    def test_adjoint_unchanged_by_writes(self):
+        # Writing into an operator in-place or with out= leaves an adjoint
+        # taken before the write as the adjoint of the old operator
+        U = random_unitary_operator(2)
+        V = random_unitary_operator(2)
+        M = U.to_matrix()
+        x = random_state(2)
+        expected = qc.Operator.from_matrix(M.conj().T)(x)
+
+        U_adj = U.adj
+        V(U, inplace=True)
+        self.assertLess(np.max(np.abs(U.to_matrix() - V.to_matrix() @ M)), epsilon)
+        self.assertLess(np.max(np.abs(U_adj.to_matrix() - M.conj().T)), epsilon)
+        self.assertLess(max_absolute_difference(U_adj(x), expected), epsilon)
+
+        W = random_unitary_operator(2)
+        W_adj = W.adj
+        M = W.to_matrix()
+        V(qc.Identity(2), out=W)
+        self.assertLess(max_absolute_difference(W, V), epsilon)
+        self.assertLess(np.max(np.abs(W_adj.to_matrix() - M.conj().T)), epsilon)
+
+    def test_adjoint_unchanged_by_writes_after_permuting(self):
+        # Permuting the qubits gives the operator a view of the tensor its
+        # adjoint shares, which a later write must not go into
+        for permute in [lambda A: A.swap_qubits(0, 1), lambda A: A.permute_qubits([1, 0])]:
+            U = random_unitary_operator(2)
+            M = U.to_matrix()
+            x = random_state(2)
+            U_adj = U.adj
+            circuit = qc.Circuit(2).add(U, [0, 1])
+            compiled = circuit.compile()
+            expected = circuit(x)
+
+            permute(U)
+            qc.Hadamard()(U, [0], inplace=True)
+            self.assertLess(np.max(np.abs(U_adj.to_matrix() - M.conj().T)), epsilon)
+            self.assertLess(max_absolute_difference(U_adj(expected), x), epsilon)
+
+            # The compiled circuit is unchanged, and the changed circuit
+            # is compiled afresh
+            self.assertLess(max_absolute_difference(compiled(x), expected), epsilon)
+            self.assertIsNot(circuit.compile(), compiled)
+            self.assertLess(max_absolute_difference(circuit.compile()(x), U(x)), epsilon)
+
+
+class FourierTransformTests(unittest.TestCase):
+
+    def test_qft_matches_circuit(self):
+        for t in range(1, 6):
+            self.assertIsNone(qc.QFT(t)._tensor)
+            expected = QFT(t)
+            self.assertLess(max_absolute_difference(qc.QFT(t), expected), epsilon)
+            self.assertLess(max_absolute_difference(qc.InverseQFT(t), expected.adj), epsilon)
+
+    def test_application(self):
+        for test_i in range(10):
+            d = np.random.randint(1, 5)
+            n = np.random.randint(d, d + 4)
+            x = random_state(n)
+            qubit_indices = np.random.choice(n, size=d, replace=False)
+            for Op in [qc.QFT(d), qc.InverseQFT(d)]:
+                expected = reference_application(qc.Operator.from_matrix(Op.to_matrix()),
+                                                 x, qubit_indices)
+                result = Op(x, qubit_indices=qubit_indices)
+                self.assertLess(max_absolute_difference(result, expected), epsilon)
+
+            y = qc.InverseQFT(d)(qc.QFT(d)(x, qubit_indices), qubit_indices)
+            self.assertLess(max_absolute_difference(x, y), epsilon)
+
+    def test_structure(self):
+        F = qc.QFT(3)
+        self.assertIsInstance(F.adj._get_kernel(), qc.kernels.FourierKernel)
+        self.assertLess(max_absolute_difference(F.adj(F), qc.Identity(3)), epsilon)
+        self.assertEqual(qc.QFT(3).astype(np.complex64).dtype, np.complex64)
+
+        rho = qc.DensityOperator.from_ensemble([random_state(4), random_state(4)], [0.5, 0.5])
+        M = qc.Operator.from_matrix(F.to_matrix())
+        assert_allclose(F(rho, [2, 0, 3])._t, M(rho, [2, 0, 3])._t, atol=1e-12)
+
+        x = random_state(3).astype(np.complex64)
+        self.assertEqual(F(x).dtype, np.complex64)
+
+
+class StabilizerStateTests(unittest.TestCase):
+
+    gates = [qc.Hadamard(), qc.Phase(), qc.Phase().adj, qc.PauliX(), qc.PauliY(),
+             qc.PauliZ(), qc.SqrtNot(), qc.CNOT(), qc.Swap(),
+             qc.ControlledU(qc.PauliZ()), qc.Hadamard(d=2)]
+
+    def test_matches_state_vector(self):
+        for test_i in range(20):
+            d = np.random.randint(1, 6)
+            x = qc.StabilizerState(d)
+            y = qc.zeros(d)
+
+            for step in range(20):
+                op = self.gates[np.random.randint(len(self.gates))]
+                op_d = op.rank // 2
+                if op_d > d:
+                    continue
+                qubit_indices = np.random.choice(d, size=op_d, replace=False)
+                x = op(x, qubit_indices)
+                y = op(y, qubit_indices)
+
+                if np.random.rand() < 0.2:
+                    # Collapse the state vector to the stabilizer outcome,
+                    # which must have nonzero probability
+                    i = np.random.randint(d)
+                    outcome = x.measure(int(i))
+                    idx = [slice(None)] * d
+                    idx[i] = 1 - outcome
+                    t = y[:]
+                    t[tuple(idx)] = 0
+                    self.assertGreater(np.linalg.norm(t), 1e-6)
+                    y = qc.State(t / np.linalg.norm(t))
+
+            self.assertAlmostEqual(abs(x.to_state().dot(y)), 1.0)
+
+    def test_bell_state(self):
+        x = qc.CNOT()(qc.Hadamard()(qc.StabilizerState(2), [0]))
+        self.assertEqual(x.stabilizers, ['+XX', '+ZZ'])
+        self.assertLess(max_absolute_difference(x.to_state(), qc.bell_state(0, 0)), epsilon)
+
+        y = qc.PauliX()(x, [1])
+        self.assertEqual(y.stabilizers, ['+XX', '-ZZ'])
+        self.assertEqual(x.stabilizers, ['+XX', '+ZZ'])
+        a, b = y.measure()
+        self.assertNotEqual(a, b)
+
+    def test_many_qubits(self):
+        d = 300
+        x = qc.StabilizerState(d)
+        qc.Hadamard()(x, [0], inplace=True)
+        for i in range(d - 1):
+            qc.CNOT()(x, [i, i + 1], inplace=True)
+        outcomes = x.measure(rng=np.random.default_rng(1))
+        self.assertEqual(len(set(outcomes)), 1)
+        self.assertEqual(x.measure(), outcomes)
+
+        # Tensor products of Clifford operators are applied factor by factor
+        y = qc.Hadamard(d)(qc.StabilizerState(d))
+        self.assertEqual(y.stabilizers[5], '+' + 'I' * 5 + 'X' + 'I' * (d - 6))
+
+    def test_pauli_tensor_powers(self):
+        for Op in [qc.PauliX(4), qc.PauliY(4), qc.PauliZ(4), qc.Phase(4), qc.Identity(4)]:
+            x = qc.Hadamard()(qc.StabilizerState(5), [2])
+            y = qc.Hadamard()(qc.zeros(5), [2])
+            x = Op(x, [4, 0, 2, 1])
+            y = Op(y, [4, 0, 2, 1])
+            self.assertAlmostEqual(abs(x.to_state().dot(y)), 1.0)
+
+        x = qc.PauliX(40)(qc.StabilizerState(40))
+        self.assertEqual(x.measure(), (1,) * 40)
+
+    def test_circuits(self):
+        circuit = qc.Circuit(3)
+        circuit.add(qc.Hadamard(), [0]).add(qc.CNOT(), [0, 1]).add(qc.Phase(), [1])
+        circuit.add(qc.CNOT(), [1, 2]).add(qc.Hadamard(), [2])
+        expected = circuit(qc.zeros(3))
+        for f in [circuit, circuit.compile(), circuit.compile(max_width=None)]:
+            x = f(qc.StabilizerState(3))
+            self.assertAlmostEqual(abs(x.to_state().dot(expected)), 1.0)
+
+    def test_non_clifford(self):
+        x = qc.StabilizerState(3)
+        for op in [qc.PiBy8(), qc.Toffoli(), qc.RotationX(0.3), qc.SqrtSwap()]:
+            with self.assertRaises(ValueError):
+                op(x, list(range(op.rank // 2)))
+        with self.assertRaises(ValueError):
+            qc.QFT(4)(qc.StabilizerState(4))
+
+    def test_reproducible(self):
+        x = qc.Hadamard(d=10)(qc.StabilizerState(10))
+        outcomes = [x._copy_into(None).measure(rng=5) for i in range(2)]
+        self.assertEqual(outcomes[0], outcomes[1])
+
+
+class MatrixProductStateTests(unittest.TestCase):
+
+    def test_matches_state_vector(self):
+        for test_i in range(20):
+            d = np.random.randint(2, 7)
+            x = qc.MatrixProductState(d)
+            y = qc.zeros(d)
+
+            for step in range(20):
+                op_d = np.random.randint(1, 3)
+                op = random_unitary_operator(op_d)
+                qubit_indices = np.random.choice(d, size=op_d, replace=False)
+                x = op(x, qubit_indices)
+                y = op(y, qubit_indices)
+
+            assert_allclose(x.to_state().to_column_vector(), y.to_column_vector(),
+                            atol=1e-6)
+            bits = np.random.randint(2, size=d)
+            self.assertAlmostEqual(x.amplitude(bits), y[tuple(bits)])
+            for k in range(1, d):
+                self.assertEqual(x.schmidt_number(list(range(k, d))),
+                                 y.schmidt_number(list(range(k, d))))
+
+    def test_from_state(self):
+        for test_i in range(10):
+            d = np.random.randint(1, 7)
+            y = random_state(d)
+            x = qc.MatrixProductState.from_state(y)
+            self.assertLess(max_absolute_difference(x.to_state(), y), epsilon)
+            self.assertEqual(x.rank, d)
+
+    def test_measurement(self):
+        for test_i in range(10):
+            d = np.random.randint(2, 6)
+            y = random_state(d)
+            x = qc.MatrixProductState.from_state(y)
+            i = np.random.randint(d)
+
+            outcome = x.measure(i)
+            idx = [slice(None)] * d
+            idx[i] = 1 - outcome
+            t = y[:]
+            t[tuple(idx)] = 0
+            expected = qc.State(t / np.linalg.norm(t))
+            self.assertLess(max_absolute_difference(x.to_state(), expected), epsilon)
+
+        x = qc.CNOT()(qc.Hadamard()(qc.MatrixProductState(2), [0]))
+        a, b = x.measure(rng=3)
+        self.assertEqual(a, b)
+        self.assertEqual(x.measure(), (a, b))
+
+    def test_truncation(self):
+        d = 8
+        x = qc.Hadamard(d)(qc.MatrixProductState(d))
+        for layer in range(4):
+            for i in range(d - 1):
+                x = random_unitary_operator(2)(x, [i, i + 1])
+        self.assertEqual(x.truncation_error, 0.0)
+
+        y = qc.MatrixProductState.from_state(x.to_state(), max_bond_dimension=2)
+        self.assertTrue(all(chi <= 2 for chi in y.bond_dimensions))
+        self.assertGreater(y.truncation_error, 0.0)
+        self.assertAlmostEqual(np.linalg.norm(y.to_state().to_column_vector()), 1.0)
+
+        with self.assertRaises(ValueError):
+            qc.MatrixProductState(d, max_bond_dimension=0)
+
+    def test_many_qubits(self):
+        d = 80
+        x = qc.MatrixProductState(d)
+        qc.Hadamard()(x, [0], inplace=True)
+        for i in range(d - 1):
+            qc.CNOT()(x, [i, i + 1], inplace=True)
+        self.assertEqual(x.bond_dimensions, [2] * (d - 1))
+        self.assertEqual(x.schmidt_number(list(range(40))), 2)
+        self.assertAlmostEqual(abs(x.amplitude([1] * d))**2, 0.5)
+
+        outcomes = x.measure(rng=np.random.default_rng(1))
+        self.assertEqual(len(set(outcomes)), 1)
+        self.assertEqual(x.measure(), outcomes)
+
+        # Non-adjacent qubits are swapped together and back
+        y = qc.CNOT()(qc.Hadamard()(qc.MatrixProductState(d), [0]), [0, d - 1])
+        self.assertAlmostEqual(abs(y.amplitude([1] + [0] * (d - 2) + [1]))**2, 0.5)
+        self.assertEqual(y.bond_dimensions, [2] * (d - 1))
+
+    def test_pauli_tensor_powers(self):
+        for Op in [qc.PauliX(3), qc.PauliY(3), qc.PauliZ(3), qc.Identity(3), qc.Phase(3)]:
+            x = qc.CNOT()(qc.Hadamard()(qc.MatrixProductState(4), [0]), [0, 3])
+            y = qc.CNOT()(qc.Hadamard()(qc.zeros(4), [0]), [0, 3])
+            x = Op(x, [3, 1, 0])
+            y = Op(y, [3, 1, 0])
+            self.assertLess(max_absolute_difference(x.to_state(), y), epsilon)
+            self.assertEqual(x.bond_dimensions, [2, 2, 2])
+
+        x = qc.PauliX(80)(qc.MatrixProductState(80))
+        self.assertAlmostEqual(abs(x.amplitude([1] * 80)), 1.0)
+        self.assertEqual(x.bond_dimensions, [1] * 79)
+
+    def test_circuits(self):
+        circuit = qc.Circuit(4)
+        circuit.add(qc.Hadamard(), [0]).add(qc.CNOT(), [0, 2]).add(qc.PiBy8(), [2])
+        circuit.add(qc.SqrtSwap(), [3, 1]).add(qc.Hadamard(d=2), [1, 3])
+        expected = circuit(qc.zeros(4))
+        for f in [circuit, circuit.compile(), circuit.compile(max_width=None)]:
+            x = f(qc.MatrixProductState(4))
+            self.assertLess(max_absolute_difference(x.to_state(), expected), epsilon)
+
+    def test_invalid(self):
+        x = qc.MatrixProductState(4)
+        with self.assertRaises(ValueError):
+            qc.Toffoli()(x, [0, 1, 2])
+        with self.assertRaises(ValueError):
+            x.schmidt_number([0, 2])
+        with self.assertRaises(ValueError):
+            x.amplitude([0, 1])
+
+
+class SparseStateTests(unittest.TestCase):
+
+    gates = [qc.PauliX(), qc.CNOT(), qc.Toffoli(), qc.Swap(), qc.Hadamard(),
+             qc.Phase(), qc.RotationY(0.4), qc.QFT(2)]
+
+    def test_matches_state_vector(self):
+        for test_i in range(20):
+            d = np.random.randint(1, 7)
+            bits = np.random.randint(2, size=d)
+            x = qc.bitstring(*bits, sparse=True)
+            y = qc.bitstring(*bits)
+            # Half of the states stay sparse throughout
+            if test_i % 2 == 0:
+                x.densify_threshold = 1.0
+
+            for step in range(15):
+                op = self.gates[np.random.randint(len(self.gates))]
+                op_d = op.rank // 2
+                if op_d > d:
+                    continue
+                qubit_indices = np.random.choice(d, size=op_d, replace=False)
+                x = op(x, qubit_indices)
+                y = op(y, qubit_indices)
+
+                if np.random.rand() < 0.2:
+                    i = np.random.randint(d)
+                    seed = np.random.randint(2**30)
+                    self.assertEqual(x.measure(int(i), rng=seed),
+                                     y.measure(int(i), rng=seed))
+
+            self.assertLess(max_absolute_difference(x.to_state(), y), epsilon)
+            bits = np.random.randint(2, size=d)
+            self.assertAlmostEqual(x.amplitude(bits), y[tuple(bits)])
+
+    def test_factories(self):
+        for sparse, dense in [(qc.zeros(3, sparse=True), qc.zeros(3)),
+                              (qc.ones(3, sparse=True), qc.ones(3)),
+                              (qc.bitstring(1, 0, 1, 1, sparse=True), qc.bitstring(1, 0, 1, 1))]:
+            self.assertIsInstance(sparse, qc.SparseState)
+            self.assertLess(max_absolute_difference(sparse.to_state(), dense), epsilon)
+
+        y = random_state(3)
+        x = qc.SparseState.from_state(y, densify_threshold=1.0)
+        self.assertEqual(x.nnz, 8)
+        self.assertLess(max_absolute_difference(x.to_state(), y), epsilon)
+
+    def test_densify(self):
+        x = qc.zeros(6, sparse=True)
+        qc.Hadamard()(x, [0], inplace=True)
+        qc.Hadamard()(x, [1], inplace=True)
+        self.assertFalse(x.dense)
+        qc.Hadamard()(x, [2], inplace=True)
+        self.assertTrue(x.dense)
+        self.assertEqual(x.nnz, 8)
+        assert_allclose(x.indices, np.arange(8) * 8)
+
+        # Cancelling amplitudes are dropped
+        x = qc.Hadamard()(qc.Hadamard()(qc.zeros(6, sparse=True), [3]), [3])
+        self.assertEqual(x.nnz, 1)
+
+    def test_many_qubits(self):
+        d = 45
+        x = qc.zeros(d, sparse=True)
+        qc.Hadamard()(x, [0], inplace=True)
+        for i in range(d - 1):
+            qc.CNOT()(x, [i, i + 1], inplace=True)
+        qc.Toffoli()(x, [0, 1, 2], inplace=True)
+        self.assertEqual(list(x.indices), [0, 2**d - 1 - 2**(d - 3)])
+        self.assertAlmostEqual(abs(x.amplitude([1, 1, 0] + [1] * (d - 3)))**2, 0.5)
+
+        y = qc.U_f(lambda a, b: a ^ b, 3)(x, [0, 2, d - 1])
+        self.assertEqual(y.nnz, 2)
+
+        outcomes = x.measure(rng=np.random.default_rng(1))
+        self.assertEqual(len(set(outcomes[3:])), 1)
+        self.assertEqual(x.measure(), outcomes)
+
+    def test_tensor_powers_on_many_qubits(self):
+        # Tensor powers are applied factor by factor, without expanding
+        # them to 2^d entries
+        d = 45
+        x = qc.PauliX(d)(qc.zeros(d, sparse=True))
+        self.assertEqual(list(x.indices), [2**d - 1])
+        x = qc.PauliZ(d)(qc.Hadamard()(x, [0]))
+        x = qc.CNOT()(x, [0, d - 1])
+        self.assertEqual(list(x.indices), [2**(d - 1) - 1, 2**d - 2])
+        self.assertAlmostEqual(x.amplitude([0] + [1] * (d - 1)), (-1)**(d - 1) / np.sqrt(2))
+        self.assertAlmostEqual(x.amplitude([1] * (d - 1) + [0]), -(-1)**d / np.sqrt(2))
+
+    def test_renormalization(self):
+        # States are renormalized after non-unitary operators, both while
+        # sparse and once dense
+        A = qc.Operator.from_matrix(np.diag([1.0, 2.0]))
+        for densify_threshold in [1.0, 0.0]:
+            x = qc.SparseState.from_state(qc.positive_superposition(3), densify_threshold)
+            y = qc.positive_superposition(3)
+            for Op in [A, qc.Hadamard(), A, qc.RotationY(0.3)]:
+                x = Op(x, [1])
+                y = Op(y, [1])
+            self.assertEqual(x.dense, densify_threshold == 0.0)
+            self.assertLess(max_absolute_difference(x.to_state(), y), epsilon)
+
+    def test_circuits(self):
+        circuit = qc.Circuit(4)
+        circuit.add(qc.PauliX(), [0]).add(qc.CNOT(), [0, 3]).add(qc.Toffoli(), [0, 3, 2])
+        circuit.add(qc.Hadamard(), [1])
+        expected = circuit(qc.zeros(4))
+        for f in [circuit, circuit.compile(), circuit.compile(max_width=None)]:
+            x = f(qc.zeros(4, sparse=True))
+            self.assertLess(max_absolute_difference(x.to_state(), expected), epsilon)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            qc.SparseState(3, [0, 8])
+        with self.assertRaises(ValueError):
+            qc.SparseState(3, [1, 1])
+        with self.assertRaises(ValueError):
+            qc.SparseState(63)
+
+
+class ProductStateTests(unittest.TestCase):
+
+    gates = [qc.PauliX(), qc.CNOT(), qc.Toffoli(), qc.Hadamard(), qc.Phase(),
+             qc.RotationY(0.4), qc.Swap(), qc.QFT(2), qc.Hadamard() * qc.PauliX()]
+
+    def test_matches_state_vector(self):
+        for test_i in range(20):
+            d = np.random.randint(1, 7)
+            x = qc.ProductState(d)
+            y = qc.zeros(d)
+
+            for step in range(12):
+                op = self.gates[np.random.randint(len(self.gates))]
+                op_d = op.rank // 2
+                if op_d > d:
+                    continue
+                qubit_indices = np.random.choice(d, size=op_d, replace=False)
+                x = op(x, qubit_indices)
+                y = op(y, qubit_indices)
+
+                if np.random.rand() < 0.2:
+                    i = np.random.randint(d)
+                    seed = np.random.randint(2**30)
+                    self.assertEqual(x.measure(int(i), rng=seed),
+                                     y.measure(int(i), rng=seed))
+
+            self.assertLess(max_absolute_difference(x.to_state(), y), epsilon)
+            bits = np.random.randint(2, size=d)
+            self.assertAlmostEqual(x.amplitude(bits), y[tuple(bits)])
+
+    def test_clusters(self):
+        x = qc.ProductState(5)
+        self.assertEqual(x.clusters, [(0,), (1,), (2,), (3,), (4,)])
+        x = qc.CNOT()(qc.Hadamard()(x, [0]), [0, 3])
+        x = qc.Hadamard(d=2)(x, [1, 2])
+        self.assertEqual(x.clusters, [(0, 3), (1,), (2,), (4,)])
+        x = qc.SqrtSwap()(x, [3, 4])
+        self.assertEqual(x.clusters, [(0, 3, 4), (1,), (2,)])
+
+        # Measured qubits are split off
+        x.measure(3)
+        self.assertEqual(x.clusters, [(0, 4), (1,), (2,), (3,)])
+
+    def test_from_states(self):
+        states = [random_state(2), qc.ones(1), random_state(3)]
+        x = qc.ProductState.from_states(states)
+        self.assertEqual(x.clusters, [(0, 1), (2,), (3, 4, 5)])
+        expected = states[0] * states[1] * states[2]
+        self.assertLess(max_absolute_difference(x.to_state(), expected), epsilon)
+
+        y = x * qc.ProductState(2)
+        self.assertEqual(y.rank, 8)
+        self.assertEqual(y.clusters[-2:], [(6,), (7,)])
+
+        # A State on the left keeps its qubits as one cluster
+        y = states[0] * qc.ProductState(2)
+        self.assertIsInstance(y, qc.ProductState)
+        self.assertEqual(y.clusters, [(0, 1), (2,), (3,)])
+        with self.assertRaises(TypeError):
+            states[0].tensor_product(qc.ProductState(2))
+
+    def test_renormalization(self):
+        # Clusters are renormalized after non-unitary operators
+        A = qc.Operator.from_matrix(np.diag([1.0, 2.0]))
+        x = qc.Hadamard(3)(qc.ProductState(3))
+        y = qc.positive_superposition(3)
+        for Op in [A, qc.Hadamard(), A]:
+            x = Op(x, [1])
+            y = Op(y, [1])
+        self.assertLess(max_absolute_difference(x.to_state(), y), epsilon)
+
+    def test_many_qubits(self):
+        d = 200
+        circuit = qc.Circuit(d)
+        for i in range(0, d, 4):
+            circuit.add(qc.Hadamard(), [i]).add(qc.CNOT(), [i, i + 1])
+            circuit.add(qc.CNOT(), [i + 1, i + 2]).add(qc.RotationX(0.3), [i + 3])
+
+        for f in [circuit, circuit.compile(), circuit.compile(max_width=None)]:
+            x = f(qc.ProductState(d))
+            self.assertEqual(len(x.clusters), d // 2)
+            outcomes = x.measure(rng=np.random.default_rng(1))
+            self.assertTrue(all(outcomes[i] == outcomes[i + 1] == outcomes[i + 2]
+                                for i in range(0, d, 4)))
+            self.assertEqual(len(x.clusters), d)
+
+    def test_tensor_powers_on_many_qubits(self):
+        # Tensor powers are applied to each qubit's cluster separately
+        for Op in [qc.PauliX(6), qc.Phase(6), qc.Hadamard(6)]:
+            x = Op(qc.ProductState(8), [7, 0, 2, 4, 6, 1])
+            y = Op(qc.zeros(8), [7, 0, 2, 4, 6, 1])
+            self.assertEqual(len(x.clusters), 8)
+            self.assertLess(max_absolute_difference(x.to_state(), y), epsilon)
+
+        d = 40
+        x = qc.Phase(d)(qc.PauliX(d)(qc.ProductState(d)))
+        self.assertEqual(len(x.clusters), d)
+        self.assertAlmostEqual(x.amplitude([1] * d), 1j**d)
+
+
 sys.path.append('../examples')
 from itertools import product
 from deutsch_algorithm import deutsch_algorithm
@@ -1296,7 +3142,7 @@ from quantum_teleportation import quantum_teleportation
 from superdense_coding import superdense_coding
 import produce_bell_states
 import quantum_parallelism
-from phase_estimation import phase_estimation
+from phase_estimation import phase_estimation, QFT
 import grover_algorithm
 
 def deutsch_function(L):